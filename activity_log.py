@@ -0,0 +1,259 @@
+"""Asynchronous, batched writer for ``activity_log``.
+
+Request handlers call ``log`` which only appends to an in-memory queue; a
+background thread writes the queue with one ``executemany`` per batch, either
+when ``batch_size`` events are waiting or every ``flush_interval`` seconds.
+Pending events are flushed at interpreter exit.
+
+The queue is bounded by ``max_queue``. When it is full the overflow policy
+decides what happens to a new event:
+
+  drop_oldest  discard the oldest queued event (default; logging never blocks)
+  drop_newest  discard the new event
+  block        wait for the writer to make room
+
+``recent_activity`` merges events that are still queued with the rows already
+in the table, so readers never miss an event that has not been flushed yet.
+A batch that fails to write goes back to the front of the queue and is
+retried on the next flush.
+"""
+import atexit
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+from db_pool import get_pool
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+INSERT_SQL = 'INSERT INTO activity_log (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)'
+
+_writers = {}
+_writers_lock = threading.Lock()
+_writer_options = {}
+
+
+def _now():
+    # Same format and clock (UTC) as CURRENT_TIMESTAMP, so buffered and stored events sort together
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class ActivityLogWriter:
+    def __init__(self, db_path, batch_size=100, flush_interval=1.0, max_queue=10000,
+                 overflow='drop_oldest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow!r}; expected one of {OVERFLOW_POLICIES}')
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.max_queue = max(1, int(max_queue))
+        self.overflow = overflow
+
+        self._pending = deque()
+        # Taken off the queue but not committed yet; still visible to readers
+        self._inflight = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        # One flush at a time (the writer thread and close())
+        self._flush_lock = threading.Lock()
+        # Bumped as a batch starts to commit; readers retry if it moved (see read_with_buffer)
+        self._commits = 0
+        self._committing = False
+        self._committed = threading.Condition(self._lock)
+        self._closed = False
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, user_id, action, details=None):
+        """Queue an event; returns False if the overflow policy dropped it"""
+        event = (user_id, action, details, _now())
+        with self._lock:
+            if len(self._pending) >= self.max_queue:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.overflow == 'drop_oldest':
+                    self._pending.popleft()
+                    self.dropped += 1
+                else:
+                    self._wake.notify()
+                    while len(self._pending) >= self.max_queue and not self._closed:
+                        self._space.wait()
+            self._pending.append(event)
+            self.logged += 1
+            if len(self._pending) >= self.batch_size:
+                self._wake.notify()
+        return True
+
+    def flush(self):
+        """Write everything queued so far; returns the number of events written"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+                self._inflight = batch
+                self._space.notify_all()
+            if not batch:
+                return 0
+
+            written = 0
+            try:
+                conn = self.pool.acquire()
+                try:
+                    with self._lock:
+                        self._commits += 1
+                        self._committing = True
+                    conn.executemany(INSERT_SQL, batch)
+                    conn.commit()
+                    written = len(batch)
+                finally:
+                    # Rolls back a batch that was not committed
+                    conn.close()
+            except sqlite3.Error as e:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+            finally:
+                with self._lock:
+                    if not written:
+                        # Put the batch back in front of newer events; retried on the next flush
+                        self._pending.extendleft(reversed(batch))
+                        while len(self._pending) > self.max_queue:
+                            self._pending.popleft()
+                            self.dropped += 1
+                    self._inflight = []
+                    self._committing = False
+                    self.written += written
+                    self._committed.notify_all()
+            return written
+
+    def close(self):
+        """Stop the writer thread after a final flush"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+            self._space.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def buffered(self, limit=None):
+        """Unwritten events, newest first, as (user_id, action, details, timestamp)"""
+        with self._lock:
+            events = self._inflight + list(self._pending)
+        events.reverse()
+        return events[:limit] if limit is not None else events
+
+    def read_with_buffer(self, read, limit=None):
+        """(buffered(limit), read()) with no batch committed in between.
+
+        ``read`` (a query of the table) runs without any lock held and is
+        repeated if a batch started to commit meanwhile, so each event shows
+        up in exactly one of the two.
+        """
+        while True:
+            with self._lock:
+                while self._committing:
+                    self._committed.wait()
+                commits = self._commits
+                events = self._inflight + list(self._pending)
+            rows = read()
+            with self._lock:
+                if self._commits == commits:
+                    break
+        events.reverse()
+        return (events[:limit] if limit is not None else events), rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                'db_path': self.db_path,
+                'queued': len(self._pending) + len(self._inflight),
+                'logged': self.logged,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'max_queue': self.max_queue,
+                'overflow': self.overflow,
+            }
+
+    def _run(self):
+        failed = False
+        while True:
+            with self._lock:
+                # After a failure wait out the interval even with a full batch queued
+                if not self._closed and (failed or len(self._pending) < self.batch_size):
+                    self._wake.wait(self.flush_interval)
+                closed = self._closed
+                errors = self.errors
+            if closed:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                # The batch is already back in the queue; the thread must outlive any error
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+            failed = self.errors > errors
+
+
+def configure(**options):
+    """Set default ActivityLogWriter options for writers created later"""
+    _writer_options.update(options)
+
+
+def get_writer(db_path):
+    """Return the process-wide writer for ``db_path``, creating it on first use"""
+    writer = _writers.get(db_path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(db_path)
+            if writer is None:
+                writer = _writers[db_path] = ActivityLogWriter(db_path, **_writer_options)
+    return writer
+
+
+def all_stats():
+    return [writer.stats() for writer in list(_writers.values())]
+
+
+def recent_activity(writer, conn, sql, limit=10):
+    """Latest events as dicts, including ones still queued in ``writer``.
+
+    ``sql`` selects (timestamp, action, username, details) newest first with a
+    LIMIT ? placeholder.
+    """
+    buffered, rows = writer.read_with_buffer(lambda: conn.execute(sql, (limit,)).fetchall(), limit)
+
+    usernames = {}
+    user_ids = sorted({event[0] for event in buffered})
+    if user_ids:
+        placeholders = ', '.join('?' * len(user_ids))
+        usernames = dict(conn.execute(f'SELECT id, username FROM users WHERE id IN ({placeholders})',
+                                      user_ids).fetchall())
+
+    activities = [(timestamp, action, usernames.get(user_id), details)
+                  for user_id, action, details, timestamp in buffered]
+    activities += [tuple(row) for row in rows]
+    activities.sort(key=lambda activity: activity[0] or '', reverse=True)
+    return [{
+        'time': activity[0],
+        'action': activity[1],
+        'user': activity[2],
+        'details': activity[3]
+    } for activity in activities[:limit]]
@@ -1,42 +1,96 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-import tensorflow as tf
-from PIL import Image
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, has_app_context, \
+    Response, stream_with_context, send_file
 import numpy as np
+import hashlib
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+from werkzeug.security import generate_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import click
+from batch_scans import iter_uploads, summarize_study
+from blob_store import BlobStore, BackgroundWriter, migrate_uploads
+import activity_log
+import bulk_export
+import calibration
+import db_pool
+import embedding_index
+import explanations
+import legacy_import
+import metrics
+import migrations
+import patient_attributes
+import probabilities
+import scan_images
+import stats
+import tta
+from config import Config
+from database import Database, RECENT_ACTIVITY_SQL
+from export_model import export_model_command
+from inference import BatchingEngine
+from jobs import JobQueue, QueueFull
+from model_registry import ModelRegistry
+from pagination import InvalidCursor, fetch_page, keyset_query, page_size
+from passwords import needs_rehash, verify_password
+from prediction_cache import PredictionCache, hash_image_bytes
+from query_plan import check_query_plans, hot_query
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE, decode_pixels
+from worker_pool import InferenceProcessPool
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key
-
-# Load the trained model
-model = tf.keras.models.load_model('models/Resnet50_best_model.keras')
+# Larger request bodies are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_CONTENT_LENGTH
+
+# Stage, SQL and HTTP timings for /metrics; with this off the timers are no-ops
+metrics.configure(Config.METRICS_ENABLED)
+
+# Every module shares one bounded pool of tuned connections per database file
+db_pool.configure(max_size=Config.DB_POOL_SIZE, timeout=Config.DB_POOL_TIMEOUT)
+activity_log.configure(batch_size=Config.ACTIVITY_LOG_BATCH_SIZE,
+                       flush_interval=Config.ACTIVITY_LOG_FLUSH_INTERVAL,
+                       max_queue=Config.ACTIVITY_LOG_QUEUE_MAX,
+                       overflow=Config.ACTIVITY_LOG_OVERFLOW)
+patient_attributes.configure(ttl=Config.PATIENT_ATTRIBUTE_CACHE_TTL,
+                             max_entries=Config.PATIENT_ATTRIBUTE_CACHE_MAX_ENTRIES)
+
+CLASS_NAMES = probabilities.CLASS_NAMES
+
+# The trained model is loaded lazily; TensorFlow is not imported until then
+if Config.INFERENCE_BACKEND == 'process':
+    # This process only dispatches; the model lives in per-core worker processes
+    registry = ModelRegistry(Config.MODEL_PATH, runtime=Config.MODEL_RUNTIME,
+                             loader=partial(InferenceProcessPool,
+                                            runtime=Config.MODEL_RUNTIME,
+                                            processes=Config.INFERENCE_PROCESSES,
+                                            capacity=Config.INFERENCE_MAX_BATCH_SIZE,
+                                            intra_op_threads=Config.INFERENCE_INTRA_OP_THREADS,
+                                            inter_op_threads=Config.INFERENCE_INTER_OP_THREADS,
+                                            timeout=Config.INFERENCE_WORKER_TIMEOUT))
+    inference_workers = Config.INFERENCE_PROCESSES
+else:
+    registry = ModelRegistry(Config.MODEL_PATH, runtime=Config.MODEL_RUNTIME)
+    inference_workers = 1
+
+# Concurrent /predict requests share forward passes through the batching engine;
+# each returns the class probabilities and the embedding used for similar-scan search
+engine = BatchingEngine(registry.predict_features,
+                        max_batch_size=Config.INFERENCE_MAX_BATCH_SIZE,
+                        max_wait_ms=Config.INFERENCE_MAX_WAIT_MS,
+                        workers=inference_workers)
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('database.db')
+    conn = db_pool.get_pool('database.db').acquire()
+    # One schema for app.py and database.py, see migrations.py
+    migrations.ensure_schema(conn)
     c = conn.cursor()
 
-    # Create users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  email TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  role TEXT NOT NULL DEFAULT 'patient',
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-
-    # Create scans table
-    c.execute('''CREATE TABLE IF NOT EXISTS scans
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  image_path TEXT NOT NULL,
-                  prediction TEXT NOT NULL,
-                  confidence REAL NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (user_id) REFERENCES users (id))''')
-
     # Create default admin user if not exists
     try:
         c.execute('''INSERT INTO users (username, email, password, role)
@@ -48,18 +102,203 @@ def init_db():
     except sqlite3.IntegrityError:
         print("Admin user already exists")
 
+    conn.commit()
     conn.close()
 
 
 # Initialize database
 init_db()
 
+# Audit events are queued and written in batches off the request path
+activity = activity_log.get_writer('database.db')
+
+# Next checkup and doctor's notes, shared with database.Database
+attributes = patient_attributes.get_cache('database.db')
+
+# Repeat uploads of the same image skip preprocessing and inference
+prediction_cache = PredictionCache('database.db', max_entries=Config.PREDICTION_CACHE_MAX_ENTRIES,
+                                   touch_interval=Config.PREDICTION_CACHE_TOUCH_INTERVAL)
+
+# Uploads are stored once per distinct image content
+blob_store = BlobStore(Config.BLOB_STORE_ROOT)
+blob_writer = BackgroundWriter(blob_store, max_workers=Config.BLOB_WRITER_THREADS)
+
+# Derived from scan_embeddings; appended to as scans are recorded
+similar_scans = embedding_index.EmbeddingIndex(Config.EMBEDDING_INDEX_DIR, 'database.db')
+# New scans are appended on this thread, never while a request holds its connection
+index_sync = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-index-sync')
+index_sync_queued = threading.Event()
+
+# Thumbnails and previews are rendered once per image, right after upload
+derivatives = scan_images.DerivativeStore(Config.BLOB_STORE_ROOT, Config.SCAN_IMAGE_VARIANTS,
+                                          quality=Config.SCAN_IMAGE_QUALITY)
+derivative_writer = scan_images.DerivativeWriter(derivatives, max_workers=Config.DERIVATIVE_WRITER_THREADS)
+
+# Grad-CAM maps are computed in background batches and cached per image and model version
+explanation_cache = explanations.ExplanationCache('database.db')
+explainer = explanations.Explainer(registry.explain, explanation_cache,
+                                   max_batch_size=Config.EXPLANATION_MAX_BATCH_SIZE,
+                                   max_wait_ms=Config.EXPLANATION_MAX_WAIT_MS,
+                                   max_pending=Config.EXPLANATION_MAX_PENDING)
+
+# Temperatures from `flask calibrate`, applied to every served probability vector
+calibrator = calibration.Calibration(Config.CALIBRATION_PATH, Config.MODEL_PATH)
+
+# A shift the images cannot take would fail every TTA request; refuse to start instead
+tta.check_shift(Config.TTA_SHIFT_PIXELS, INPUT_SIZE)
+
+# Batch uploads decode their images in parallel
+decode_pool = ThreadPoolExecutor(max_workers=Config.DECODE_THREADS, thread_name_prefix='decode')
+
+PREDICTIONS = metrics.Counter('alzdx_predictions_total', 'Scans classified', ['source', 'mode'])
+HTTP_REQUESTS = metrics.Counter('alzdx_http_requests_total', 'HTTP requests served',
+                                ['endpoint', 'method', 'status'])
+HTTP_SECONDS = metrics.Histogram('alzdx_http_request_seconds', 'HTTP request latency', ['endpoint'])
+
+# Read at scrape time only
+metrics.Callback('alzdx_model_loaded', 'Whether the model is loaded and serving (1) or not (0)',
+                 lambda: int(registry.is_ready()))
+metrics.Callback('alzdx_model_load_seconds', 'How long loading the model took',
+                 lambda: registry.status()['load_seconds'])
+metrics.Callback('alzdx_inference_queue_depth', 'Images waiting for a micro-batch', lambda: engine.queue_depth())
+metrics.Callback('alzdx_scan_job_queue_depth', 'Scan jobs queued or running in this process',
+                 lambda: job_queue.depth())
+metrics.Callback('alzdx_explanation_queue_depth', 'Grad-CAM maps waiting to be computed',
+                 lambda: explainer.stats()['pending'])
+metrics.Callback('alzdx_activity_log_queue_depth', 'Audit events waiting to be written',
+                 lambda: activity.stats()['queued'])
+metrics.Callback('alzdx_db_pool_connections', 'Pooled SQLite connections', lambda: {
+    (os.path.basename(s['db_path']), state): s[state] for s in db_pool.all_stats() for state in ('in_use', 'idle')
+}, labelnames=['db', 'state'])
+metrics.Callback('alzdx_prediction_cache_lookups_total', 'Prediction cache lookups', lambda: {
+    ('hit',): prediction_cache.hits, ('miss',): prediction_cache.misses,
+}, labelnames=['result'], type='counter')
+
 
 # Helper function to get database connection
 def get_db():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Pooled connection for the current request, released on teardown.
+
+    One connection per request: pass it to helpers that take a ``conn``
+    rather than letting them check out another one while this is held.
+    Outside a request (job workers, CLI) the caller gets its own pooled
+    connection and must close() it to hand it back.
+    """
+    if not has_app_context():
+        return db_pool.get_pool('database.db').acquire(row_factory=sqlite3.Row)
+    if 'db' not in g:
+        g.db = db_pool.get_pool('database.db').acquire(row_factory=sqlite3.Row)
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(e=None):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+INSERT_SCAN_SQL = ('INSERT INTO scans (user_id, image_path, prediction, confidence, probabilities) '
+                   'VALUES (?, ?, ?, ?, ?)')
+
+# Hot queries; `flask check-query-plans` fails if any of them needs a full table scan
+LOGIN_USER_SQL = hot_query('database.db', 'login_user',
+                           'SELECT * FROM users WHERE username = ? AND role = ?', ('admin', 'admin'))
+PATIENT_SCANS_QUERY = keyset_query('database.db', 'patient_scans', '''SELECT * FROM scans
+                         WHERE user_id = ? {after}
+                         ORDER BY created_at DESC, id DESC
+                         LIMIT ?''', 'created_at, id', (1,))
+RECENT_SCANS_SQL = hot_query('database.db', 'recent_scans', '''
+        SELECT s.*, u.username, u.email
+        FROM scans s
+        JOIN users u ON s.user_id = u.id
+        ORDER BY s.created_at DESC
+        LIMIT ?''', (10,))
+PATIENT_LIST_QUERY = keyset_query('database.db', 'patient_list', '''
+        SELECT u.*, COALESCE(c.scans, 0) as scan_count
+        FROM users u
+        LEFT JOIN user_scan_counts c ON c.user_id = u.id
+        WHERE u.role = 'patient' {after}
+        ORDER BY u.created_at DESC, u.id DESC
+        LIMIT ?''', 'u.created_at, u.id')
+
+
+def patient_scans_page(db, user_id):
+    """One page of a patient's scans for the ?cursor=&limit= of the current request"""
+    limit = page_size(request.args.get('limit'), Config.PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    return fetch_page(db, PATIENT_SCANS_QUERY, (user_id,), request.args.get('cursor'), limit)
+
+
+def patients_page(db):
+    """One page of patients as dicts, with their attributes loaded in a single query"""
+    limit = page_size(request.args.get('limit'), Config.PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    page = fetch_page(db, PATIENT_LIST_QUERY, (), request.args.get('cursor'), limit)
+    loaded = attributes.get_many([row['id'] for row in page.items], db)
+    patients = []
+    for row in page.items:
+        patient = dict(row)
+        patient.pop('password', None)
+        patient.update(loaded[row['id']])
+        patients.append(patient)
+    return page._replace(items=patients)
+
+
+if Config.METRICS_ENABLED:
+    # Only registered when enabled, so a disabled build adds nothing per request
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_SECONDS.observe(time.perf_counter() - started, endpoint)
+            HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of this process's metrics"""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {Config.METRICS_TOKEN}':
+        return jsonify({'error': 'Invalid metrics token'}), 401
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    message = f'Uploads may be at most {Config.MAX_CONTENT_LENGTH // (1024 * 1024)} MB per request'
+    if request.endpoint == 'predict':
+        flash(message, 'danger')
+        return redirect(url_for('dashboard'))
+    return jsonify({'error': message}), 413
+
+
+@app.before_first_request
+def warm_up_model():
+    if Config.MODEL_WARMUP:
+        registry.warm_up()
+
+
+@app.before_first_request
+def start_job_workers():
+    # Resumes any jobs left queued or running by a previous process
+    job_queue.start()
+
+
+@app.route('/healthz/ready')
+def healthz_ready():
+    status = registry.status()
+    return jsonify(status), 200 if registry.is_ready() else 503
 
 
 @app.route('/')
@@ -71,6 +310,16 @@ def index():
     return render_template('index.html')
 
 
+def check_login(db, user, password):
+    """Verify a password, upgrading accounts imported with a legacy SHA-256 digest"""
+    if not verify_password(user['password'], password):
+        return False
+    if needs_rehash(user['password']):
+        db.execute('UPDATE users SET password = ? WHERE id = ?', (generate_password_hash(password), user['id']))
+        db.commit()
+    return True
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -78,10 +327,9 @@ def login():
         password = request.form['password']
 
         db = get_db()
-        user = db.execute('SELECT * FROM users WHERE username = ? AND role = "patient"',
-                          (username,)).fetchone()
+        user = db.execute(LOGIN_USER_SQL, (username, 'patient')).fetchone()
 
-        if user and check_password_hash(user['password'], password):
+        if user and check_login(db, user, password):
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
@@ -98,10 +346,9 @@ def admin_login():
         password = request.form['password']
 
         db = get_db()
-        user = db.execute('SELECT * FROM users WHERE username = ? AND role = "admin"',
-                          (username,)).fetchone()
+        user = db.execute(LOGIN_USER_SQL, (username, 'admin')).fetchone()
 
-        if user and check_password_hash(user['password'], password):
+        if user and check_login(db, user, password):
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
@@ -136,8 +383,6 @@ def register():
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             flash('Username or email already exists', 'danger')
-        finally:
-            db.close()
 
     return render_template('register.html')
 
@@ -154,14 +399,142 @@ def dashboard():
         return redirect(url_for('login'))
 
     db = get_db()
-    scans = db.execute('''SELECT * FROM scans 
-                         WHERE user_id = ? 
-                         ORDER BY created_at DESC''',
-                       (session['user_id'],)).fetchall()
+    page = patient_scans_page(db, session['user_id'])
 
     return render_template('patient_dashboard.html',
                            username=session['username'],
-                           scans=scans)
+                           scans=page.items,
+                           next_cursor=page.next_cursor,
+                           total_scans=stats.user_scan_count(db, session['user_id']))
+
+
+@app.route('/scans')
+def list_scans():
+    """JSON scan history, newest first; follow next_cursor for older scans"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    user_id = session['user_id']
+    if session.get('role') == 'admin':
+        user_id = request.args.get('user_id', user_id, type=int)
+
+    db = get_db()
+    page = patient_scans_page(db, user_id)
+    matrix = probabilities.decode_many([row['probabilities'] for row in page.items])
+    scans = [dict(row, probabilities=None if np.isnan(vector).any() else probabilities.as_dict(vector))
+             for row, vector in zip(page.items, matrix)]
+    return jsonify({'scans': scans,
+                    'next_cursor': page.next_cursor,
+                    'total': stats.user_scan_count(db, user_id)})
+
+
+@app.route('/scans/<int:scan_id>/image', defaults={'variant': scan_images.ORIGINAL})
+@app.route('/scans/<int:scan_id>/image/<variant>')
+def scan_image(scan_id, variant):
+    """A scan image (original, or a variant from Config.SCAN_IMAGE_VARIANTS) with strong, immutable caching"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    if variant != scan_images.ORIGINAL and variant not in derivatives.variants:
+        return jsonify({'error': f'Unknown image variant {variant!r}'}), 404
+
+    scan = get_db().execute('SELECT user_id, image_path FROM scans WHERE id = ?', (scan_id,)).fetchone()
+    if scan is None or (session.get('role') != 'admin' and scan['user_id'] != session['user_id']):
+        return jsonify({'error': 'Scan not found'}), 404
+    # /predict stores uploads in the background; the page may ask before the write lands
+    blob_writer.wait(scan['image_path'])
+    if not os.path.exists(scan['image_path']):
+        return jsonify({'error': 'Scan image missing'}), 404
+
+    digest = scan_images.digest_for(scan['image_path'])
+    etag = derivatives.etag(digest, variant)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        path = scan['image_path'] if variant == scan_images.ORIGINAL else \
+            derivatives.ensure(digest, variant, scan['image_path'])
+        response = send_file(os.path.abspath(path), conditional=False, etag=False)
+    response.set_etag(etag)
+    # private: scans are patient data and must not sit in shared caches
+    response.headers['Cache-Control'] = f'private, max-age={Config.SCAN_IMAGE_MAX_AGE}, immutable'
+    return response
+
+
+@app.route('/scans/<int:scan_id>')
+def scan_detail(scan_id):
+    """A scan with its class probabilities and, once computed, the Grad-CAM overlay"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    scan = get_db().execute('SELECT s.*, u.username FROM scans s LEFT JOIN users u ON u.id = s.user_id '
+                            'WHERE s.id = ?', (scan_id,)).fetchone()
+    if scan is None or (session.get('role') != 'admin' and scan['user_id'] != session['user_id']):
+        flash('Scan not found', 'danger')
+        return redirect(url_for('index'))
+
+    vector = probabilities.decode(scan['probabilities'])
+    return render_template('scan_detail.html', scan=scan,
+                           probabilities=None if np.isnan(vector).any() else probabilities.as_dict(vector))
+
+
+def explanation_key(scan):
+    """(image hash, model version, class index) the scan's Grad-CAM map is cached under, or None"""
+    if scan['prediction'] not in CLASS_NAMES:
+        return None
+    return (scan_images.digest_for(scan['image_path']), registry.version(),
+            CLASS_NAMES.index(scan['prediction']))
+
+
+@app.route('/scans/<int:scan_id>/explanation')
+def scan_explanation(scan_id):
+    """Grad-CAM state of a scan, queueing the map if needed; 202 while it is being computed"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    scan = get_db().execute('SELECT user_id, image_path, prediction FROM scans WHERE id = ?',
+                            (scan_id,)).fetchone()
+    if scan is None or (session.get('role') != 'admin' and scan['user_id'] != session['user_id']):
+        return jsonify({'error': 'Scan not found'}), 404
+    blob_writer.wait(scan['image_path'])
+    if not os.path.exists(scan['image_path']):
+        return jsonify({'error': 'Scan image missing'}), 404
+    key = explanation_key(scan)
+    if key is None:
+        return jsonify({'error': f"No class to explain for prediction {scan['prediction']!r}"}), 404
+
+    state = explainer.request(*key, scan['image_path'], conn=get_db())
+    state.pop('heatmap', None)
+    state['class'] = scan['prediction']
+    if state['status'] == explanations.READY:
+        state['overlay_url'] = url_for('scan_explanation_overlay', scan_id=scan_id)
+    return jsonify(state), 202 if state['status'] == explanations.PENDING else 200
+
+
+@app.route('/scans/<int:scan_id>/explanation.png')
+def scan_explanation_overlay(scan_id):
+    """The cached Grad-CAM map as a transparent overlay; 404 until it has been computed"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    scan = get_db().execute('SELECT user_id, image_path, prediction FROM scans WHERE id = ?',
+                            (scan_id,)).fetchone()
+    if scan is None or (session.get('role') != 'admin' and scan['user_id'] != session['user_id']):
+        return jsonify({'error': 'Scan not found'}), 404
+    blob_writer.wait(scan['image_path'])
+    key = explanation_key(scan) if os.path.exists(scan['image_path']) else None
+    cached = explanation_cache.get(*key, conn=get_db()) if key else None
+    if cached is None:
+        return jsonify({'error': 'Explanation not computed yet'}), 404
+
+    # Changes with the model, so revalidated on every view rather than cached as immutable
+    etag = hashlib.sha256(f'{key}:{Config.EXPLANATION_OVERLAY_SIZE}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(explanations.render_overlay(cached[0], size=Config.EXPLANATION_OVERLAY_SIZE),
+                            mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @app.route('/admin/dashboard')
@@ -170,13 +543,9 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
 
     db = get_db()
-    total_patients = db.execute('SELECT COUNT(*) FROM users WHERE role = "patient"').fetchone()[0]
-    total_scans = db.execute('SELECT COUNT(*) FROM scans').fetchone()[0]
-    recent_scans = db.execute('''SELECT s.*, u.username 
-                                FROM scans s 
-                                JOIN users u ON s.user_id = u.id 
-                                ORDER BY s.created_at DESC 
-                                LIMIT 5''').fetchall()
+    total_patients = stats.get_counter(db, 'users.role.patient')
+    total_scans = stats.get_counter(db, 'scans.total')
+    recent_scans = db.execute(RECENT_SCANS_SQL, (5,)).fetchall()
 
     return render_template('admin_dashboard.html',
                            username=session['username'],
@@ -185,6 +554,117 @@ def admin_dashboard():
                            recent_scans=recent_scans)
 
 
+def tta_requested():
+    """Per-request test-time augmentation switch (a tta form field or ?tta=), default Config.TTA_DEFAULT"""
+    value = request.values.get('tta')
+    if value is None:
+        return Config.TTA_DEFAULT
+    return value.lower() in ('1', 'true', 'on', 'yes')
+
+
+def classify_image(data, image_hash, use_tta=False, db=None):
+    """Return (predicted_class, confidence, probabilities, embedding) for one image, using the prediction cache.
+
+    ``db`` is the caller's connection, used for the prediction cache.
+
+    With ``use_tta`` the augmented variants of the image go through the
+    engine as one group, i.e. one forward pass, and their outputs are
+    averaged. ``embedding`` is None when the model runtime does not expose one.
+    """
+    model_version = registry.version()
+    if use_tta:
+        # Never cached: the prediction cache holds single-pass outputs
+        variants = tta.augment(decode_pixels(data), Config.TTA_SHIFT_PIXELS, Config.TTA_INTENSITY_JITTER)
+        with metrics.stage('inference_tta'):
+            outputs, features = engine.predict_many(variants)
+        PREDICTIONS.inc('model', calibration.TTA)
+        prediction = tta.combine(outputs)[0]
+        # The unaugmented image's, so it stays comparable with single-pass embeddings
+        embedding = None if features is None else features[0]
+    else:
+        cached = prediction_cache.lookup(image_hash, model_version, db) if Config.PREDICTION_CACHE_ENABLED else None
+        if cached is not None:
+            prediction, embedding = cached
+            PREDICTIONS.inc('cache', calibration.SINGLE)
+        else:
+            # Decode straight from the upload buffer; scaling happens in the serving graph
+            img_array = decode_pixels(data, timed=True)
+
+            # Make prediction (the engine adds the batch dimension)
+            with metrics.stage('inference'):
+                prediction, embedding = engine.predict(img_array)
+            PREDICTIONS.inc('model', calibration.SINGLE)
+            if Config.PREDICTION_CACHE_ENABLED:
+                prediction_cache.put(image_hash, model_version, prediction, embedding, conn=db)
+
+    # Cached outputs are uncalibrated, so a refitted temperature applies to them too
+    prediction = calibrator.apply(prediction, calibration.TTA if use_tta else calibration.SINGLE)
+    predicted_class = CLASS_NAMES[np.argmax(prediction)]
+    confidence = float(np.max(prediction))
+    return predicted_class, confidence, prediction, embedding
+
+
+def insert_scan(db, user_id, image_path, predicted_class, confidence, prediction, embedding):
+    """Insert a scan and its embedding in the caller's transaction; returns the scan id"""
+    cursor = db.execute(INSERT_SCAN_SQL, (user_id, image_path, predicted_class, confidence,
+                                          probabilities.encode(prediction)))
+    if embedding is not None:
+        embedding_index.store(db, cursor.lastrowid, registry.version(), embedding)
+    return cursor.lastrowid
+
+
+def index_new_scans():
+    """Queue an append of committed embeddings to the similar-scan index.
+
+    At most one sync waits on the index_sync thread at a time; it picks up
+    every row committed before it starts.
+    """
+    if not index_sync_queued.is_set():
+        index_sync_queued.set()
+        index_sync.submit(sync_index)
+
+
+def sync_index():
+    index_sync_queued.clear()
+    try:
+        similar_scans.sync(registry.version())
+    except (OSError, sqlite3.Error) as e:
+        # The table stays authoritative; the next sync picks the rows up
+        app.logger.warning('Embedding index sync failed: %s', e)
+
+
+def queue_explanation(image_hash, predicted_class, source, db=None):
+    """Start the Grad-CAM map of a new scan so it is ready when the scan is opened"""
+    if Config.EXPLAIN_ON_UPLOAD:
+        explainer.request(image_hash, registry.version(), CLASS_NAMES.index(predicted_class), source, db)
+
+
+def process_scan_job(job):
+    """Job queue handler: classify the stored upload and record the scan"""
+    with open(job['image_path'], 'rb') as f:
+        data = f.read()
+    db = get_db()
+    try:
+        predicted_class, confidence, prediction, embedding = classify_image(data, job['image_hash'],
+                                                                            bool(job['tta']), db)
+        with metrics.stage('db_insert'):
+            scan_id = insert_scan(db, job['user_id'], job['image_path'], predicted_class, confidence,
+                                  prediction, embedding)
+        with metrics.stage('db_commit'):
+            db.commit()
+    finally:
+        db.close()
+    index_new_scans()
+    queue_explanation(job['image_hash'], predicted_class, job['image_path'])
+    activity.log(job['user_id'], 'New Scan', f'Scan ID: {scan_id}, Class: {predicted_class}')
+    return {'prediction': predicted_class, 'confidence': confidence, 'scan_id': scan_id}
+
+
+# Asynchronous scan submission: jobs are persisted so they survive restarts
+job_queue = JobQueue('database.db', process_scan_job, workers=Config.JOB_WORKERS,
+                     max_pending=Config.JOB_QUEUE_MAX, lease_seconds=Config.JOB_LEASE_SECONDS)
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
     if 'user_id' not in session:
@@ -200,37 +680,28 @@ def predict():
         return redirect(url_for('dashboard'))
 
     try:
-        # Save the uploaded file
-        upload_dir = os.path.join('static', 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-        file.save(file_path)
-
-        # Preprocess the image
-        img = Image.open(file_path)
-        img = img.resize((128, 128))  # Changed from 224x224 to 128x128
-        img_array = np.array(img) / 255.0
-
-        # Check if image is grayscale and add channel dimension if needed
-        if len(img_array.shape) == 2:  # If grayscale (no channel dimension)
-            img_array = np.expand_dims(img_array, axis=-1)  # Add channel dimension
-            img_array = np.repeat(img_array, 3, axis=-1)  # Convert to 3-channel (RGB)
-        elif img_array.shape[2] == 1:  # If already has channel dim but just 1 channel
-            img_array = np.repeat(img_array, 3, axis=-1)  # Convert to 3-channel
-
-        img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
-
-        # Make prediction
-        prediction = model.predict(img_array)
-        class_names = ['Non-Demented', 'Very Mild Demented', 'Mild Demented', 'Moderate Demented']
-        predicted_class = class_names[np.argmax(prediction)]
-        confidence = float(np.max(prediction))
+        data = file.read()
+        image_hash = hash_image_bytes(data)
+
+        # Save the uploaded file in the background (a no-op if it was stored before)
+        with metrics.stage('upload_save'):
+            file_path = blob_writer.put(data, file.filename, digest=image_hash)
+        derivative_writer.schedule(data, image_hash)
 
-        # Save scan results to database
         db = get_db()
-        db.execute('INSERT INTO scans (user_id, image_path, prediction, confidence) VALUES (?, ?, ?, ?)',
-                   (session['user_id'], file_path, predicted_class, confidence))
-        db.commit()
+        predicted_class, confidence, prediction, embedding = classify_image(data, image_hash, tta_requested(), db)
+        # The write ran alongside inference; a scan row never points at a file that failed to save
+        blob_writer.wait(file_path)
+
+        # Save scan results to database
+        with metrics.stage('db_insert'):
+            scan_id = insert_scan(db, session['user_id'], file_path, predicted_class, confidence,
+                                  prediction, embedding)
+        with metrics.stage('db_commit'):
+            db.commit()
+        index_new_scans()
+        queue_explanation(image_hash, predicted_class, data, db)
+        activity.log(session['user_id'], 'New Scan', f'Scan ID: {scan_id}, Class: {predicted_class}')
 
         flash(f'Scan completed successfully. Result: {predicted_class} (Confidence: {confidence:.2%})', 'success')
 
@@ -239,6 +710,184 @@ def predict():
 
     return redirect(url_for('dashboard'))
 
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    data = file.read()
+    image_hash = hash_image_bytes(data)
+    # Written synchronously: a resumed job must find its input on disk
+    with metrics.stage('upload_save'):
+        image_path = blob_store.put(data, file.filename, digest=image_hash)
+    derivative_writer.schedule(data, image_hash)
+
+    try:
+        job_id = job_queue.submit(session['user_id'], file.filename, image_path, image_hash, tta=tta_requested())
+    except QueueFull as e:
+        response = jsonify({'error': f'Scan queue is full, please retry shortly ({e})'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    return jsonify({'job_id': job_id, 'status': JobQueue.QUEUED,
+                    'status_url': url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    job = job_queue.get(job_id)
+    if job is None or (job['user_id'] != session['user_id'] and session.get('role') != 'admin'):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+def _decode_into(data, out):
+    """Decode into a preallocated batch row, returning the error message on failure"""
+    try:
+        decode_pixels(data, out=out)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def _set_prediction(result, prediction, cached, mode=calibration.SINGLE):
+    prediction = calibrator.apply(prediction, mode)
+    result.update(prediction=CLASS_NAMES[np.argmax(prediction)], confidence=float(np.max(prediction)),
+                  probabilities=probabilities.as_dict(prediction), cached=cached)
+
+
+def predict_images(uploads, use_tta=False, db=None):
+    """Classify a list of (filename, bytes) uploads in model-sized batches.
+
+    Cached images skip decoding entirely; the rest are decoded in parallel on
+    the decode pool straight into a preallocated batch array. With
+    ``use_tta`` every image of a batch is expanded into its augmented
+    variants and the whole stack still goes through one model call. Returns
+    one result dict per upload, in order, and a parallel list of embeddings
+    (None where there is none). ``db`` is used for the prediction cache.
+    """
+    model_version = registry.version()
+    mode = calibration.TTA if use_tta else calibration.SINGLE
+    results = []
+    embeddings = [None] * len(uploads)
+    hashes = []
+    misses = []
+    for index, (filename, data) in enumerate(uploads):
+        image_hash = hash_image_bytes(data)
+        hashes.append(image_hash)
+        result = {'filename': filename, 'image_path': blob_store.path_for(image_hash, filename)}
+        use_cache = Config.PREDICTION_CACHE_ENABLED and not use_tta
+        cached = prediction_cache.lookup(image_hash, model_version, db) if use_cache else None
+        if cached is not None:
+            _set_prediction(result, cached[0], cached=True)
+            embeddings[index] = cached[1]
+            PREDICTIONS.inc('cache', mode)
+        else:
+            misses.append((index, result, image_hash, data))
+        results.append(result)
+
+    batch_size = Config.INFERENCE_MAX_BATCH_SIZE
+    for start in range(0, len(misses), batch_size):
+        chunk = misses[start:start + batch_size]
+        batch = np.empty((len(chunk), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=PIXEL_DTYPE)
+        errors = list(decode_pool.map(_decode_into, [item[3] for item in chunk], batch))
+
+        decoded = []
+        for (index, result, image_hash, _), error in zip(chunk, errors):
+            if error is not None:
+                result['error'] = f'Error processing scan: {error}'
+                del result['image_path']
+            else:
+                decoded.append((index, result, image_hash))
+        if not decoded:
+            continue
+
+        rows = [i for i, error in enumerate(errors) if error is None]
+        images = batch[rows] if len(rows) < len(chunk) else batch
+        if use_tta:
+            variants = tta.augment_batch(images, Config.TTA_SHIFT_PIXELS, Config.TTA_INTENSITY_JITTER)
+            with metrics.stage('batch_inference_tta'):
+                predictions, features = registry.predict_features(variants)
+            predictions = tta.combine(predictions)
+            # Keep the unaugmented images' embeddings
+            features = None if features is None else features[::len(tta.AUGMENTATIONS)]
+        else:
+            with metrics.stage('batch_inference'):
+                predictions, features = registry.predict_features(images)
+        PREDICTIONS.inc('model', mode, amount=len(decoded))
+        for row, (index, result, image_hash) in enumerate(decoded):
+            embeddings[index] = None if features is None else features[row]
+            _set_prediction(result, predictions[row], cached=False, mode=mode)
+            if Config.PREDICTION_CACHE_ENABLED and not use_tta:
+                prediction_cache.put(image_hash, model_version, predictions[row], embeddings[index], conn=db)
+
+    # Only images that decoded are kept in the store
+    for (filename, data), image_hash, result in zip(uploads, hashes, results):
+        if 'prediction' in result:
+            with metrics.stage('batch_upload_save'):
+                blob_writer.put(data, filename, digest=image_hash)
+            derivative_writer.schedule(data, image_hash)
+
+    return results, embeddings
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    try:
+        uploads = list(iter_uploads(request.files.getlist('files'),
+                                    Config.ALLOWED_EXTENSIONS, Config.BATCH_MAX_FILES,
+                                    Config.BATCH_MAX_IMAGE_BYTES, Config.BATCH_MAX_TOTAL_BYTES))
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    if not uploads:
+        return jsonify({'error': 'No image files uploaded'}), 400
+
+    use_tta = tta_requested()
+    db = get_db()
+    try:
+        results, embeddings = predict_images(uploads, use_tta, db)
+    except Exception as e:
+        return jsonify({'error': f'Error processing scans: {str(e)}'}), 500
+
+    for result in results:
+        if 'prediction' in result:
+            try:
+                blob_writer.wait(result['image_path'])
+            except OSError as e:
+                filename = result['filename']
+                result.clear()
+                result.update(filename=filename, error=f'Error saving scan: {e}')
+
+    # All scans of the study are recorded in one transaction
+    with metrics.stage('batch_db_insert'):
+        for result, embedding in zip(results, embeddings):
+            if 'prediction' in result:
+                insert_scan(db, session['user_id'], result['image_path'], result['prediction'],
+                            result['confidence'], result['probabilities'], embedding)
+    with metrics.stage('batch_db_commit'):
+        db.commit()
+    index_new_scans()
+    for (_, data), result in zip(uploads, results):
+        if 'prediction' in result:
+            queue_explanation(scan_images.digest_for(result['image_path']), result['prediction'], data, db)
+    summary = summarize_study(results)
+    activity.log(session['user_id'], 'Batch Scan',
+                 f"Scans: {summary['scans']}, Errors: {summary['errors']}")
+
+    return jsonify({'results': results, 'summary': summary, 'tta': use_tta})
+
+
 @app.route('/admin/add_patient', methods=['GET', 'POST'])
 def admin_add_patient():
     if 'user_id' not in session or session.get('role') != 'admin':
@@ -258,8 +907,6 @@ def admin_add_patient():
             return redirect(url_for('admin_manage_users'))
         except sqlite3.IntegrityError:
             flash('Username or email already exists', 'danger')
-        finally:
-            db.close()
 
     return render_template('admin_add_patient.html')
 
@@ -270,16 +917,23 @@ def admin_manage_users():
         return redirect(url_for('admin_login'))
 
     db = get_db()
-    patients = db.execute('''
-        SELECT u.*, COUNT(s.id) as scan_count 
-        FROM users u 
-        LEFT JOIN scans s ON u.id = s.user_id 
-        WHERE u.role = 'patient' 
-        GROUP BY u.id
-        ORDER BY u.created_at DESC
-    ''').fetchall()
+    page = patients_page(db)
+
+    return render_template('admin_manage_users.html', patients=page.items,
+                           next_cursor=page.next_cursor)
 
-    return render_template('admin_manage_users.html', patients=patients)
+
+@app.route('/admin/patients')
+def admin_list_patients():
+    """JSON patient listing with per-patient scan counts, newest first"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Admin login required'}), 401
+
+    db = get_db()
+    page = patients_page(db)
+    return jsonify({'patients': page.items,
+                    'next_cursor': page.next_cursor,
+                    'total': stats.get_counter(db, 'users.role.patient')})
 
 
 @app.route('/admin/delete_user/<int:user_id>')
@@ -289,11 +943,15 @@ def admin_delete_user(user_id):
 
     db = get_db()
     try:
-        # Delete user's scans first
+        # Delete user's scans (and their embeddings) first
+        db.execute('DELETE FROM scan_embeddings WHERE scan_id IN (SELECT id FROM scans WHERE user_id = ?)',
+                   (user_id,))
         db.execute('DELETE FROM scans WHERE user_id = ?', (user_id,))
         # Then delete the user
         db.execute('DELETE FROM users WHERE id = ? AND role = "patient"', (user_id,))
         db.commit()
+        attributes.clear(user_id, db)
+        activity.log(session['user_id'], 'Delete Patient', f'User ID: {user_id}')
         flash('Patient deleted successfully', 'success')
     except sqlite3.Error as e:
         flash(f'Error deleting patient: {str(e)}', 'danger')
@@ -301,6 +959,59 @@ def admin_delete_user(user_id):
     return redirect(url_for('admin_manage_users'))
 
 
+@app.route('/admin/patients/<int:user_id>/attributes', methods=['POST'])
+def admin_set_patient_attributes(user_id):
+    """Set next_checkup / doctor_notes from a form or JSON body; an empty value clears it"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Admin login required'}), 401
+
+    values = request.get_json(silent=True) or request.form
+    unknown = sorted(set(values) - set(patient_attributes.ATTRIBUTES))
+    if unknown:
+        return jsonify({'error': f'Unknown attributes: {", ".join(unknown)}'}), 400
+    db = get_db()
+    if not db.execute('SELECT 1 FROM users WHERE id = ? AND role = "patient"', (user_id,)).fetchone():
+        return jsonify({'error': 'Patient not found'}), 404
+
+    for name, value in values.items():
+        attributes.set(user_id, name, value or None, db)
+    activity.log(session['user_id'], 'Update Patient', f'User ID: {user_id}, {", ".join(sorted(values))}')
+    return jsonify({'patient_id': user_id, 'attributes': attributes.get(user_id, conn=db)})
+
+
+@app.route('/admin/scans/<int:scan_id>/similar')
+def admin_similar_scans(scan_id):
+    """Past scans that look most like this one, by embedding cosine similarity: ?k=5"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Admin login required'}), 401
+
+    db = get_db()
+    stored = embedding_index.scan_embedding(db, scan_id)
+    if stored is None:
+        return jsonify({'error': 'No embedding stored for this scan'}), 404
+    model_version, query = stored
+    if model_version != registry.version():
+        return jsonify({'error': 'Scan was embedded by a different model version'}), 409
+
+    k = page_size(request.args.get('k'), 5, Config.SIMILAR_SCANS_MAX_K)
+    started = time.perf_counter()
+    similar_scans.sync(model_version, db)
+    # Over-fetch: deleted scans stay in the index files until `flask embedding-index --rebuild`
+    matches = similar_scans.search(query, k=2 * k, nprobe=Config.EMBEDDING_IVF_NPROBE, exclude={scan_id})
+    search_ms = (time.perf_counter() - started) * 1000.0
+
+    ids = [match_id for match_id, _ in matches]
+    placeholders = ', '.join('?' * len(ids))
+    rows = {row['scan_id']: row for row in db.execute(
+        f'''SELECT s.id AS scan_id, s.user_id, u.username, s.prediction, s.confidence, s.created_at
+            FROM scans s LEFT JOIN users u ON u.id = s.user_id
+            WHERE s.id IN ({placeholders})''', ids)} if ids else {}
+    similar = [dict(rows[match_id], similarity=score,
+                    thumbnail_url=url_for('scan_image', scan_id=match_id, variant='thumb'))
+               for match_id, score in matches if match_id in rows][:k]
+    return jsonify({'scan_id': scan_id, 'similar': similar, 'search_ms': search_ms})
+
+
 @app.route('/admin/generate_report')
 def admin_generate_report():
     if 'user_id' not in session or session.get('role') != 'admin':
@@ -309,25 +1020,14 @@ def admin_generate_report():
     db = get_db()
 
     # Get overall statistics
-    total_patients = db.execute('SELECT COUNT(*) FROM users WHERE role = "patient"').fetchone()[0]
-    total_scans = db.execute('SELECT COUNT(*) FROM scans').fetchone()[0]
+    total_patients = stats.get_counter(db, 'users.role.patient')
+    total_scans = stats.get_counter(db, 'scans.total')
 
     # Get diagnosis distribution
-    diagnosis_stats = db.execute('''
-        SELECT prediction, COUNT(*) as count
-        FROM scans
-        GROUP BY prediction
-        ORDER BY count DESC
-    ''').fetchall()
+    diagnosis_stats = stats.class_distribution(db, stats.APP_SCANS)
 
     # Get recent scans with patient details
-    recent_scans = db.execute('''
-        SELECT s.*, u.username, u.email
-        FROM scans s
-        JOIN users u ON s.user_id = u.id
-        ORDER BY s.created_at DESC
-        LIMIT 10
-    ''').fetchall()
+    recent_scans = db.execute(RECENT_SCANS_SQL, (10,)).fetchall()
 
     return render_template('admin_report.html',
                            total_patients=total_patients,
@@ -335,6 +1035,213 @@ def admin_generate_report():
                            diagnosis_stats=diagnosis_stats,
                            recent_scans=recent_scans)
 
+
+def export_source(name):
+    """Export source by name; scans (with users) is the only one since the schemas were unified"""
+    if name == 'scans':
+        return bulk_export.scans_source('database.db')
+    raise bulk_export.ExportError(f'Unknown export source {name!r}; expected scans')
+
+
+@app.route('/admin/export')
+def admin_export():
+    """Stream a full dump: ?format=csv|jsonl|parquet&since=&until="""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    source_name = request.args.get('source', 'scans')
+    fmt = request.args.get('format', 'csv')
+    try:
+        source = export_source(source_name)
+        records = bulk_export.iter_records(source, request.args.get('since'), request.args.get('until'))
+        chunks = bulk_export.stream(records, fmt, source.columns)
+        mimetype, extension = bulk_export.FORMATS[fmt]
+    except bulk_export.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = f"{source_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@app.route('/admin/probability_stats')
+def admin_probability_stats():
+    """Per-class confidence histograms over every stored probability vector"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    matrix = probabilities.load_matrix(get_db(), 'SELECT probabilities FROM scans')
+    bins = max(1, min(request.args.get('bins', 10, type=int), 100))
+    return jsonify(probabilities.confidence_summary(matrix, bins=bins))
+
+
+@app.route('/admin/inference_stats')
+def admin_inference_stats():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(dict(engine.stats(), calibration=calibrator.status()))
+
+
+@app.route('/admin/explanation_stats')
+def admin_explanation_stats():
+    """Grad-CAM batching and timing, kept apart from the prediction engine's inference_stats"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(explainer.stats())
+
+
+@app.route('/admin/prediction_cache_stats')
+def admin_prediction_cache_stats():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(prediction_cache.stats())
+
+
+@app.route('/admin/blob_writer_stats')
+def admin_blob_writer_stats():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(blob_writer.stats())
+
+
+@app.route('/admin/patient_attribute_cache_stats')
+def admin_patient_attribute_cache_stats():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(patient_attributes.all_stats())
+
+
+@app.route('/admin/db_pool_stats')
+def admin_db_pool_stats():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    return jsonify(db_pool.all_stats())
+
+
+@app.route('/admin/activity')
+def admin_activity():
+    """Recent audit events (queued ones included) and writer statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('admin_login'))
+
+    limit = page_size(request.args.get('limit'), Config.PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    return jsonify({'activity': activity_log.recent_activity(activity, get_db(), RECENT_ACTIVITY_SQL, limit),
+                    'writers': activity_log.all_stats()})
+
+
+app.cli.add_command(export_model_command)
+app.cli.add_command(calibration.calibrate_command)
+
+
+@app.cli.command('migrate-uploads')
+@click.option('--dry-run', is_flag=True, help='Report savings without moving files.')
+def migrate_uploads_command(dry_run):
+    """Deduplicate legacy uploads into the content-addressed store."""
+    summary = migrate_uploads('database.db', Config.BLOB_STORE_ROOT, blob_store, dry_run=dry_run)
+    click.echo(f"{summary['files']} files -> {summary['unique_blobs']} blobs, "
+               f"{summary['bytes_before']} -> {summary['bytes_after']} bytes, "
+               f"{summary['rows_updated']} scans updated")
+
+
+@app.cli.command('export-scans')
+@click.option('--source', type=click.Choice(['scans']), default='scans')
+@click.option('--format', 'fmt', type=click.Choice(sorted(bulk_export.FORMATS)), default='csv')
+@click.option('--since', help='Start date (inclusive), YYYY-MM-DD[ HH:MM:SS].')
+@click.option('--until', help='End date; a plain date includes that whole day.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, allow_dash=True), default='-',
+              help='Output file (default: stdout).')
+def export_scans_command(source, fmt, since, until, output):
+    """Stream a full scan export without loading the table into memory."""
+    try:
+        export = export_source(source)
+        chunks = bulk_export.stream(bulk_export.iter_records(export, since, until), fmt, export.columns)
+    except bulk_export.ExportError as e:
+        raise click.UsageError(str(e))
+
+    mode = 'wb' if fmt == 'parquet' else 'w'
+    with click.open_file(output, mode) as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+
+@app.cli.command('embedding-index')
+@click.option('--rebuild', is_flag=True, help='Re-read every embedding, dropping deleted scans.')
+@click.option('--ivf', 'ivf_lists', type=int, help='Then partition the index into this many IVF lists.')
+def embedding_index_command(rebuild, ivf_lists):
+    """Bring the similar-scan index up to date with scan_embeddings."""
+    version = registry.version()
+    added = similar_scans.rebuild(version) if rebuild else similar_scans.sync(version)
+    click.echo(f'{added} embeddings added')
+    if ivf_lists:
+        try:
+            similar_scans.train_ivf(ivf_lists)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    click.echo(json.dumps(similar_scans.stats()))
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any registered hot query falls back to a full table scan."""
+    # Make sure the database exists with its indexes applied
+    Database()
+
+    violations = check_query_plans()
+    for name, lines in violations.items():
+        click.echo(f'{name}: ' + '; '.join(lines), err=True)
+    if violations:
+        raise SystemExit(1)
+    click.echo('All hot queries use indexes.')
+
+
+@app.cli.command('reconcile-stats')
+@click.option('--fix', is_flag=True, help='Rebuild the maintained statistics when they drift.')
+def reconcile_stats_command(fix):
+    """Compare trigger-maintained statistics with a full recount."""
+    conn = db_pool.get_pool('database.db').acquire()
+    try:
+        mismatches = stats.reconcile(conn, stats.APP_SCANS, fix=fix)
+    finally:
+        conn.close()
+    for name, maintained, actual in mismatches:
+        click.echo(f'{name} maintained={maintained} actual={actual}', err=True)
+    if mismatches and not fix:
+        raise SystemExit(1)
+    click.echo('rebuilt' if mismatches else 'consistent')
+
+
+@app.cli.command('migrate-legacy')
+@click.option('--source', default=Config.LEGACY_DATABASE, show_default=True,
+              help='Old database.Database file to import.')
+@click.option('--batch-size', default=500, show_default=True, help='Rows copied per transaction.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--status', is_flag=True, help='Only show how far the import has got.')
+def migrate_legacy_command(source, batch_size, pause, status):
+    """Copy alzheimer.db into database.db in resumable batches."""
+    conn = db_pool.get_pool('database.db').acquire()
+    try:
+        if status:
+            progress = legacy_import.import_status(conn, source)
+        else:
+            if not os.path.exists(source):
+                raise click.UsageError(f'{source} does not exist')
+            progress = legacy_import.import_legacy(
+                source, conn, batch_size=batch_size, pause=pause,
+                progress=lambda table, copied, skipped: click.echo(f'{table}: {copied} copied, {skipped} skipped'),
+                conflict=lambda user, reason: click.echo(f"Skipped legacy user {user['id']} "
+                                                         f"({user['username']}): {reason}", err=True))
+    finally:
+        conn.close()
+    for row in progress:
+        click.echo(f"{row['table']}: {'done' if row['done'] else 'in progress'} "
+                   f"({row['copied']} copied, {row['skipped']} skipped, last id {row['last_id']})")
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,65 @@
+import io
+import os
+import zipfile
+from collections import Counter
+
+
+def _allowed(filename, allowed_extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+def iter_uploads(files, allowed_extensions, max_files, max_image_bytes=None, max_total_bytes=None):
+    """Yield (filename, bytes) for every image in a multi-file or zip upload.
+
+    Zip archives are expanded in memory; directories, hidden files and members
+    without an allowed image extension are skipped. Raises ValueError once more
+    than ``max_files`` images have been seen, or before expanding a member
+    larger than ``max_image_bytes`` or one that would take the images past
+    ``max_total_bytes`` altogether. Members are checked by their declared
+    size; zipfile never inflates a member past it.
+    """
+    count = 0
+    total = 0
+
+    def check(name, size):
+        nonlocal count, total
+        count += 1
+        if count > max_files:
+            raise ValueError(f'A batch may contain at most {max_files} images')
+        if max_image_bytes is not None and size > max_image_bytes:
+            raise ValueError(f'{name} is {size} bytes; images may be at most {max_image_bytes} bytes')
+        total += size
+        if max_total_bytes is not None and total > max_total_bytes:
+            raise ValueError(f'A batch may contain at most {max_total_bytes} bytes of images')
+
+    for file in files:
+        if not file.filename:
+            continue
+        data = file.read()
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or name.startswith('.') or not _allowed(name, allowed_extensions):
+                        continue
+                    check(name, info.file_size)
+                    yield name, archive.read(info)
+        elif _allowed(file.filename, allowed_extensions):
+            check(file.filename, len(data))
+            yield file.filename, data
+
+
+def summarize_study(results):
+    """Study-level summary over the successful per-file results"""
+    scored = [r for r in results if 'prediction' in r]
+    if not scored:
+        return {'scans': 0, 'errors': len(results)}
+
+    counts = Counter(r['prediction'] for r in scored)
+    return {
+        'scans': len(scored),
+        'errors': len(results) - len(scored),
+        'class_counts': dict(counts),
+        'majority_class': counts.most_common(1)[0][0],
+        'mean_confidence': sum(r['confidence'] for r in scored) / len(scored),
+    }
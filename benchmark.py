@@ -0,0 +1,327 @@
+"""Inference benchmark over the bundled MRI images.
+
+Measures four levels of the /predict path:
+
+  preprocess  decoding + resizing + array conversion alone
+  model       the model call alone, at several batch sizes
+  serving     Keras only: model.predict() against the compiled serving
+              function on the same batches, i.e. the per-call overhead the
+              serving function removes
+  request     full POST /predict requests through the Flask test client,
+              at several concurrency levels
+
+Usage:
+  python benchmark.py --output bench.json
+  python benchmark.py --stub --compare bench.json
+
+Without --stub the real model is used and the benchmark falls back to a
+deterministic stub model when it cannot be loaded (e.g. Git LFS weights not
+pulled). Full-request runs happen in a temporary working directory so the
+real database and upload folder are never touched.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import model_registry
+from preprocessing import INPUT_SIZE, decode_pixels, normalize
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIRS = [os.path.join(ROOT, 'static', 'images'), os.path.join(ROOT, 'static', 'uploads')]
+
+
+class StubModel:
+    """Deterministic stand-in with the real model's input/output shapes.
+
+    One dense projection over the flattened image, so the cost still scales
+    with batch size, followed by a softmax over the four classes.
+    """
+
+    def __init__(self, classes=4, seed=0):
+        rng = np.random.default_rng(seed)
+        features = INPUT_SIZE[0] * INPUT_SIZE[1] * 3
+        self.weights = rng.standard_normal((features, classes)).astype(np.float32) / np.sqrt(features)
+
+    def predict(self, batch):
+        logits = normalize(batch).reshape(len(batch), -1) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+model_registry.register_loader('stub', lambda path: StubModel())
+
+
+def find_images(limit=None):
+    """Sample MRI images (JPEGs) from static/images and every level of static/uploads"""
+    paths = []
+    for directory in IMAGE_DIRS:
+        paths.extend(glob.glob(os.path.join(directory, '**', '*.jp*g'), recursive=True))
+    paths = sorted(paths)
+    return paths[:limit] if limit else paths
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(latencies_ms, wall_seconds, items):
+    latencies = np.asarray(latencies_ms)
+    return {
+        'count': int(len(latencies)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'throughput_per_s': items / wall_seconds if wall_seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_preprocess(blobs, repeat):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for data in blobs:
+            t = time.perf_counter()
+            decode_pixels(data)
+            latencies.append((time.perf_counter() - t) * 1000.0)
+    return summarize(latencies, time.perf_counter() - started, len(latencies))
+
+
+def bench_model(model, images, batch_sizes, repeat):
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.resize(images, (batch_size,) + images.shape[1:])
+        results[str(batch_size)] = _time_calls(lambda: model.predict(batch), batch_size, repeat)
+    return results
+
+
+def bench_serving(model, images, batch_sizes, repeat):
+    """Same batches through Keras model.predict() and through the serving tf.function"""
+    keras_model = model.model
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.resize(images, (batch_size,) + images.shape[1:])
+        scaled = normalize(batch)
+        keras = _time_calls(lambda: keras_model.predict(scaled, verbose=0), batch_size, repeat)
+        serving = _time_calls(lambda: model.predict(batch), batch_size, repeat)
+        results[str(batch_size)] = {
+            'keras_predict': keras,
+            'serving_function': serving,
+            'overhead_removed_p50_ms': keras['p50_ms'] - serving['p50_ms'],
+        }
+    return results
+
+
+def _time_calls(call, batch_size, repeat):
+    call()  # warm-up / graph tracing
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        t = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - t) * 1000.0)
+    return summarize(latencies, time.perf_counter() - started, batch_size * repeat)
+
+
+def bench_requests(app_module, files, concurrency_levels, requests_per_level):
+    """POST /predict from ``concurrency`` threads sharing one request budget.
+
+    /predict redirects whether or not the scan worked, so a request only
+    counts (and is timed) when it flashed a success message; the rest are
+    reported as ``errors``.
+    """
+    results = {}
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        counter = iter(range(requests_per_level))
+
+        def worker():
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'benchmark'
+                sess['role'] = 'patient'
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                name, data = files[i % len(files)]
+                t = time.perf_counter()
+                response = client.post('/predict', data={'file': (io.BytesIO(data), name)},
+                                       content_type='multipart/form-data')
+                elapsed = (time.perf_counter() - t) * 1000.0
+                # The redirect is never followed, so the flashed messages are still in the session
+                with client.session_transaction() as sess:
+                    flashes = sess.pop('_flashes', [])
+                succeeded = response.status_code == 302 and any(category == 'success' for category, _ in flashes)
+                with lock:
+                    if succeeded:
+                        latencies.append(elapsed)
+                    else:
+                        errors.append('; '.join(message for _, message in flashes) or
+                                      f'/predict returned {response.status_code}')
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        result = summarize(latencies, wall, len(latencies)) if latencies else {'count': 0}
+        result['errors'] = len(errors)
+        if errors:
+            result['first_error'] = errors[0]
+            print(f'concurrency {concurrency}: {len(errors)} of {requests_per_level} requests failed '
+                  f'({errors[0]})', file=sys.stderr)
+        results[str(concurrency)] = result
+    return results
+
+
+def load_model(use_stub):
+    if use_stub:
+        return 'stub', StubModel()
+    from config import Config
+    try:
+        return Config.MODEL_RUNTIME, model_registry.get_loader(Config.MODEL_RUNTIME)(Config.MODEL_PATH)
+    except Exception as e:
+        print(f'Could not load {Config.MODEL_PATH} ({e}); falling back to the stub model', file=sys.stderr)
+        return 'stub', StubModel()
+
+
+def app_environment():
+    """Settings for the request level; config reads them once, so this runs before anything imports it"""
+    os.environ.setdefault('PREDICTION_CACHE_ENABLED', '0')
+    os.environ.setdefault('MODEL_WARMUP', '0')
+    # Relative, so always the scratch one: a real index would be reset for the benchmark's model version
+    os.environ['EMBEDDING_INDEX_DIR'] = 'embedding_index'
+
+
+def import_app(workdir, runtime, model):
+    """Import app.py with its relative paths (database, uploads) redirected to ``workdir``.
+
+    The stub is handed to the app's registry, since the app cannot load it
+    from MODEL_PATH. A real model is loaded by the app itself, so the
+    configured inference backend is what gets measured.
+    """
+    app_environment()
+    os.environ['MODEL_RUNTIME'] = runtime
+    os.makedirs(os.path.join(workdir, 'static'), exist_ok=True)
+    os.chdir(workdir)
+    import app
+    if runtime == 'stub':
+        app.registry.set_model(model, runtime)
+    return app
+
+
+def compare(current, baseline_path):
+    """Print p50/p95 and throughput ratios against a previous JSON result"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def walk(cur, base, prefix):
+        if 'p50_ms' in cur and 'p50_ms' in base:
+            print(f"{prefix:<28} p50 {cur['p50_ms'] / base['p50_ms']:6.2f}x  "
+                  f"p95 {cur['p95_ms'] / base['p95_ms']:6.2f}x  "
+                  f"throughput {cur['throughput_per_s'] / base['throughput_per_s']:6.2f}x")
+            return
+        for key, value in cur.items():
+            if isinstance(value, dict) and isinstance(base.get(key), dict):
+                walk(value, base[key], f'{prefix}/{key}' if prefix else key)
+
+    walk(current['results'], baseline['results'], '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stub', action='store_true', help='Use the stub model even if the real one loads')
+    parser.add_argument('--levels', default='preprocess,model,serving,request',
+                        help='Comma-separated subset of preprocess,model,serving,request')
+    parser.add_argument('--batch-sizes', default='1,4,8,16')
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the images / batches')
+    parser.add_argument('--requests', type=int, default=64, help='Requests per concurrency level')
+    parser.add_argument('--limit', type=int, help='Only use the first N images')
+    parser.add_argument('--output', help='Write JSON results here (default: stdout)')
+    parser.add_argument('--compare', help='Previous JSON result to compare against')
+    args = parser.parse_args(argv)
+
+    levels = set(args.levels.split(','))
+    paths = find_images(args.limit)
+    if not paths:
+        parser.error('No images found under static/images or static/uploads')
+    files = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read()))
+
+    if 'request' in levels:
+        app_environment()
+    runtime, model = load_model(args.stub)
+    report = {
+        'runtime': runtime,
+        'images': len(files),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': {},
+    }
+
+    if 'preprocess' in levels:
+        report['results']['preprocess'] = bench_preprocess([data for _, data in files], args.repeat)
+
+    if levels & {'model', 'serving'}:
+        images = np.stack([decode_pixels(data) for _, data in files])
+        batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    if 'model' in levels:
+        report['results']['model'] = bench_model(model, images, batch_sizes, args.repeat)
+    if 'serving' in levels:
+        if isinstance(model, model_registry.KerasModel):
+            report['results']['serving'] = bench_serving(model, images, batch_sizes, args.repeat)
+        else:
+            print(f'Skipping the serving level: it compares Keras calls, runtime is {runtime}', file=sys.stderr)
+
+    if 'request' in levels:
+        cwd = os.getcwd()
+        workdir = tempfile.mkdtemp(prefix='alzdx-bench-')
+        try:
+            app_module = import_app(workdir, runtime, model)
+            concurrency = [int(c) for c in args.concurrency.split(',')]
+            report['results']['request'] = bench_requests(app_module, files, concurrency, args.requests)
+            app_module.blob_writer.flush()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
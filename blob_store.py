@@ -0,0 +1,208 @@
+import atexit
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import get_pool
+
+# Uploads with these extensions keep them so browsers get the right MIME type
+_EXTENSION_ALIASES = {'jpeg': 'jpg', 'jpg': 'jpg', 'png': 'png'}
+
+
+def _extension(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    ext = _EXTENSION_ALIASES.get(ext)
+    return f'.{ext}' if ext else ''
+
+
+def write_atomic(path, data):
+    """Write ``data`` to a temporary file next to ``path`` and rename it into place"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class BlobStore:
+    """Content-addressed file store.
+
+    Each blob is written once to ``<root>/<aa>/<bb>/<sha256><ext>`` where
+    ``aa`` and ``bb`` are the first two byte pairs of the digest, so identical
+    uploads share one file and no directory grows without bound. Writes go to
+    a temporary file in the target directory and are renamed into place, so
+    readers never see a partial file.
+    """
+
+    def __init__(self, root):
+        # Stored paths always use forward slashes so they work in url_for('static')
+        self.root = root.replace('\\', '/')
+
+    def path_for(self, digest, filename=None):
+        return posixpath.join(self.root, digest[:2], digest[2:4], digest + _extension(filename))
+
+    def exists(self, digest, filename=None):
+        return os.path.exists(self.path_for(digest, filename))
+
+    def put(self, data, filename=None, digest=None):
+        """Store ``data`` and return its path; existing blobs are not rewritten"""
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, filename)
+        if os.path.exists(path):
+            return path
+        write_atomic(path, data)
+        return path
+
+    def put_file(self, src_path):
+        """Store an existing file and return (digest, path)"""
+        with open(src_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        return digest, self.put(data, os.path.basename(src_path), digest=digest)
+
+
+class BackgroundWriter:
+    """Writes blobs on a small thread pool so disk I/O stays off the request path.
+
+    ``put`` returns the final path immediately; the file appears there once the
+    write completes. Callers ``wait`` for the path before recording it
+    anywhere, which re-raises the error of a failed write. Failures are kept
+    (and counted in ``stats``) until the same blob is put again.
+    Pending writes are flushed at interpreter exit.
+    """
+
+    def __init__(self, store, max_workers=2):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='blob-writer')
+        self._pending = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failures = 0
+        self.last_error = None
+        atexit.register(self.flush)
+
+    def put(self, data, filename=None, digest=None):
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+        path = self.store.path_for(digest, filename)
+        with self._lock:
+            if path in self._pending or os.path.exists(path):
+                return path
+            # A new upload of a blob whose write failed tries again
+            self._failed.pop(path, None)
+            future = self._executor.submit(self.store.put, data, filename, digest)
+            self._pending[path] = future
+        future.add_done_callback(lambda done: self._done(path, done))
+        return path
+
+    def wait(self, path):
+        """Block until a queued write of ``path`` (if any) has finished; raises its error if it failed"""
+        with self._lock:
+            future = self._pending.get(path)
+            error = self._failed.get(path)
+        if future is not None:
+            future.result()
+        elif error is not None:
+            raise error
+
+    def flush(self):
+        """Block until every queued write has finished; failures are left to ``wait`` and ``stats``"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'failures': self.failures,
+                'failed_paths': len(self._failed),
+                'last_error': self.last_error,
+            }
+
+    def _done(self, path, future):
+        error = future.exception()
+        with self._lock:
+            self._pending.pop(path, None)
+            if error is None:
+                self.written += 1
+            else:
+                self._failed[path] = error
+                self.failures += 1
+                self.last_error = f'{path}: {error}'
+
+
+def _normalized(path):
+    # Older rows were written on Windows with backslash separators
+    return os.path.normcase(os.path.abspath(path.replace('\\', '/')))
+
+
+def migrate_uploads(db_path, upload_dir, store, dry_run=False):
+    """Move legacy timestamped uploads into ``store`` and repoint scans rows.
+
+    Only regular files directly inside ``upload_dir`` are migrated; the shard
+    directories of the store are left alone, so running it twice is safe.
+    Rows are matched on the file's full path, never on its name alone, and
+    an original is only deleted once the rows pointing at it are committed
+    and its blob is on disk. Returns a summary dict.
+    """
+    summary = {'files': 0, 'unique_blobs': 0, 'bytes_before': 0, 'bytes_after': 0, 'rows_updated': 0}
+    new_paths = {}
+    blobs = set()
+
+    for name in sorted(os.listdir(upload_dir)):
+        src = os.path.join(upload_dir, name)
+        if not os.path.isfile(src) or name.startswith('.'):
+            continue
+        size = os.path.getsize(src)
+        summary['files'] += 1
+        summary['bytes_before'] += size
+
+        with open(src, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        path = store.path_for(digest, name)
+        if path not in blobs:
+            blobs.add(path)
+            summary['bytes_after'] += size
+            if not dry_run:
+                store.put(data, name, digest=digest)
+        new_paths[_normalized(src)] = path
+
+    summary['unique_blobs'] = len(blobs)
+
+    conn = get_pool(db_path).acquire()
+    try:
+        rows = conn.execute('SELECT id, image_path FROM scans').fetchall()
+        updates = []
+        for scan_id, image_path in rows:
+            new_path = new_paths.get(_normalized(image_path)) if image_path else None
+            if new_path is not None:
+                updates.append((new_path, scan_id))
+        summary['rows_updated'] = len(updates)
+        if not dry_run:
+            conn.executemany('UPDATE scans SET image_path = ? WHERE id = ?', updates)
+            conn.commit()
+    finally:
+        conn.close()
+
+    # Originals are only removed once the committed rows point at the store
+    if not dry_run:
+        for src, path in new_paths.items():
+            if os.path.exists(path):
+                os.remove(src)
+
+    return summary
@@ -0,0 +1,228 @@
+"""Streaming bulk export of scans for audits.
+
+Rows are read in keyset pages of ``chunk_size`` and written out as they
+arrive, so an export holds one chunk in memory no matter how large the
+table is:
+
+    records = iter_records(scans_source('database.db'), since='2024-01-01')
+    for chunk in stream(records, 'csv', scans_source('database.db').columns):
+        response.write(chunk)
+
+Every page is its own short query on a pooled connection that goes back
+to the pool before the page is written out. A slow download therefore
+holds neither a connection nor a read transaction (which would keep the
+WAL from being checkpointed). Pages follow (date, id), so SQLite walks the
+date index and only sorts rows that share a timestamp.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import probabilities
+from db_pool import get_pool
+
+# name -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+CHUNK_SIZE = 1000
+
+# sql: a SELECT with a {where} placeholder, ending in ORDER BY <key_columns> LIMIT ?
+# key_columns: the '<date>, <id>' pair pages are keyed on; key: their values in a fetched row
+# columns: [(name, type)] with type one of 'int', 'float', 'str'
+# transform: optional function turning a fetched row tuple into the output tuple
+ExportSource = namedtuple('ExportSource', 'db_path sql date_column key_columns key columns transform')
+
+
+class ExportError(ValueError):
+    """Raised for an unknown format or source, a bad date, or a missing optional dependency"""
+
+
+def _decode_probabilities(row):
+    # Probabilities are the last selected column; NaN for scans without a stored vector
+    vector = probabilities.decode(row[-1])
+    return tuple(row[:-1]) + tuple(None if p != p else float(p) for p in vector)
+
+
+PROBABILITY_COLUMNS = [('p_' + name.lower().replace(' ', '_').replace('-', '_'), 'float')
+                       for name in probabilities.CLASS_NAMES]
+
+
+def scans_source(db_path):
+    """app.py scans joined with the owning user, probabilities as one column per class"""
+    return ExportSource(db_path, '''
+        SELECT s.id, s.user_id, u.username, u.email, s.prediction, s.confidence,
+               s.image_path, s.created_at, s.probabilities
+        FROM scans s
+        LEFT JOIN users u ON u.id = s.user_id
+        {where}
+        ORDER BY s.created_at, s.id
+        LIMIT ?''', 's.created_at', 's.created_at, s.id', lambda row: (row[7], row[0]), [
+        ('id', 'int'), ('user_id', 'int'), ('username', 'str'), ('email', 'str'),
+        ('prediction', 'str'), ('confidence', 'float'), ('image_path', 'str'),
+        ('created_at', 'str'),
+    ] + PROBABILITY_COLUMNS, _decode_probabilities)
+
+
+def parse_date_range(since=None, until=None):
+    """Normalize ISO dates/datetimes to a [since, until) range of timestamp strings.
+
+    A date-only ``until`` includes that whole day.
+    """
+    def parse(value, end):
+        if not value:
+            return None
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            raise ExportError(f'Invalid date: {value!r} (expected YYYY-MM-DD[ HH:MM:SS])')
+        if end and len(value) == 10:
+            moment += timedelta(days=1)
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+    return parse(since, False), parse(until, True)
+
+
+def iter_records(source, since=None, until=None, chunk_size=CHUNK_SIZE):
+    """Return an iterator of output tuples, fetching ``chunk_size`` rows per query"""
+    start, end = parse_date_range(since, until)
+    conditions, params = [], []
+    if start:
+        conditions.append(f'{source.date_column} >= ?')
+        params.append(start)
+    if end:
+        conditions.append(f'{source.date_column} < ?')
+        params.append(end)
+    first = source.sql.format(where=_where(conditions))
+    after = source.sql.format(where=_where(conditions + [f'({source.key_columns}) > (?, ?)']))
+    # Dates are validated above, before a streamed response has started
+    return _fetch(source, first, after, params, chunk_size)
+
+
+def _where(conditions):
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+def _fetch(source, first, after, params, chunk_size):
+    pool = get_pool(source.db_path)
+    key = None
+    while True:
+        conn = pool.acquire()
+        try:
+            if key is None:
+                rows = conn.execute(first, params + [chunk_size]).fetchall()
+            else:
+                rows = conn.execute(after, params + list(key) + [chunk_size]).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            yield source.transform(row) if source.transform else tuple(row)
+        if len(rows) < chunk_size:
+            return
+        key = source.key(rows[-1])
+
+
+def stream(records, fmt, columns, chunk_size=CHUNK_SIZE):
+    """Encode records as ``fmt``, yielding str (csv, jsonl) or bytes (parquet) chunks"""
+    if fmt == 'csv':
+        return _stream_csv(records, columns, chunk_size)
+    if fmt == 'jsonl':
+        return _stream_jsonl(records, columns, chunk_size)
+    if fmt == 'parquet':
+        return _stream_parquet(records, columns, chunk_size)
+    raise ExportError(f'Unknown export format {fmt!r}; expected one of {", ".join(FORMATS)}')
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stream_csv(records, columns, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in _batches(records, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _stream_jsonl(records, columns, chunk_size):
+    names = [name for name, _ in columns]
+    for batch in _batches(records, chunk_size):
+        yield ''.join(json.dumps(dict(zip(names, record))) + '\n' for record in batch)
+
+
+def _stream_parquet(records, columns, chunk_size):
+    # Checked before the first chunk so a missing dependency fails the request cleanly
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError('Parquet export requires pyarrow (pip install pyarrow)')
+
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    return _parquet_chunks(records, schema, pa, pq, chunk_size)
+
+
+def _parquet_chunks(records, schema, pa, pq, chunk_size):
+    # Each batch becomes one row group; the footer is written on close
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in _batches(records, chunk_size):
+            arrays = [pa.array(list(values), type=field.type)
+                      for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class _ChunkSink:
+    """Write-only file object handing out what was written since the last drain.
+
+    ``tell`` keeps counting across drains because the Parquet footer records
+    absolute offsets.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
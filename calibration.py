@@ -0,0 +1,212 @@
+"""Temperature scaling of the model's class probabilities.
+
+The model ends in a softmax, so the log of its output equals its logits up
+to a per-row constant, and softmax(log(p) / T) is ordinary temperature
+scaling. T > 1 softens overconfident outputs, T < 1 sharpens them; the
+order of the classes, and so the diagnosis, never changes.
+
+``flask calibrate`` fits one temperature for single-pass outputs and one for
+test-time augmented outputs (averaging already softens those) by minimizing
+the negative log-likelihood on labelled sample images, and writes them to
+Config.CALIBRATION_PATH next to the model. The labels file is a CSV of
+``filename,class`` rows, where class is a name from CLASS_NAMES or its
+index. Without a calibration file every temperature is 1.
+"""
+import csv
+import json
+import os
+import threading
+
+import click
+import numpy as np
+
+import tta
+from config import Config
+from model_registry import get_loader
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE, decode_pixels
+from probabilities import CLASS_NAMES
+
+SINGLE = 'single'
+TTA = 'tta'
+MODES = (SINGLE, TTA)
+
+
+def apply_temperature(probs, temperature):
+    """Rescale (..., classes) probabilities as if their logits were divided by ``temperature``"""
+    probs = np.asarray(probs, dtype=np.float32)
+    if temperature == 1.0:
+        return probs
+    logits = np.log(np.clip(probs, 1e-12, None)) / np.float32(temperature)
+    logits -= logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def negative_log_likelihood(probs, labels):
+    return float(-np.mean(np.log(np.clip(probs[np.arange(len(labels)), labels], 1e-12, None))))
+
+
+def expected_calibration_error(probs, labels, bins=10):
+    """Gap between confidence and accuracy, averaged over equal-width confidence bins"""
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == labels
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(error)
+
+
+def fit_temperature(probs, labels, low=0.05, high=20.0, iterations=60):
+    """Temperature minimizing the NLL of ``labels``; golden-section search over log T"""
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    a, b = np.log(low), np.log(high)
+
+    def loss(log_t):
+        return negative_log_likelihood(apply_temperature(probs, float(np.exp(log_t))), labels)
+
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    loss_c, loss_d = loss(c), loss(d)
+    for _ in range(iterations):
+        if loss_c < loss_d:
+            b, d, loss_d = d, c, loss_c
+            c = b - ratio * (b - a)
+            loss_c = loss(c)
+        else:
+            a, c, loss_c = c, d, loss_d
+            d = a + ratio * (b - a)
+            loss_d = loss(d)
+    return float(np.exp((a + b) / 2.0))
+
+
+def load_labels(path):
+    """{filename: class index} from a ``filename,class`` CSV (a header row is skipped)"""
+    labels = {}
+    with open(path, newline='') as f:
+        for line, row in enumerate(csv.reader(f)):
+            if len(row) < 2 or not row[0].strip() or row[0].startswith('#'):
+                continue
+            name, label = row[0].strip(), row[1].strip()
+            if label in CLASS_NAMES:
+                labels[name] = CLASS_NAMES.index(label)
+            elif label.isdigit() and int(label) < len(CLASS_NAMES):
+                labels[name] = int(label)
+            elif line > 0:
+                raise ValueError(f'{path}: unknown class {label!r} for {name}; expected one of {CLASS_NAMES}')
+    return labels
+
+
+class Calibration:
+    """Temperatures from a calibration file, re-read whenever the file changes.
+
+    A file fitted on another model (its recorded size differs from the
+    served model's) is ignored, so a swapped model is never calibrated with
+    stale temperatures.
+    """
+
+    def __init__(self, path, model_path):
+        self.path = path
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._data = {}
+        self._error = None
+
+    def temperature(self, mode):
+        return float(self._load().get('temperatures', {}).get(mode, 1.0))
+
+    def apply(self, probs, mode):
+        return apply_temperature(probs, self.temperature(mode))
+
+    def status(self):
+        data = self._load()
+        return {'path': self.path, 'temperatures': {mode: self.temperature(mode) for mode in MODES},
+                'fitted_on_images': data.get('images'), 'error': self._error}
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return self._data
+        with self._lock:
+            if mtime != self._mtime:
+                self._data, self._error = {}, None
+                if mtime is not None:
+                    try:
+                        with open(self.path) as f:
+                            data = json.load(f)
+                        model_bytes = os.path.getsize(self.model_path) if os.path.exists(self.model_path) else None
+                        if data.get('model_bytes') != model_bytes:
+                            self._error = f'{self.path} was fitted on a different model; ignored'
+                        else:
+                            self._data = data
+                    except (OSError, ValueError) as e:
+                        self._error = f'Unreadable calibration file: {e}'
+                self._mtime = mtime
+        return self._data
+
+
+def _metrics(raw, calibrated, labels):
+    return {
+        'accuracy': float(np.mean(raw.argmax(axis=1) == labels)),
+        'nll_before': negative_log_likelihood(raw, labels),
+        'nll_after': negative_log_likelihood(calibrated, labels),
+        'ece_before': expected_calibration_error(raw, labels),
+        'ece_after': expected_calibration_error(calibrated, labels),
+    }
+
+
+@click.command('calibrate')
+@click.option('--labels', 'labels_path', default=os.path.join('static', 'images', 'labels.csv'), show_default=True,
+              help='CSV of filename,class rows for the sample images.')
+@click.option('--image-dir', default=os.path.join('static', 'images'), show_default=True)
+@click.option('--output', default=lambda: Config.CALIBRATION_PATH, show_default='Config.CALIBRATION_PATH')
+def calibrate_command(labels_path, image_dir, output):
+    """Fit single-pass and TTA temperatures on the labelled sample images."""
+    if not os.path.exists(labels_path):
+        raise click.UsageError(f'{labels_path} does not exist; it needs one "filename,class" row per '
+                               f'sample image, class being one of: {", ".join(CLASS_NAMES)}')
+    try:
+        labels = load_labels(labels_path)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    names = sorted(name for name in labels if os.path.exists(os.path.join(image_dir, name)))
+    if len(names) < len(labels):
+        click.echo(f'{len(labels) - len(names)} labelled images not found in {image_dir}', err=True)
+    if not names:
+        raise click.ClickException('No labelled images to calibrate on')
+
+    images = np.empty((len(names), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=PIXEL_DTYPE)
+    for i, name in enumerate(names):
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            decode_pixels(f.read(), out=images[i])
+    y = np.array([labels[name] for name in names])
+
+    click.echo(f'Calibrating {Config.MODEL_PATH} on {len(names)} images...')
+    model = get_loader(Config.MODEL_RUNTIME)(Config.MODEL_PATH)
+    outputs = {
+        SINGLE: np.asarray(model.predict(images), dtype=np.float32),
+        TTA: tta.combine(model.predict(tta.augment_batch(images, Config.TTA_SHIFT_PIXELS,
+                                                         Config.TTA_INTENSITY_JITTER))),
+    }
+
+    report = {'model_path': Config.MODEL_PATH, 'model_bytes': os.path.getsize(Config.MODEL_PATH),
+              'images': len(names), 'temperatures': {}, 'metrics': {}}
+    for mode, raw in outputs.items():
+        temperature = fit_temperature(raw, y)
+        report['temperatures'][mode] = temperature
+        report['metrics'][mode] = _metrics(raw, apply_temperature(raw, temperature), y)
+        metrics = report['metrics'][mode]
+        click.echo(f"{mode}: T={temperature:.3f}, accuracy {metrics['accuracy']:.2%}, "
+                   f"NLL {metrics['nll_before']:.4f} -> {metrics['nll_after']:.4f}, "
+                   f"ECE {metrics['ece_before']:.4f} -> {metrics['ece_after']:.4f}")
+
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_output, output)
+    click.echo(f'Wrote {output}')
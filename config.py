@@ -4,20 +4,108 @@ from datetime import timedelta
 class Config:
     # Basic Flask configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # Request body limit, 16MB
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
     
     # Database configuration
     DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
+    # Pre-unification database.Database file, read by `flask migrate-legacy`
+    LEGACY_DATABASE = os.environ.get('LEGACY_DATABASE', 'alzheimer.db')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))  # Connections per database file
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
     
     # Upload configuration
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    # Content-addressed scan store; kept relative so stored paths resolve under /static
+    BLOB_STORE_ROOT = 'static/uploads'
+    BLOB_WRITER_THREADS = int(os.environ.get('BLOB_WRITER_THREADS', 2))  # Background upload writers
+    # Downsized scan images served by /scans/<id>/image/<variant>; longest edge in pixels
+    SCAN_IMAGE_VARIANTS = {
+        'thumb': int(os.environ.get('SCAN_THUMBNAIL_SIZE', 160)),
+        'preview': int(os.environ.get('SCAN_PREVIEW_SIZE', 640)),
+    }
+    SCAN_IMAGE_QUALITY = int(os.environ.get('SCAN_IMAGE_QUALITY', 85))  # JPEG quality of the variants
+    SCAN_IMAGE_MAX_AGE = int(os.environ.get('SCAN_IMAGE_MAX_AGE', 365 * 24 * 3600))  # Content-addressed, so safe to cache this long
+    DERIVATIVE_WRITER_THREADS = int(os.environ.get('DERIVATIVE_WRITER_THREADS', 1))
     
     # Model configuration
-    MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'alzheimer_model.h5')
-    IMAGE_SIZE = (224, 224)  # Input size for the model
+    KERAS_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'Resnet50_best_model.keras')
+    # Written by `flask export-model`
+    TFLITE_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'Resnet50_best_model.tflite')
+    # 'keras' serves the original model, 'tflite' the exported (optionally quantized) one
+    MODEL_RUNTIME = os.environ.get('MODEL_RUNTIME', 'keras')
+    MODEL_PATH = os.environ.get('MODEL_PATH') or (TFLITE_MODEL_PATH if MODEL_RUNTIME == 'tflite' else KERAS_MODEL_PATH)
+    # Load the model in a background thread on the first request instead of on first /predict
+    MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1') == '1'
+    IMAGE_SIZE = (128, 128)  # Input size for the model (preprocessing.INPUT_SIZE)
+
+    # Test-time augmentation (tta.py) and temperature calibration (calibration.py)
+    TTA_DEFAULT = os.environ.get('TTA_DEFAULT', '0') == '1'  # Requests override it with tta=0/1
+    TTA_SHIFT_PIXELS = int(os.environ.get('TTA_SHIFT_PIXELS', 4))
+    TTA_INTENSITY_JITTER = float(os.environ.get('TTA_INTENSITY_JITTER', 0.1))  # Fraction of brightness added/removed
+    # Written by `flask calibrate`; without it probabilities are served uncalibrated
+    CALIBRATION_PATH = os.environ.get('CALIBRATION_PATH') or os.path.splitext(MODEL_PATH)[0] + '.calibration.json'
+
+    # Inference batching configuration
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+    INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))  # Max time to hold a partial batch
+    # 'thread' runs the model inside the Flask process; 'process' dispatches to worker processes
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'thread')
+    INFERENCE_PROCESSES = int(os.environ.get('INFERENCE_PROCESSES', os.cpu_count() or 1))
+    INFERENCE_INTRA_OP_THREADS = int(os.environ.get('INFERENCE_INTRA_OP_THREADS', 0))  # 0 = cores per worker
+    INFERENCE_INTER_OP_THREADS = int(os.environ.get('INFERENCE_INTER_OP_THREADS', 1))
+    INFERENCE_WORKER_TIMEOUT = float(os.environ.get('INFERENCE_WORKER_TIMEOUT', 120))  # Seconds before a silent worker is replaced
+
+    # Batch (study) upload configuration
+    BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 256))
+    # Uncompressed limits for zip uploads (a small archive can expand enormously)
+    BATCH_MAX_IMAGE_BYTES = int(os.environ.get('BATCH_MAX_IMAGE_BYTES', MAX_CONTENT_LENGTH))
+    BATCH_MAX_TOTAL_BYTES = int(os.environ.get('BATCH_MAX_TOTAL_BYTES', 256 * 1024 * 1024))
+    DECODE_THREADS = int(os.environ.get('DECODE_THREADS', 4))
+
+    # Asynchronous scan job configuration
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 64))  # Submissions past this get 429
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 60))  # A running job is re-queued this long after its process stops renewing it
     
+    # Background activity-log writer
+    ACTIVITY_LOG_BATCH_SIZE = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 100))  # Flush when this many are queued
+    ACTIVITY_LOG_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0))  # ...or after this many seconds
+    ACTIVITY_LOG_QUEUE_MAX = int(os.environ.get('ACTIVITY_LOG_QUEUE_MAX', 10000))
+    ACTIVITY_LOG_OVERFLOW = os.environ.get('ACTIVITY_LOG_OVERFLOW', 'drop_oldest')  # drop_oldest, drop_newest or block
+
+    # Keyset pagination for scan history and patient listings
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 20))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+    # Per-patient attributes (next checkup, doctor notes) cached in-process
+    PATIENT_ATTRIBUTE_CACHE_TTL = float(os.environ.get('PATIENT_ATTRIBUTE_CACHE_TTL', 60))  # Seconds; bounds staleness across processes
+    PATIENT_ATTRIBUTE_CACHE_MAX_ENTRIES = int(os.environ.get('PATIENT_ATTRIBUTE_CACHE_MAX_ENTRIES', 10000))
+
+    # Similar-scan search over penultimate-layer embeddings
+    # Relative like database.db, whose scan_embeddings rows it mirrors
+    EMBEDDING_INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', 'embedding_index')
+    EMBEDDING_IVF_NPROBE = int(os.environ.get('EMBEDDING_IVF_NPROBE', 8))  # IVF lists searched per query (after `flask embedding-index --ivf`)
+    SIMILAR_SCANS_MAX_K = int(os.environ.get('SIMILAR_SCANS_MAX_K', 50))
+
+    # Grad-CAM explanation maps, computed in the background and cached per image and model version
+    # Off by default: a map per upload doubles the model work of every scan, most of which are never opened
+    EXPLAIN_ON_UPLOAD = os.environ.get('EXPLAIN_ON_UPLOAD', '0') == '1'  # Queue a map for every new scan, not only when viewed
+    EXPLANATION_MAX_BATCH_SIZE = int(os.environ.get('EXPLANATION_MAX_BATCH_SIZE', 8))
+    EXPLANATION_MAX_WAIT_MS = float(os.environ.get('EXPLANATION_MAX_WAIT_MS', 50))  # Off the request path, so it can wait longer than inference
+    EXPLANATION_MAX_PENDING = int(os.environ.get('EXPLANATION_MAX_PENDING', 256))
+    EXPLANATION_OVERLAY_SIZE = int(os.environ.get('EXPLANATION_OVERLAY_SIZE', 256))  # Pixels; the browser stretches it over the image
+
+    # Prediction cache configuration
+    PREDICTION_CACHE_ENABLED = os.environ.get('PREDICTION_CACHE_ENABLED', '1') == '1'
+    PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 10000))
+    PREDICTION_CACHE_TOUCH_INTERVAL = float(os.environ.get('PREDICTION_CACHE_TOUCH_INTERVAL', 60))  # Seconds between last_used writes per entry
+
+    # Prometheus-text /metrics endpoint (see metrics.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # Off: every timer is a no-op
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # If set, scrapers must send "Authorization: Bearer <token>"
+
     # Admin configuration
     ADMIN_USERNAME = 'admin'
     ADMIN_EMAIL = 'admin@neuroscan.ai'
@@ -1,92 +1,57 @@
 import sqlite3
 import os
 from datetime import datetime
-import hashlib
-import json
 import click
 from flask import current_app, g
-from werkzeug.security import generate_password_hash
+import activity_log
+from db_pool import get_pool
+from migrations import ensure_schema
+from pagination import fetch_page, keyset_query
+from passwords import hash_password, needs_rehash, verify_password
+from query_plan import hot_query
+import patient_attributes
+import probabilities
+import stats
+
+# Same file as app.py; alzheimer.db is only read by `flask migrate-legacy`
+DB_PATH = 'database.db'
+
+# Hot queries checked by `flask check-query-plans`
+LATEST_SCAN_SQL = hot_query(DB_PATH, 'latest_scan', '''
+            SELECT id, created_at, prediction, confidence, probabilities
+            FROM scans
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ''', (1,))
+SCAN_HISTORY_QUERY = keyset_query(DB_PATH, 'scan_history', '''
+            SELECT id, created_at, prediction, confidence, probabilities
+            FROM scans
+            WHERE user_id = ? {after}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', 'created_at, id', (1,))
+RECENT_ACTIVITY_SQL = hot_query(DB_PATH, 'recent_activity', '''
+            SELECT al.timestamp, al.action, u.username, al.details
+            FROM activity_log al
+            JOIN users u ON al.user_id = u.id
+            ORDER BY al.timestamp DESC
+            LIMIT ?
+        ''', (10,))
 
 class Database:
     def __init__(self):
-        self.db_path = 'alzheimer.db'
+        self.db_path = DB_PATH
         self.init_db()
 
-    def init_db(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Create users table with oauth fields
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                role TEXT NOT NULL,
-                oauth_provider TEXT,
-                oauth_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(oauth_provider, oauth_id)
-            )
-        ''')
-
-        # Create patient_details table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patient_details (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                full_name TEXT NOT NULL,
-                date_of_birth DATE NOT NULL,
-                gender TEXT NOT NULL,
-                address TEXT,
-                phone TEXT,
-                emergency_contact TEXT,
-                medical_history TEXT,
-                profile_image TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-
-        # Create scan_results table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scan_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER NOT NULL,
-                scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                scan_image_path TEXT NOT NULL,
-                predicted_class TEXT NOT NULL,
-                confidence REAL NOT NULL,
-                probabilities TEXT NOT NULL,
-                notes TEXT,
-                FOREIGN KEY (patient_id) REFERENCES users (id)
-            )
-        ''')
+    def _connect(self):
+        """Check out a pooled connection; close() returns it to the pool"""
+        return get_pool(self.db_path).acquire()
 
-        # Create activity_log table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                action TEXT NOT NULL,
-                details TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-
-        # Create system_settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS system_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                setting_key TEXT UNIQUE NOT NULL,
-                setting_value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        conn.commit()
+    def init_db(self):
+        """Create or upgrade the unified schema"""
+        conn = self._connect()
+        ensure_schema(conn)
         conn.close()
 
         # Create admin user if not exists
@@ -94,7 +59,7 @@ class Database:
 
     def create_admin_user(self):
         """Create default admin user if not exists"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         # Check if admin exists
@@ -111,22 +76,27 @@ class Database:
         conn.close()
 
     def hash_password(self, password):
-        """Hash password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password (salted, werkzeug format shared with app.py)"""
+        return hash_password(password)
 
     def authenticate_user(self, username, password, role):
         """Authenticate user and return user data if successful"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
-        hashed_password = self.hash_password(password)
         cursor.execute('''
-            SELECT id, username, email, role
+            SELECT id, username, email, role, password
             FROM users
-            WHERE username = ? AND password = ? AND role = ?
-        ''', (username, hashed_password, role))
+            WHERE username = ? AND role = ?
+        ''', (username, role))
 
         user = cursor.fetchone()
+        if user and not verify_password(user[4], password):
+            user = None
+        if user and needs_rehash(user[4]):
+            # Imported SHA-256 digest; replace it now that we know the password
+            cursor.execute('UPDATE users SET password = ? WHERE id = ?', (self.hash_password(password), user[0]))
+            conn.commit()
         conn.close()
 
         if user:
@@ -140,7 +110,7 @@ class Database:
 
     def add_user(self, username, password, email, role):
         """Add new user to the database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         try:
@@ -158,7 +128,7 @@ class Database:
 
     def get_user_by_username(self, username):
         """Get user data by username"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('SELECT id, username, email, role FROM users WHERE username = ?', (username,))
@@ -177,7 +147,7 @@ class Database:
     def add_patient_details(self, user_id, full_name, date_of_birth, gender,
                           address, phone, emergency_contact, medical_history):
         """Add patient details to the database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -194,7 +164,7 @@ class Database:
 
     def get_patient_details(self, user_id):
         """Get patient details by user ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -220,44 +190,39 @@ class Database:
         return None
 
     def save_scan_result(self, patient_id, scan_image_path, predicted_class,
-                        confidence, probabilities):
-        """Save scan result to the database"""
-        conn = sqlite3.connect(self.db_path)
+                        confidence, class_probabilities):
+        """Save scan result to the database.
+
+        ``class_probabilities`` is the full vector (list, array or {class: p})
+        and is stored as a float32 BLOB.
+        """
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO scan_results (
-                patient_id, scan_image_path, predicted_class,
+            INSERT INTO scans (
+                user_id, image_path, prediction,
                 confidence, probabilities
             )
             VALUES (?, ?, ?, ?, ?)
         ''', (patient_id, scan_image_path, predicted_class,
-              confidence, json.dumps(probabilities)))
+              confidence, probabilities.encode(class_probabilities)))
         
         scan_id = cursor.lastrowid
-
-        # Log activity
-        cursor.execute('''
-            INSERT INTO activity_log (user_id, action, details)
-            VALUES (?, ?, ?)
-        ''', (patient_id, 'New Scan', f'Scan ID: {scan_id}, Class: {predicted_class}'))
-
         conn.commit()
         conn.close()
+
+        # Log activity; written in the background, outside this transaction
+        activity_log.get_writer(self.db_path).log(
+            patient_id, 'New Scan', f'Scan ID: {scan_id}, Class: {predicted_class}')
         return scan_id
 
     def get_latest_scan(self, patient_id):
         """Get the most recent scan result for a patient"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT id, scan_date, predicted_class, confidence, probabilities
-            FROM scan_results
-            WHERE patient_id = ?
-            ORDER BY scan_date DESC
-            LIMIT 1
-        ''', (patient_id,))
+        cursor.execute(LATEST_SCAN_SQL, (patient_id,))
         
         scan = cursor.fetchone()
         conn.close()
@@ -268,93 +233,81 @@ class Database:
                 'scan_date': scan[1],
                 'predicted_class': scan[2],
                 'confidence': scan[3],
-                'probabilities': json.loads(scan[4])
+                'probabilities': probabilities.as_dict(probabilities.decode(scan[4]))
             }
         return None
 
-    def get_scan_history(self, patient_id):
-        """Get scan history for a patient"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_scan_history(self, patient_id, cursor=None, limit=20):
+        """Get one page of a patient's scan history, newest first.
 
-        cursor.execute('''
-            SELECT id, scan_date, predicted_class, confidence, probabilities
-            FROM scan_results
-            WHERE patient_id = ?
-            ORDER BY scan_date DESC
-        ''', (patient_id,))
-        
-        scans = cursor.fetchall()
+        Returns (scans, next_cursor); pass next_cursor back to get the
+        following page, it is None on the last page.
+        """
+        conn = self._connect()
+        page = fetch_page(conn, SCAN_HISTORY_QUERY, (patient_id,), cursor, limit,
+                          key=lambda scan: (scan[1], scan[0]))
         conn.close()
 
+        # One frombuffer for the whole page instead of a decode per row
+        matrix = probabilities.decode_many([scan[4] for scan in page.items])
         return [{
             'id': scan[0],
             'scan_date': scan[1],
             'predicted_class': scan[2],
             'confidence': scan[3],
-            'probabilities': json.loads(scan[4])
-        } for scan in scans]
+            'probabilities': probabilities.as_dict(vector)
+        } for scan, vector in zip(page.items, matrix)], page.next_cursor
+
+    def get_probability_matrix(self, since=None):
+        """All stored probability vectors (optionally from ``since`` on) as an (n, classes) array"""
+        conn = self._connect()
+        if since:
+            matrix = probabilities.load_matrix(
+                conn, 'SELECT probabilities FROM scans WHERE created_at >= ?', (since,))
+        else:
+            matrix = probabilities.load_matrix(conn, 'SELECT probabilities FROM scans')
+        conn.close()
+        return matrix
+
+    def get_scan_count(self, patient_id):
+        """Get number of scans for a patient"""
+        conn = self._connect()
+        count = stats.user_scan_count(conn, patient_id)
+        conn.close()
+        return count
 
     def get_total_patients(self):
         """Get total number of patients"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT COUNT(*) FROM users WHERE role = ?', ('patient',))
-        count = cursor.fetchone()[0]
+        conn = self._connect()
+        count = stats.get_counter(conn, 'users.role.patient')
         conn.close()
         return count
 
     def get_total_scans(self):
         """Get total number of scans"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT COUNT(*) FROM scan_results')
-        count = cursor.fetchone()[0]
+        conn = self._connect()
+        count = stats.get_counter(conn, 'scans.total')
         conn.close()
         return count
 
     def get_active_patients(self):
         """Get number of active patients (with scans in last 30 days)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT COUNT(DISTINCT patient_id)
-            FROM scan_results
-            WHERE scan_date >= datetime('now', '-30 days')
-        ''')
-        count = cursor.fetchone()[0]
+        conn = self._connect()
+        count = stats.active_patients(conn, days=30)
         conn.close()
         return count
 
     def get_recent_activity(self, limit=10):
-        """Get recent activity log entries"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT al.timestamp, al.action, u.username, al.details
-            FROM activity_log al
-            JOIN users u ON al.user_id = u.id
-            ORDER BY al.timestamp DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        activities = cursor.fetchall()
+        """Get recent activity log entries, including ones not written yet"""
+        conn = self._connect()
+        activities = activity_log.recent_activity(activity_log.get_writer(self.db_path), conn,
+                                                  RECENT_ACTIVITY_SQL, limit)
         conn.close()
-
-        return [{
-            'time': activity[0],
-            'action': activity[1],
-            'user': activity[2],
-            'details': activity[3]
-        } for activity in activities]
+        return activities
 
     def get_last_backup(self):
         """Get last backup timestamp"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -370,39 +323,27 @@ class Database:
 
     def get_next_checkup(self, patient_id):
         """Get next checkup date for a patient"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT setting_value
-            FROM system_settings
-            WHERE setting_key = ?
-        ''', (f'next_checkup_{patient_id}',))
-        
-        result = cursor.fetchone()
-        conn.close()
-
-        return result[0] if result else 'Not scheduled'
+        return patient_attributes.get_cache(self.db_path).get(patient_id, 'next_checkup')
 
     def get_doctor_notes(self, patient_id):
         """Get doctor's notes for a patient"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return patient_attributes.get_cache(self.db_path).get(patient_id, 'doctor_notes')
 
-        cursor.execute('''
-            SELECT setting_value
-            FROM system_settings
-            WHERE setting_key = ?
-        ''', (f'doctor_notes_{patient_id}',))
-        
-        result = cursor.fetchone()
-        conn.close()
+    def get_patient_attributes(self, patient_ids):
+        """Next checkup and doctor's notes for many patients with at most one query"""
+        return patient_attributes.get_cache(self.db_path).get_many(patient_ids)
 
-        return result[0] if result else 'No notes available'
+    def set_next_checkup(self, patient_id, checkup_date):
+        """Set (or with None, clear) a patient's next checkup date"""
+        patient_attributes.get_cache(self.db_path).set(patient_id, 'next_checkup', checkup_date)
+
+    def set_doctor_notes(self, patient_id, notes):
+        """Set (or with None, clear) the doctor's notes for a patient"""
+        patient_attributes.get_cache(self.db_path).set(patient_id, 'doctor_notes', notes)
 
     def get_user_by_email(self, email):
         """Get user data by email"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('SELECT id, username, email, role FROM users WHERE email = ?', (email,))
@@ -420,7 +361,7 @@ class Database:
 
     def get_user_by_oauth(self, provider, oauth_id):
         """Get user data by OAuth provider and ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -443,7 +384,7 @@ class Database:
 
     def add_oauth_user(self, username, email, oauth_provider, oauth_id, role='patient'):
         """Add new user with OAuth credentials"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         try:
@@ -467,7 +408,7 @@ class Database:
 
     def update_user_profile(self, user_id, **kwargs):
         """Update user profile information"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         try:
@@ -495,11 +436,10 @@ class Database:
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
+        g.db = get_pool(
             current_app.config['DATABASE'],
             detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        ).acquire(row_factory=sqlite3.Row)
 
     return g.db
 
@@ -510,31 +450,8 @@ def close_db(e=None):
 
 def init_db():
     db = get_db()
-    
-    # Create tables
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_admin BOOLEAN NOT NULL DEFAULT 0,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            prediction TEXT NOT NULL,
-            confidence REAL NOT NULL,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
+    ensure_schema(db)
+
     # Create default admin user if not exists
     admin_exists = db.execute(
         'SELECT id FROM users WHERE username = ?',
@@ -543,12 +460,12 @@ def init_db():
     
     if not admin_exists:
         db.execute(
-            'INSERT INTO users (username, email, password_hash, is_admin) VALUES (?, ?, ?, ?)',
+            'INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)',
             (
                 current_app.config['ADMIN_USERNAME'],
                 current_app.config['ADMIN_EMAIL'],
-                generate_password_hash(current_app.config['ADMIN_PASSWORD']),
-                True
+                hash_password(current_app.config['ADMIN_PASSWORD']),
+                'admin'
             )
         )
     
@@ -560,7 +477,7 @@ def init_app(app):
 
 @click.command('init-db')
 def init_db_command():
-    """Clear existing data and create new tables."""
+    """Create or upgrade the database tables."""
     init_db()
     click.echo('Initialized the database.')
 
@@ -597,23 +514,11 @@ def get_recent_scans(limit=10):
 
 def get_stats():
     db = get_db()
-    stats = {}
-    
-    # Get total patients (non-admin users)
-    stats['total_patients'] = db.execute(
-        'SELECT COUNT(*) as count FROM users WHERE is_admin = 0'
-    ).fetchone()['count']
+    summary = {}
     
-    # Get total scans
-    stats['total_scans'] = db.execute(
-        'SELECT COUNT(*) as count FROM scans'
-    ).fetchone()['count']
-    
-    # Get scans by prediction
-    stats['prediction_counts'] = db.execute(
-        '''SELECT prediction, COUNT(*) as count 
-           FROM scans 
-           GROUP BY prediction'''
-    ).fetchall()
+    # Maintained by triggers (see stats.py) instead of counting on every call
+    summary['total_patients'] = stats.get_counter(db, 'users.role.patient')
+    summary['total_scans'] = stats.get_counter(db, 'scans.total')
+    summary['prediction_counts'] = stats.class_distribution(db)
     
-    return stats 
\ No newline at end of file
+    return summary 
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""Bounded SQLite connection pools, one per database file.
+
+One connection per request: a request handler checks out a single
+connection (``app.get_db``) and hands it to every helper it calls. Helpers
+that can run inside a request take an optional ``conn`` and only check out
+their own (``ConnectionPool.connection``) when called without one, so a
+request never waits on the pool for a second connection while holding its
+first.
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# Applied once when a pooled connection is opened
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # Readers no longer block the writer (and vice versa)
+    ('synchronous', 'NORMAL'),      # Safe with WAL; skips an fsync per commit
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),         # Negative means KiB: 16 MB page cache per connection
+    ('busy_timeout', 5000),         # Wait for a competing writer instead of failing immediately
+)
+
+
+class PooledConnection:
+    """A pooled sqlite3 connection; ``close()`` hands it back to the pool.
+
+    Everything else is delegated to the underlying connection, so code written
+    against ``sqlite3.connect`` works unchanged. A connection that is dropped
+    without being closed is returned when the wrapper is garbage collected.
+    Statements run through ``execute``/``executemany``/``executescript``,
+    cursors from ``cursor()`` and ``commit`` are timed into
+    metrics.SQL_SECONDS while metrics are enabled.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def _connection(self):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return conn
+
+    def execute(self, sql, parameters=()):
+        with metrics.time_sql(self._pool.db_path, sql):
+            return self._connection().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with metrics.time_sql(self._pool.db_path, sql):
+            return self._connection().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        with metrics.time_sql(self._pool.db_path, script):
+            return self._connection().executescript(script)
+
+    def commit(self):
+        with metrics.time_sql(self._pool.db_path, 'COMMIT'):
+            return self._connection().commit()
+
+    def cursor(self, *args):
+        cursor = self._connection().cursor(*args)
+        return TimedCursor(cursor, self._pool.db_path) if metrics.ENABLED else cursor
+
+    @property
+    def row_factory(self):
+        return self._conn.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self._conn.row_factory = factory
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool._release(conn)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def __del__(self):
+        if self.__dict__.get('_conn') is not None:
+            self.close()
+
+
+class TimedCursor:
+    """A cursor whose statements are timed like PooledConnection.execute"""
+
+    def __init__(self, cursor, db_path):
+        self._cursor = cursor
+        self._db_path = db_path
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, parameters=()):
+        with metrics.time_sql(self._db_path, sql):
+            self._cursor.execute(sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        with metrics.time_sql(self._db_path, sql):
+            self._cursor.executemany(sql, seq_of_parameters)
+        return self
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections to one database file"""
+
+    def __init__(self, db_path, max_size=8, timeout=30.0, pragmas=DEFAULT_PRAGMAS, detect_types=0):
+        self.db_path = db_path
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.detect_types = detect_types
+        self._idle = deque()
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Metrics
+        self._acquires = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def acquire(self, timeout=None, row_factory=None):
+        """Check out a connection, waiting up to ``timeout`` seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        with self._cond:
+            waited = False
+            while not self._idle and self._created >= self.max_size:
+                waited = True
+                remaining = timeout - (time.perf_counter() - started)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if self._idle or self._created < self.max_size:
+                        break
+                    self._timeouts += 1
+                    raise sqlite3.OperationalError(
+                        f'Timed out after {timeout}s waiting for a database connection')
+
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # Reserve the slot now; the connection is opened outside the lock
+                self._created += 1
+                conn = None
+            self._in_use += 1
+            self._acquires += 1
+            if waited:
+                wait = time.perf_counter() - started
+                self._waits += 1
+                self._wait_seconds += wait
+                self._max_wait_seconds = max(self._max_wait_seconds, wait)
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        conn.row_factory = row_factory
+        return PooledConnection(self, conn)
+
+    @contextmanager
+    def connection(self, conn=None):
+        """Use the caller's ``conn`` if given, else check one out for the block"""
+        if conn is not None:
+            yield conn
+            return
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'db_path': self.db_path,
+                'max_size': self.max_size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'acquires': self._acquires,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_ms': self._wait_seconds * 1000.0,
+                'max_wait_ms': self._max_wait_seconds * 1000.0,
+            }
+
+    def close_all(self):
+        """Close idle connections; checked-out ones are closed when released"""
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+
+    def _open(self):
+        # Pooled connections move between request threads, so the same-thread check is off
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               detect_types=self.detect_types)
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            # A broken connection is dropped and its slot freed
+            conn.close()
+            conn = None
+        with self._cond:
+            self._in_use -= 1
+            if conn is None:
+                self._created -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pool_options = {}
+
+
+def configure(**options):
+    """Set default ConnectionPool options (max_size, timeout, pragmas) for pools created later"""
+    _pool_options.update(options)
+
+
+def get_pool(db_path, detect_types=0):
+    """Return the process-wide pool for ``db_path``, creating it on first use"""
+    key = (db_path, detect_types)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(db_path, detect_types=detect_types, **_pool_options)
+    return pool
+
+
+def all_stats():
+    return [pool.stats() for pool in list(_pools.values())]
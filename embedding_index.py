@@ -0,0 +1,260 @@
+"""Similar-scan search over penultimate-layer embeddings.
+
+Every classified scan gets a row in ``scan_embeddings``: the model's
+penultimate-layer output as a float16 BLOB (half the size of float32 and
+plenty for cosine similarity). That table is the source of truth.
+
+``EmbeddingIndex`` keeps a derived copy for search in ``directory``:
+
+  vectors.f32   (n, dim) float32, L2-normalized, memory-mapped
+  ids.i64       scan id of each row
+  meta.json     model version and dimension the rows belong to
+  centroids.f32 / lists.i32   optional IVF partitioning (see ``train_ivf``)
+
+The files are append-only. ``sync`` copies the rows with a scan id above the
+last indexed one, so keeping up with new scans costs one primary-key range
+query and an append. Scan ids are handed out and committed in order (SQLite
+has one writer), so the id watermark never skips a row. Search is a dot
+product against the mapped matrix, over every row (brute force) or only the
+rows of the ``nprobe`` closest IVF lists. Embeddings from a different model
+version are not comparable; seeing a new version starts a fresh index.
+"""
+import contextlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from db_pool import get_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per index directory
+    fcntl = None
+
+STORAGE_DTYPE = np.dtype('<f2')
+_VECTOR_DTYPE = np.dtype('<f4')
+_ID_DTYPE = np.dtype('<i8')
+_LIST_DTYPE = np.dtype('<i4')
+
+SYNC_CHUNK = 5000
+
+
+def encode(embedding):
+    """Pack an embedding into a float16 BLOB"""
+    return np.asarray(embedding, dtype=STORAGE_DTYPE).reshape(-1).tobytes()
+
+
+def decode(blob):
+    return np.frombuffer(blob, dtype=STORAGE_DTYPE).astype(np.float32)
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def store(conn, scan_id, model_version, embedding):
+    """Record a scan's embedding; part of the caller's transaction"""
+    conn.execute('INSERT OR REPLACE INTO scan_embeddings (scan_id, model_version, embedding) VALUES (?, ?, ?)',
+                 (scan_id, model_version, encode(embedding)))
+
+
+def scan_embedding(conn, scan_id):
+    """(model_version, float32 vector) of a scan, or None"""
+    row = conn.execute('SELECT model_version, embedding FROM scan_embeddings WHERE scan_id = ?',
+                       (scan_id,)).fetchone()
+    return (row[0], decode(row[1])) if row else None
+
+
+class EmbeddingIndex:
+    def __init__(self, directory, db_path):
+        self.directory = directory
+        self.pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self.model_version = None
+        self.dim = None
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._centroids = None
+        self._lists = None
+        self._loaded = False
+
+    def sync(self, model_version, conn=None):
+        """Append the scans embedded with ``model_version`` that are not indexed yet; returns how many.
+
+        Uses ``conn`` when the caller holds one. Otherwise a connection is
+        checked out before the index lock is taken, so nothing waits on the
+        pool while holding the lock.
+        """
+        added = 0
+        with self.pool.connection(conn) as conn, self._lock, self._file_lock():
+            self._load()
+            if model_version != self.model_version:
+                self._reset(model_version)
+            while True:
+                last_id = int(self._ids[-1]) if len(self._ids) else 0
+                rows = conn.execute('SELECT scan_id, embedding FROM scan_embeddings '
+                                    'WHERE model_version = ? AND scan_id > ? ORDER BY scan_id LIMIT ?',
+                                    (model_version, last_id, SYNC_CHUNK)).fetchall()
+                if not rows:
+                    break
+                self._append([row[0] for row in rows], np.stack([decode(row[1]) for row in rows]))
+                added += len(rows)
+        return added
+
+    def rebuild(self, model_version):
+        """Start over from scan_embeddings, dropping the rows of deleted scans"""
+        with self._lock, self._file_lock():
+            self._reset(model_version)
+        return self.sync(model_version)
+
+    def search(self, query, k=5, nprobe=8, exclude=()):
+        """[(scan_id, cosine similarity)] of the ``k`` nearest indexed scans, best first"""
+        with self._lock:
+            self._load()
+            vectors, ids, centroids, lists = self._vectors, self._ids, self._centroids, self._lists
+        if not len(ids):
+            return []
+        query = _normalize(query).reshape(-1)
+        if query.shape[0] != vectors.shape[1]:
+            raise ValueError(f'Query has {query.shape[0]} dimensions, index has {vectors.shape[1]}')
+
+        if centroids is not None and len(lists) == len(ids):
+            probe = np.argsort(centroids @ query)[::-1][:max(1, nprobe)]
+            rows = np.flatnonzero(np.isin(lists, probe))
+            scores = vectors[rows] @ query
+        else:
+            rows = None
+            scores = vectors @ query
+
+        wanted = min(len(scores), k + len(exclude))
+        if not wanted:
+            return []
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        excluded = set(exclude)
+        results = []
+        for i in top:
+            scan_id = int(ids[rows[i] if rows is not None else i])
+            if scan_id not in excluded:
+                results.append((scan_id, float(scores[i])))
+        return results[:k]
+
+    def train_ivf(self, lists, iterations=10, sample_size=50000, seed=0):
+        """Partition the indexed rows into ``lists`` k-means clusters for IVF search"""
+        with self._lock, self._file_lock():
+            self._load()
+            count = len(self._ids)
+            if count < lists:
+                raise ValueError(f'Need at least {lists} indexed scans to train {lists} lists, have {count}')
+            rng = np.random.default_rng(seed)
+            sample = self._vectors[np.sort(rng.choice(count, min(count, sample_size), replace=False))]
+            centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(lists):
+                    members = sample[assignment == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            with open(self._path('centroids.f32'), 'wb') as f:
+                f.write(centroids.astype(_VECTOR_DTYPE).tobytes())
+            with open(self._path('lists.i32'), 'wb') as f:
+                for start in range(0, count, SYNC_CHUNK):
+                    chunk = self._vectors[start:start + SYNC_CHUNK]
+                    f.write(np.argmax(chunk @ centroids.T, axis=1).astype(_LIST_DTYPE).tobytes())
+            self._map()
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'directory': self.directory,
+                'model_version': self.model_version,
+                'dim': self.dim,
+                'vectors': int(len(self._ids)),
+                'last_scan_id': int(self._ids[-1]) if len(self._ids) else None,
+                'ivf_lists': None if self._centroids is None else int(len(self._centroids)),
+            }
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # Serializes writers across processes sharing the directory
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path('lock'), 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        # Caller holds self._lock; re-mapped on every call so appends by other processes show up
+        if not os.path.exists(self._path('meta.json')):
+            return
+        if not self._loaded or self._count_on_disk() != len(self._ids):
+            with open(self._path('meta.json')) as f:
+                meta = json.load(f)
+            self.model_version, self.dim = meta['model_version'], meta['dim']
+            self._map()
+            self._loaded = True
+
+    def _count_on_disk(self):
+        if not self.dim or not os.path.exists(self._path('ids.i64')):
+            return 0
+        return min(os.path.getsize(self._path('vectors.f32')) // (self.dim * _VECTOR_DTYPE.itemsize),
+                   os.path.getsize(self._path('ids.i64')) // _ID_DTYPE.itemsize)
+
+    def _map(self):
+        count = self._count_on_disk()
+        if count:
+            self._vectors = np.memmap(self._path('vectors.f32'), dtype=_VECTOR_DTYPE, mode='r',
+                                      shape=(count, self.dim))
+            self._ids = np.memmap(self._path('ids.i64'), dtype=_ID_DTYPE, mode='r', shape=(count,))
+        else:
+            self._vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+
+        self._centroids = self._lists = None
+        if os.path.exists(self._path('centroids.f32')):
+            self._centroids = np.fromfile(self._path('centroids.f32'), dtype=_VECTOR_DTYPE).reshape(-1, self.dim)
+            self._lists = np.fromfile(self._path('lists.i32'), dtype=_LIST_DTYPE)[:count]
+
+    def _reset(self, model_version, dim=None):
+        for name in ('vectors.f32', 'ids.i64', 'centroids.f32', 'lists.i32'):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.model_version, self.dim = model_version, dim
+        self._write_meta()
+        self._map()
+
+    def _write_meta(self):
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'model_version': self.model_version, 'dim': self.dim}, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def _append(self, scan_ids, embeddings):
+        vectors = _normalize(embeddings)
+        if not self.dim:
+            self.dim = vectors.shape[1]
+            self._write_meta()
+        # Vectors before ids: a reader sizes the index by the shorter of the two files
+        with open(self._path('vectors.f32'), 'ab') as f:
+            f.write(vectors.astype(_VECTOR_DTYPE).tobytes())
+        with open(self._path('ids.i64'), 'ab') as f:
+            f.write(np.asarray(scan_ids, dtype=_ID_DTYPE).tobytes())
+        if self._centroids is not None:
+            with open(self._path('lists.i32'), 'ab') as f:
+                f.write(np.argmax(vectors @ self._centroids.T, axis=1).astype(_LIST_DTYPE).tobytes())
+        self._map()
+        self._loaded = True
@@ -0,0 +1,289 @@
+"""Grad-CAM explanation maps, computed in the background and cached.
+
+A Grad-CAM map needs a forward and a backward pass, roughly twice the cost
+of a prediction, so it is never computed on the request path:
+
+- ``Explainer.request`` looks the map up in ``ExplanationCache`` and, on a
+  miss, queues the image and returns at once;
+- a worker thread takes the first queued image, keeps collecting until
+  ``max_batch_size`` images are waiting or ``max_wait_ms`` has passed, and
+  runs the whole batch through ``explain_fn`` in one call;
+- maps are stored keyed by (image hash, model version, class), so a repeat
+  upload or a second viewer never recomputes one. Rows of other model
+  versions are purged the first time a new version is seen, as in the
+  prediction cache;
+- only permanent failures (a model that cannot explain, an image that does
+  not decode) are remembered and reported as failed. Anything else (a
+  locked database, a model still loading, a crashed worker) drops the
+  image from the queue, and the next request for it queues it again.
+
+Maps are kept at the resolution of the model's last feature map (a few
+pixels square) as uint8, and ``render_overlay`` turns one into a
+transparent PNG that the scan view stretches over the image.
+"""
+import io
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from db_pool import get_pool
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE, decode_pixels
+
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+
+BATCH_SECONDS = metrics.Histogram('alzdx_explanation_batch_seconds',
+                                  'Grad-CAM time per batch, kept apart from inference')
+
+# Failures remembered so a broken image or model is not retried on every poll
+_MAX_FAILURES = 1000
+
+# Colormap stops (blue -> cyan -> yellow -> red) for render_overlay
+_COLOR_STOPS = np.array([0.0, 0.35, 0.65, 1.0])
+_COLORS = np.array([[0, 0, 255], [0, 255, 255], [255, 255, 0], [255, 0, 0]], dtype=np.float32)
+
+
+def encode_map(heatmap):
+    """uint8 (h, w) of a map in [0, 1]"""
+    return np.clip(np.rint(np.asarray(heatmap, dtype=np.float32) * 255.0), 0, 255).astype(np.uint8)
+
+
+def render_overlay(heatmap, size=256, max_alpha=0.6):
+    """PNG bytes: the uint8 map smoothly upscaled to ``size`` x ``size``, colored, opacity rising with heat"""
+    heat = np.asarray(Image.fromarray(heatmap).resize((size, size), Image.BILINEAR), dtype=np.float32) / 255.0
+    rgba = np.empty(heat.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(heat, _COLOR_STOPS, _COLORS[:, channel])
+    rgba[..., 3] = heat * (255.0 * max_alpha)
+    out = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+class ExplanationCache:
+    """Grad-CAM maps in the ``explanations`` table, keyed by (image hash, model version, class)"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        self._current_version = None
+
+    def get(self, image_hash, model_version, class_index, conn=None):
+        """Return (uint8 map, compute_ms), or None; uses ``conn`` when the caller holds one"""
+        with self.pool.connection(conn) as conn:
+            self._check_version(model_version, conn)
+            row = conn.execute('SELECT height, width, heatmap, compute_ms FROM explanations '
+                               'WHERE image_hash = ? AND model_version = ? AND class_index = ?',
+                               (image_hash, model_version, class_index)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[2], dtype=np.uint8).reshape(row[0], row[1]), row[3]
+
+    def put_many(self, rows):
+        """Store [(image_hash, model_version, class_index, map in [0, 1], compute_ms)] in one transaction"""
+        values = []
+        for image_hash, model_version, class_index, heatmap, compute_ms in rows:
+            encoded = encode_map(heatmap)
+            values.append((image_hash, model_version, class_index, encoded.shape[0], encoded.shape[1],
+                           encoded.tobytes(), compute_ms))
+        with self.pool.connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO explanations (image_hash, model_version, class_index, '
+                             'height, width, heatmap, compute_ms) VALUES (?, ?, ?, ?, ?, ?, ?)', values)
+            conn.commit()
+
+    def _check_version(self, model_version, conn):
+        """Drop maps of older model versions the first time a new one is seen"""
+        if model_version == self._current_version:
+            return
+        with self._lock:
+            if model_version == self._current_version:
+                return
+            conn.execute('DELETE FROM explanations WHERE model_version != ?', (model_version,))
+            conn.commit()
+            self._current_version = model_version
+
+
+class _PendingExplanation:
+    __slots__ = ('key', 'source', 'enqueued_at')
+
+    def __init__(self, key, source):
+        self.key = key
+        self.source = source
+        self.enqueued_at = time.perf_counter()
+
+
+class Explainer:
+    """Batches queued explanation requests through ``explain_fn`` on a background thread.
+
+    ``explain_fn(pixels, class_indices)`` takes a uint8 batch (see
+    preprocessing.decode_pixels) and returns (N, h, w) maps in [0, 1];
+    NotImplementedError means the model cannot explain. Timings are kept
+    apart from the prediction engine's, see ``stats``.
+    """
+
+    def __init__(self, explain_fn, cache, max_batch_size=8, max_wait_ms=50.0, max_pending=256,
+                 stats_window=256):
+        self.explain_fn = explain_fn
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_pending = max(1, int(max_pending))
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._batches = deque(maxlen=stats_window)
+        self.requests = 0
+        self.cache_hits = 0
+        self.explained = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='explainer', daemon=True)
+                self._thread.start()
+
+    def request(self, image_hash, model_version, class_index, source, conn=None):
+        """State of a map, queueing it if missing: {'status': ready|pending|failed, ...}
+
+        ``source`` is the image as bytes or a path; it is only read if the
+        map has to be computed. ``conn`` is the caller's connection, for the
+        cache lookup.
+        """
+        key = (image_hash, model_version, int(class_index))
+        cached = self.cache.get(*key, conn=conn)
+        with self._lock:
+            self.requests += 1
+            if cached is not None:
+                self.cache_hits += 1
+                return {'status': READY, 'heatmap': cached[0], 'compute_ms': cached[1]}
+            if key in self._failures:
+                return {'status': FAILED, 'error': self._failures[key]}
+            if key in self._pending:
+                return {'status': PENDING}
+            if len(self._pending) >= self.max_pending:
+                # Asked again on the next poll, by when the queue has moved
+                self.dropped += 1
+                return {'status': PENDING}
+            self._pending.add(key)
+        self.start()
+        self._queue.put(_PendingExplanation(key, source))
+        return {'status': PENDING}
+
+    def stats(self):
+        with self._lock:
+            batches = list(self._batches)
+            summary = {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'pending': len(self._pending),
+                'requests': self.requests,
+                'cache_hits': self.cache_hits,
+                'explained': self.explained,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'last_error': self.last_error,
+                'recent_batches': batches,
+            }
+        if batches:
+            summary['mean_batch_size'] = float(np.mean([b['size'] for b in batches]))
+            summary['mean_queue_wait_ms'] = float(np.mean([b['mean_queue_wait_ms'] for b in batches]))
+            summary['mean_decode_ms'] = float(np.mean([b['decode_ms'] for b in batches]))
+            summary['mean_explain_ms'] = float(np.mean([b['explain_ms'] for b in batches]))
+        return summary
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect(self._queue.get())
+            try:
+                self._explain(batch)
+            except Exception as e:
+                self._retry(batch, f'Explanation failed: {e}')
+            finally:
+                with self._lock:
+                    for item in batch:
+                        self._pending.discard(item.key)
+
+    def _explain(self, batch):
+        started = time.perf_counter()
+        pixels = np.empty((len(batch), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=PIXEL_DTYPE)
+        decoded = []
+        for item in batch:
+            data = item.source
+            if isinstance(data, str):
+                try:
+                    with open(data, 'rb') as f:
+                        data = f.read()
+                except OSError as e:
+                    # e.g. the upload is still being written in the background
+                    self._retry([item], f'Could not read image: {e}')
+                    continue
+            try:
+                decode_pixels(data, out=pixels[len(decoded)])
+                decoded.append(item)
+            except Exception as e:
+                self._fail([item], f'Could not decode image: {e}')
+        if not decoded:
+            return
+
+        decoded_at = time.perf_counter()
+        try:
+            maps = self.explain_fn(pixels[:len(decoded)], [item.key[2] for item in decoded])
+        except NotImplementedError as e:
+            self._fail(decoded, str(e))
+            return
+        finished = time.perf_counter()
+
+        BATCH_SECONDS.observe(finished - decoded_at)
+        explain_ms = (finished - decoded_at) * 1000.0
+        self.cache.put_many([item.key + (heatmap, explain_ms / len(decoded))
+                             for item, heatmap in zip(decoded, maps)])
+        waits = [(started - item.enqueued_at) * 1000.0 for item in decoded]
+        with self._lock:
+            self.explained += len(decoded)
+            self._batches.append({
+                'size': len(decoded),
+                'mean_queue_wait_ms': sum(waits) / len(waits),
+                'decode_ms': (decoded_at - started) * 1000.0,
+                'explain_ms': explain_ms,
+            })
+
+    def _retry(self, items, error):
+        """Forget a transient failure; the next request queues the items again"""
+        with self._lock:
+            self.retried += len(items)
+            self.last_error = error
+
+    def _fail(self, items, error):
+        """Remember a permanent failure, reported until the process restarts"""
+        with self._lock:
+            self.failed += len(items)
+            if len(self._failures) + len(items) > _MAX_FAILURES:
+                self._failures.clear()
+            for item in items:
+                self._failures[item.key] = error
@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+import time
+
+import click
+import numpy as np
+
+from config import Config
+from model_registry import get_loader
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE, decode_pixels, normalize
+
+QUANTIZATION_MODES = ('none', 'float16', 'int8')
+
+
+def load_calibration_images(image_dir, limit=None):
+    """Decode the sample MRIs (JPEGs only; the PNGs are UI screenshots) into one uint8 batch"""
+    paths = sorted(p for p in glob.glob(os.path.join(image_dir, '*'))
+                   if p.lower().endswith(('.jpg', '.jpeg')))
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        raise click.ClickException(f'No calibration images found in {image_dir}')
+
+    images = np.empty((len(paths), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=PIXEL_DTYPE)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            decode_pixels(f.read(), out=images[i])
+    return paths, images
+
+
+def convert_to_tflite(keras_path, quantization, calibration_images):
+    """Convert the Keras model to a TFLite flatbuffer with optional post-training quantization.
+
+    The flatbuffer takes float32 input in [0, 1]; TFLiteModel scales the pixels.
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # Weights and activations in INT8; inputs/outputs stay float32 so the
+        # exported model is a drop-in replacement behind the same preprocessing
+        def representative_dataset():
+            for image in calibration_images:
+                yield [normalize(image[np.newaxis])]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+def _timed_predict(model, images):
+    model.predict(images[:1])  # warm-up
+    started = time.perf_counter()
+    outputs = np.concatenate([model.predict(images[i:i + 1]) for i in range(len(images))])
+    return outputs, (time.perf_counter() - started) * 1000.0 / len(images)
+
+
+def parity_report(reference, candidate, images, paths):
+    """Compare two models image by image on the same inputs"""
+    ref_out, ref_ms = _timed_predict(reference, images)
+    cand_out, cand_ms = _timed_predict(candidate, images)
+
+    ref_top = ref_out.argmax(axis=1)
+    cand_top = cand_out.argmax(axis=1)
+    diff = np.abs(ref_out - cand_out)
+    return {
+        'images': len(paths),
+        'top1_agreement': float(np.mean(ref_top == cand_top)),
+        'max_abs_prob_diff': float(diff.max()),
+        'mean_abs_prob_diff': float(diff.mean()),
+        'reference_ms_per_image': ref_ms,
+        'candidate_ms_per_image': cand_ms,
+        'disagreements': [
+            {'image': paths[i], 'reference': int(ref_top[i]), 'candidate': int(cand_top[i])}
+            for i in np.flatnonzero(ref_top != cand_top)
+        ],
+    }
+
+
+@click.command('export-model')
+@click.option('--source', default=lambda: Config.KERAS_MODEL_PATH, show_default='Config.KERAS_MODEL_PATH',
+              help='Keras model to convert.')
+@click.option('--output', default=lambda: Config.TFLITE_MODEL_PATH, show_default='Config.TFLITE_MODEL_PATH',
+              help='Where to write the .tflite model.')
+@click.option('--quantization', type=click.Choice(QUANTIZATION_MODES), default='none', show_default=True)
+@click.option('--calibration-dir', default=os.path.join('static', 'images'), show_default=True,
+              help='Sample MRIs used for INT8 calibration and the parity report.')
+@click.option('--min-agreement', type=float, default=1.0, show_default=True,
+              help='Fail if top-1 agreement with the Keras model is lower than this.')
+def export_model_command(source, output, quantization, calibration_dir, min_agreement):
+    """Export the Keras model to TFLite and check it against the original."""
+    paths, images = load_calibration_images(calibration_dir)
+    click.echo(f'Converting {source} ({quantization}) with {len(paths)} calibration images...')
+    flatbuffer = convert_to_tflite(source, quantization, images)
+
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        f.write(flatbuffer)
+
+    report = parity_report(get_loader('keras')(source), get_loader('tflite')(tmp_output), images, paths)
+    report.update({
+        'source': source,
+        'output': output,
+        'quantization': quantization,
+        'source_bytes': os.path.getsize(source),
+        'output_bytes': len(flatbuffer),
+    })
+    report_path = os.path.splitext(output)[0] + '.parity.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    click.echo(f"Top-1 agreement {report['top1_agreement']:.2%}, max prob diff "
+               f"{report['max_abs_prob_diff']:.4f}, {report['reference_ms_per_image']:.1f} -> "
+               f"{report['candidate_ms_per_image']:.1f} ms/image. Report: {report_path}")
+
+    # The converted model only replaces the served one if it gives the same diagnoses
+    if report['top1_agreement'] < min_agreement:
+        os.remove(tmp_output)
+        raise click.ClickException(f"Top-1 agreement {report['top1_agreement']:.2%} is below "
+                                   f"{min_agreement:.2%}; {output} was not written")
+    os.replace(tmp_output, output)
+    click.echo(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    export_model_command()
@@ -0,0 +1,213 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import metrics
+
+BATCH_SECONDS = metrics.Histogram('alzdx_inference_batch_seconds', 'Model call time per micro-batch')
+BATCH_SIZE = metrics.Histogram('alzdx_inference_batch_size', 'Images per micro-batch',
+                               buckets=metrics.BATCH_SIZE_BUCKETS)
+QUEUE_WAIT_SECONDS = metrics.Histogram('alzdx_inference_queue_wait_seconds',
+                                       'Time a request waited for its micro-batch to start')
+
+
+class _PendingRequest:
+    """Images of one caller waiting to be run through the model"""
+    __slots__ = ('images', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, images):
+        self.images = images
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingEngine:
+    """Collects concurrent prediction requests into micro-batches.
+
+    Callers submit one preprocessed image at a time. A worker thread
+    takes the first waiting image, then keeps collecting until either
+    ``max_batch_size`` images are queued or ``max_wait_ms`` has passed since
+    that first image arrived. The whole batch goes through ``predict_fn`` in
+    one call and every caller gets back its own row of the output. If
+    ``predict_fn`` returns a tuple of arrays, callers get a tuple of rows.
+
+    ``predict_many`` submits several images (e.g. test-time augmentations of
+    one scan) as a group that is never split across forward passes; a group
+    larger than ``max_batch_size`` runs as a batch of its own.
+
+    With ``workers`` > 1, that many threads collect batches independently so
+    several batches can be in flight at once (e.g. one per inference process).
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10.0, stats_window=256, workers=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.workers = max(1, int(workers))
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = False
+
+        # Per-batch statistics, most recent last
+        self._batches = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._total_batches = 0
+        self._total_images = 0
+
+    def start(self):
+        """Start the worker threads if they are not already running"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._threads = [threading.Thread(target=self._run, name=f'batching-engine-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker threads once the queue has drained"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            # One shutdown sentinel per worker thread
+            for _ in self._threads:
+                self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def predict(self, image, timeout=None):
+        """Run a single image (without batch dimension) and return its output row"""
+        result = self.predict_many(np.asarray(image)[np.newaxis], timeout)
+        if isinstance(result, tuple):
+            return tuple(None if output is None else output[0] for output in result)
+        return result[0]
+
+    def predict_many(self, images, timeout=None):
+        """Run an (N, ...) group of images in one forward pass and return their N output rows"""
+        if not self._running:
+            self.start()
+
+        pending = _PendingRequest(images)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError('Timed out waiting for the inference worker')
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def queue_depth(self):
+        """Requests waiting for a worker thread"""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return aggregate and recent per-batch statistics"""
+        with self._stats_lock:
+            batches = list(self._batches)
+            total_batches = self._total_batches
+            total_images = self._total_images
+
+        summary = {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize(),
+            'total_batches': total_batches,
+            'total_images': total_images,
+            'recent_batches': batches,
+        }
+        if batches:
+            summary['mean_batch_size'] = float(np.mean([b['size'] for b in batches]))
+            summary['mean_fill_ratio'] = float(np.mean([b['fill_ratio'] for b in batches]))
+            summary['mean_queue_wait_ms'] = float(np.mean([b['mean_queue_wait_ms'] for b in batches]))
+            summary['mean_compute_ms'] = float(np.mean([b['compute_ms'] for b in batches]))
+        return summary
+
+    def _collect(self, first):
+        """Gather more requests behind ``first`` until the batch is full or the wait expires.
+
+        Returns the batch and a request that did not fit, to start the next one.
+        """
+        batch = [first]
+        rows = len(first.images)
+        deadline = first.enqueued_at + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then let _run exit
+                self._queue.put(None)
+                break
+            if rows + len(item.images) > self.max_batch_size:
+                return batch, item
+            batch.append(item)
+            rows += len(item.images)
+        return batch, None
+
+    def _run(self):
+        carried = None
+        while True:
+            first = carried if carried is not None else self._queue.get()
+            if first is None:
+                if not self._running:
+                    break
+                continue
+
+            batch, carried = self._collect(first)
+            started = time.perf_counter()
+            try:
+                images = batch[0].images if len(batch) == 1 else np.concatenate([p.images for p in batch])
+                outputs = self.predict_fn(images)
+                error = None
+            except Exception as e:
+                outputs = None
+                error = e
+            finished = time.perf_counter()
+
+            start = 0
+            for pending in batch:
+                end = start + len(pending.images)
+                if error is not None:
+                    pending.error = error
+                elif isinstance(outputs, tuple):
+                    # Several outputs per batch (e.g. probabilities and embeddings); None stays None
+                    pending.result = tuple(None if output is None else output[start:end] for output in outputs)
+                else:
+                    pending.result = outputs[start:end]
+                pending.done.set()
+                start = end
+
+            self._record(batch, start, started, finished)
+
+    def _record(self, batch, rows, started, finished):
+        waits = [(started - p.enqueued_at) * 1000.0 for p in batch]
+        record = {
+            'size': rows,
+            'requests': len(batch),
+            'fill_ratio': rows / self.max_batch_size,
+            'mean_queue_wait_ms': sum(waits) / len(waits),
+            'max_queue_wait_ms': max(waits),
+            'compute_ms': (finished - started) * 1000.0,
+        }
+        with self._stats_lock:
+            self._batches.append(record)
+            self._total_batches += 1
+            self._total_images += rows
+        if metrics.ENABLED:
+            BATCH_SECONDS.observe(finished - started)
+            BATCH_SIZE.observe(rows)
+            for wait in waits:
+                QUEUE_WAIT_SECONDS.observe(wait / 1000.0)
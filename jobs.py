@@ -0,0 +1,192 @@
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from db_pool import get_pool
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class JobQueue:
+    """Scan jobs persisted in SQLite and processed by a local worker pool.
+
+    A submitted job is written to ``scan_jobs`` (migration 10) before it is
+    queued, so a restart loses nothing. Several processes may share the
+    table: a worker claims a job by stamping it with this queue's ``owner``
+    and a lease of ``lease_seconds``, which a heartbeat thread keeps renewing
+    while the job runs. ``start`` and the heartbeat re-queue running jobs
+    whose lease has run out (their process died) but never those another
+    live process is still working on. ``handler`` is called with the job
+    dict and returns a dict of result columns (prediction, confidence,
+    scan_id) to store on the row.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, db_path, handler, workers=2, max_pending=64, lease_seconds=60.0):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.lease_seconds = max(1.0, float(lease_seconds))
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the workers and resume jobs left over from a previous run"""
+        with self._lock:
+            if self._threads:
+                return
+            conn = self.pool.acquire()
+            try:
+                self._expire_leases(conn)
+                leftover = [row[0] for row in conn.execute(
+                    'SELECT id FROM scan_jobs WHERE status = ? ORDER BY created_at', (self.QUEUED,))]
+            finally:
+                conn.close()
+
+            # Resumed jobs are always accepted, even past max_pending
+            for job_id in leftover:
+                self._queue.put(job_id)
+            self._pending += len(leftover)
+
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'scan-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name='scan-job-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, user_id, filename, image_path, image_hash, tta=False):
+        """Persist and queue a job, returning its id; raises QueueFull at capacity"""
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f'{self._pending} scans are already waiting')
+            self._pending += 1
+
+        job_id = uuid.uuid4().hex
+        conn = self.pool.acquire()
+        try:
+            conn.execute('INSERT INTO scan_jobs (id, user_id, filename, image_path, image_hash, status, tta) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, user_id, filename, image_path, image_hash, self.QUEUED, int(tta)))
+            conn.commit()
+        except sqlite3.Error:
+            with self._lock:
+                self._pending -= 1
+            raise
+        finally:
+            conn.close()
+
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Return the job row as a dict (without the lease bookkeeping), or None"""
+        conn = self.pool.acquire(row_factory=sqlite3.Row)
+        try:
+            row = conn.execute('SELECT * FROM scan_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        del job['owner'], job['lease_expires']
+        return job
+
+    def depth(self):
+        """Number of jobs queued or running in this process"""
+        with self._lock:
+            return self._pending
+
+    def _expire_leases(self, conn):
+        """Re-queue running jobs whose owner stopped renewing the lease; returns their ids"""
+        # Jobs claimed before leases existed have none; their process is long gone
+        expired = [row[0] for row in conn.execute(
+            'SELECT id FROM scan_jobs WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)',
+            (self.RUNNING, time.time()))]
+        for job_id in expired:
+            conn.execute('UPDATE scan_jobs SET status = ?, owner = NULL, lease_expires = NULL, '
+                         'updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = ? '
+                         'AND (lease_expires IS NULL OR lease_expires < ?)',
+                         (self.QUEUED, job_id, self.RUNNING, time.time()))
+        conn.commit()
+        return expired
+
+    def _heartbeat(self):
+        """Renew this queue's leases and pick up jobs abandoned by dead processes"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                conn = self.pool.acquire()
+                try:
+                    conn.execute('UPDATE scan_jobs SET lease_expires = ? WHERE owner = ? AND status = ?',
+                                 (time.time() + self.lease_seconds, self.owner, self.RUNNING))
+                    conn.commit()
+                    expired = self._expire_leases(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                # A locked database only delays the renewal; leases outlast a few missed beats
+                continue
+            with self._lock:
+                self._pending += len(expired)
+            for job_id in expired:
+                self._queue.put(job_id)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(job_id)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def _process(self, job_id):
+        conn = self.pool.acquire(row_factory=sqlite3.Row)
+        try:
+            # Claiming with a conditional update keeps a job from running twice
+            claimed = conn.execute('UPDATE scan_jobs SET status = ?, owner = ?, lease_expires = ?, '
+                                   'updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = ?',
+                                   (self.RUNNING, self.owner, time.time() + self.lease_seconds,
+                                    job_id, self.QUEUED)).rowcount
+            conn.commit()
+            if not claimed:
+                return
+            job = dict(conn.execute('SELECT * FROM scan_jobs WHERE id = ?', (job_id,)).fetchone())
+        finally:
+            conn.close()
+
+        try:
+            result = self.handler(job)
+            status, error = self.DONE, None
+        except Exception as e:
+            result, status, error = {}, self.FAILED, str(e)
+
+        conn = self.pool.acquire()
+        try:
+            conn.execute('''UPDATE scan_jobs
+                            SET status = ?, prediction = ?, confidence = ?, scan_id = ?, error = ?,
+                                owner = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+                            WHERE id = ?''',
+                         (status, result.get('prediction'), result.get('confidence'),
+                          result.get('scan_id'), error, job_id))
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,225 @@
+"""Copy data from the old alzheimer.db into the unified database.db.
+
+database.Database used to keep its own users, patient_details, scan_results,
+activity_log and system_settings tables in alzheimer.db. ``import_legacy``
+moves them into the unified schema while the app keeps running:
+
+- each table is copied in id order, ``batch_size`` rows per transaction, so
+  the write lock on database.db is only held for one short batch at a time;
+- the position reached in every table is committed with the batch itself
+  (``legacy_import_progress``), so an interrupted run resumes where it
+  stopped without copying a row twice;
+- a legacy user is merged into an existing account only when username,
+  email and role all match. One whose username or email belongs to a
+  different account (or the same account with another role) is skipped
+  and reported, and its rows in the other tables count as unknown. The
+  rest are inserted. The id mapping is kept in ``legacy_user_map`` for
+  the tables that reference users;
+- per-patient settings (``next_checkup_{id}``, ``doctor_notes_{id}``) land
+  in ``patient_attributes`` under the new user id.
+
+The source file is opened read-only and never modified.
+"""
+import sqlite3
+import time
+from functools import partial
+
+import patient_attributes
+import probabilities
+
+# Copy order matters: users first, everything else refers to them
+TABLES = ['users', 'patient_details', 'scan_results', 'activity_log', 'system_settings']
+
+# system_settings keys that embed a legacy user id; they become patient_attributes rows
+_USER_SETTING_PREFIXES = tuple(f'{name}_' for name in patient_attributes.ATTRIBUTES)
+
+
+def import_legacy(source_path, conn, batch_size=500, pause=0.0, progress=None, conflict=None):
+    """Copy every legacy table into ``conn`` (database.db); returns the progress rows.
+
+    ``pause`` sleeps between batches to leave room for other writers;
+    ``progress`` is called with (table, copied, skipped) after each batch and
+    ``conflict`` with (legacy user row, reason) for every skipped user.
+    """
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    try:
+        existing = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in TABLES:
+            state = _state(conn, source_path, table)
+            if state['done']:
+                continue
+            if table not in existing:
+                _save(conn, source_path, table, state, done=True)
+                conn.commit()
+                continue
+            while True:
+                rows = source.execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                                      (state['last_id'], batch_size))
+                columns = [d[0] for d in rows.description]
+                rows = [dict(zip(columns, row)) for row in rows.fetchall()]
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if rows:
+                        copier = _COPIERS[table]
+                        if table == 'users':
+                            copier = partial(copier, conflict=conflict)
+                        copied = copier(conn, source_path, rows)
+                        state['copied'] += copied
+                        state['skipped'] += len(rows) - copied
+                        state['last_id'] = rows[-1]['id']
+                    _save(conn, source_path, table, state, done=len(rows) < batch_size)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                if progress:
+                    progress(table, state['copied'], state['skipped'])
+                if len(rows) < batch_size:
+                    break
+                if pause:
+                    time.sleep(pause)
+    finally:
+        source.close()
+    return import_status(conn, source_path)
+
+
+def import_status(conn, source_path):
+    return [dict(zip(('table', 'last_id', 'copied', 'skipped', 'done'), row)) for row in conn.execute(
+        'SELECT table_name, last_id, copied, skipped, done FROM legacy_import_progress '
+        'WHERE source = ?', (source_path,))]
+
+
+def _state(conn, source, table):
+    row = conn.execute('SELECT last_id, copied, skipped, done FROM legacy_import_progress '
+                       'WHERE source = ? AND table_name = ?', (source, table)).fetchone()
+    if row is None:
+        return {'last_id': 0, 'copied': 0, 'skipped': 0, 'done': False}
+    return {'last_id': row[0], 'copied': row[1], 'skipped': row[2], 'done': bool(row[3])}
+
+
+def _save(conn, source, table, state, done):
+    conn.execute('''INSERT INTO legacy_import_progress (source, table_name, last_id, copied, skipped, done)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(source, table_name) DO UPDATE SET
+                        last_id = excluded.last_id, copied = excluded.copied,
+                        skipped = excluded.skipped, done = excluded.done''',
+                 (source, table, state['last_id'], state['copied'], state['skipped'], int(done)))
+
+
+def _user_map(conn, source, legacy_ids):
+    ids = sorted({i for i in legacy_ids if i is not None})
+    if not ids:
+        return {}
+    placeholders = ', '.join('?' * len(ids))
+    return dict(conn.execute(f'SELECT legacy_id, user_id FROM legacy_user_map '
+                             f'WHERE source = ? AND legacy_id IN ({placeholders})', [source] + ids))
+
+
+def _user_conflict(row, matches):
+    """Why a legacy user cannot be merged into ``matches`` (users with its username or email), or None"""
+    if len(matches) > 1:
+        return 'username and email belong to different accounts'
+    _, username, email, role = matches[0]
+    if username != row['username']:
+        return f'email belongs to account {username!r}'
+    if email != row['email']:
+        return f'username belongs to an account with email {email!r}'
+    if role != row['role']:
+        return f'existing account has role {role!r}, legacy user has {row["role"]!r}'
+    return None
+
+
+def _copy_users(conn, source, rows, conflict=None):
+    copied = 0
+    for row in rows:
+        matches = conn.execute('SELECT id, username, email, role FROM users WHERE username = ? OR email = ?',
+                               (row['username'], row['email'])).fetchall()
+        if matches:
+            reason = _user_conflict(row, matches)
+            if reason is not None:
+                if conflict:
+                    conflict(row, reason)
+                continue
+            user_id = matches[0][0]
+        else:
+            user_id = conn.execute('''INSERT INTO users (username, email, password, role,
+                                                         oauth_provider, oauth_id, created_at)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                   (row['username'], row['email'], row['password'], row['role'],
+                                    row.get('oauth_provider'), row.get('oauth_id'),
+                                    row['created_at'])).lastrowid
+        conn.execute('INSERT OR REPLACE INTO legacy_user_map (source, legacy_id, user_id) VALUES (?, ?, ?)',
+                     (source, row['id'], user_id))
+        copied += 1
+    return copied
+
+
+def _copy_patient_details(conn, source, rows):
+    users = _user_map(conn, source, [row['user_id'] for row in rows])
+    values = [(users[row['user_id']], row['full_name'], row['date_of_birth'], row['gender'],
+               row.get('address'), row.get('phone'), row.get('emergency_contact'),
+               row.get('medical_history'), row.get('profile_image'))
+              for row in rows if row['user_id'] in users]
+    conn.executemany('''INSERT INTO patient_details (user_id, full_name, date_of_birth, gender, address,
+                                                     phone, emergency_contact, medical_history, profile_image)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', values)
+    return len(values)
+
+
+def _copy_scan_results(conn, source, rows):
+    users = _user_map(conn, source, [row['patient_id'] for row in rows])
+    values = []
+    for row in rows:
+        vector = row['probabilities']
+        if isinstance(vector, str):
+            vector = probabilities.from_json(vector)
+        values.append((users.get(row['patient_id']), row['scan_image_path'], row['predicted_class'],
+                       row['confidence'], vector, row.get('notes'), row['scan_date']))
+    # Scans of unknown patients are kept with a NULL user, like app.py scans of deleted users
+    conn.executemany('''INSERT INTO scans (user_id, image_path, prediction, confidence,
+                                           probabilities, notes, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', values)
+    return len(values)
+
+
+def _copy_activity_log(conn, source, rows):
+    users = _user_map(conn, source, [row['user_id'] for row in rows])
+    values = [(users[row['user_id']], row['action'], row['details'], row['timestamp'])
+              for row in rows if row['user_id'] in users]
+    conn.executemany('INSERT INTO activity_log (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)',
+                     values)
+    return len(values)
+
+
+def _copy_system_settings(conn, source, rows):
+    legacy_ids = {}
+    for row in rows:
+        for prefix in _USER_SETTING_PREFIXES:
+            suffix = row['setting_key'][len(prefix):]
+            if row['setting_key'].startswith(prefix) and suffix.isdigit():
+                legacy_ids[row['id']] = (prefix, int(suffix))
+    users = _user_map(conn, source, [legacy_id for _, legacy_id in legacy_ids.values()])
+
+    setting_rows, attribute_rows = [], []
+    for row in rows:
+        if row['id'] in legacy_ids:
+            prefix, legacy_id = legacy_ids[row['id']]
+            if legacy_id in users:
+                attribute_rows.append((users[legacy_id], prefix[:-1], row['setting_value'], row['updated_at']))
+        else:
+            setting_rows.append((row['setting_key'], row['setting_value'], row['updated_at']))
+    # Values already present in database.db win
+    settings = conn.executemany('''INSERT INTO system_settings (setting_key, setting_value, updated_at)
+                                   VALUES (?, ?, ?) ON CONFLICT(setting_key) DO NOTHING''', setting_rows)
+    attributes = conn.executemany('''INSERT INTO patient_attributes (user_id, name, value, updated_at)
+                                     VALUES (?, ?, ?, ?) ON CONFLICT(user_id, name) DO NOTHING''', attribute_rows)
+    return max(settings.rowcount, 0) + max(attributes.rowcount, 0)
+
+
+_COPIERS = {
+    'users': _copy_users,
+    'patient_details': _copy_patient_details,
+    'scan_results': _copy_scan_results,
+    'activity_log': _copy_activity_log,
+    'system_settings': _copy_system_settings,
+}
@@ -0,0 +1,215 @@
+"""Process-local metrics in the Prometheus text format.
+
+Counters and histograms are updated in place under a lock; ``Callback``
+metrics (queue depths, model state, pool sizes) are read only when /metrics
+is scraped, so they cost nothing on the request path. With metrics disabled
+(``configure(enabled=False)``, the default until app.py turns them on),
+``stage`` and ``time_sql`` return a shared no-op context manager and the
+hot path pays one flag check.
+
+Metrics live in the process that records them: run one scrape target per
+process when serving with several (e.g. gunicorn workers).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = False
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; request stages run from well under a millisecond (hashing) to seconds (a cold model)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', 'CREATE', 'DROP', 'ALTER',
+                   'PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'ANALYZE', 'VACUUM'}
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def configure(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def _register(metric):
+    # Re-registering a name replaces the old metric (e.g. the app module imported twice)
+    with _metrics_lock:
+        _metrics[metric.name] = metric
+    return metric
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, *labelvalues, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, labels, (), value) for labels, value in sorted(values.items())]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, *labelvalues):
+        if not ENABLED:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        samples = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels, (('le', _number(bound)),), cumulative))
+            samples.append((self.name + '_sum', labels, (), total))
+            samples.append((self.name + '_count', labels, (), cumulative))
+        return samples
+
+
+class Callback:
+    """A gauge or counter whose value is read from ``fn`` at scrape time.
+
+    ``fn`` returns a number, or {labelvalues tuple: number} when the metric
+    has labels.
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), type='gauge'):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        _register(self)
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, labels, (), value) for labels, value in sorted(values.items())
+                if value is not None]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'started')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL = _NullTimer()
+
+
+# Single-image /predict and /jobs stages; /predict/batch records its own batch_* stages
+STAGE_SECONDS = Histogram('alzdx_stage_seconds', 'Time spent in each stage of scan classification', ['stage'])
+SQL_SECONDS = Histogram('alzdx_sql_seconds', 'SQL statement execution time (fetching rows excluded)',
+                        ['db', 'operation'], buckets=SQL_BUCKETS)
+
+
+def stage(name, record=True):
+    """Time a block as one stage of the /predict path: ``with metrics.stage('decode_resize'):``
+
+    Helpers shared with other paths pass ``record=False`` unless called
+    from /predict, so background work does not skew its stages.
+    """
+    return _Timer(STAGE_SECONDS, (name,)) if ENABLED and record else _NULL
+
+
+def time_sql(db_path, sql):
+    """Time one statement, labelled by database file and leading SQL keyword"""
+    if not ENABLED:
+        return _NULL
+    head = sql.lstrip()[:10].split(None, 1)
+    keyword = head[0].upper() if head else ''
+    operation = keyword.lower() if keyword in _SQL_OPERATIONS else 'other'
+    return _Timer(SQL_SECONDS, (os.path.basename(db_path), operation))
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        try:
+            samples = metric.samples()
+        except Exception:
+            # A failing callback must not take the whole scrape down
+            continue
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, extra, value in samples:
+            lines.append(f'{name}{_labels(metric.labelnames, labels, extra)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
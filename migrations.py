@@ -0,0 +1,227 @@
+"""Versioned schema migrations tracked with ``PRAGMA user_version``.
+
+database.db is the single store for app.py and database.py. ``ensure_schema``
+creates the base tables and then ``migrate`` applies every migration newer
+than the file's user_version, one transaction per migration, so a failed step
+leaves the file at the last good version. A statement is either SQL or a
+function called with the connection, for data migrations that need Python.
+
+Data from the old alzheimer.db is copied in separately by legacy_import.
+"""
+import patient_attributes
+import stats
+
+# The tables as app.py originally created them; everything since is a migration
+BASE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'patient',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS scans
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        image_path TEXT NOT NULL,
+        prediction TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id))''',
+]
+
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _add_column(table, column, definition):
+    """Step adding a column unless the table already has it (tables once created by their modules)"""
+    def add_column(conn):
+        if column not in _columns(conn, table):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return add_column
+
+
+def _drop_prediction_cache_without_vectors(conn):
+    # Entries from before full vectors were cached; cheaper to recompute than convert
+    columns = _columns(conn, 'prediction_cache')
+    if columns and 'probabilities' not in columns:
+        conn.execute('DROP TABLE prediction_cache')
+
+
+APP_MIGRATIONS = [
+    (1, 'Indexes for dashboard and admin hot paths', [
+        # dashboard(): WHERE user_id = ? ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_scans_user_created ON scans (user_id, created_at DESC)',
+        # admin pages: ORDER BY s.created_at DESC LIMIT n
+        'CREATE INDEX IF NOT EXISTS idx_scans_created ON scans (created_at DESC)',
+        # report: GROUP BY prediction without touching the table
+        'CREATE INDEX IF NOT EXISTS idx_scans_prediction ON scans (prediction)',
+        # WHERE role = "patient" (counts and patient listing ordered by created_at)
+        'CREATE INDEX IF NOT EXISTS idx_users_role_created ON users (role, created_at DESC)',
+    ]),
+    (2, 'Trigger-maintained dashboard statistics', stats.schema_statements(stats.APP_SCANS)),
+    (3, 'Keyset pagination indexes and per-user scan counts', [
+        # (created_at, id) cursors: the id tiebreaker must be in the index to avoid a sort
+        'DROP INDEX IF EXISTS idx_scans_user_created',
+        'CREATE INDEX idx_scans_user_created ON scans (user_id, created_at DESC, id DESC)',
+        'DROP INDEX IF EXISTS idx_users_role_created',
+        'CREATE INDEX idx_users_role_created ON users (role, created_at DESC, id DESC)',
+    ] + stats.user_count_statements(stats.APP_SCANS)),
+    # Scans recorded before this keep NULL (the vector was not stored)
+    (4, 'Full probability vector as a float32 BLOB', [
+        'ALTER TABLE scans ADD COLUMN probabilities BLOB',
+    ]),
+    # Same layout as alzheimer.db, written by activity_log.ActivityLogWriter
+    (5, 'Activity log', [
+        '''CREATE TABLE IF NOT EXISTS activity_log
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+        'CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log (timestamp DESC)',
+    ]),
+    # Everything database.Database kept in alzheimer.db now lives here too
+    (6, 'Unified schema for app.py and database.py', [
+        'ALTER TABLE users ADD COLUMN oauth_provider TEXT',
+        'ALTER TABLE users ADD COLUMN oauth_id TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_oauth ON users (oauth_provider, oauth_id)',
+        'ALTER TABLE scans ADD COLUMN notes TEXT',
+        '''CREATE TABLE IF NOT EXISTS patient_details
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            full_name TEXT NOT NULL,
+            date_of_birth DATE NOT NULL,
+            gender TEXT NOT NULL,
+            address TEXT,
+            phone TEXT,
+            emergency_contact TEXT,
+            medical_history TEXT,
+            profile_image TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+        'CREATE INDEX IF NOT EXISTS idx_patient_details_user ON patient_details (user_id)',
+        '''CREATE TABLE IF NOT EXISTS system_settings
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            setting_key TEXT UNIQUE NOT NULL,
+            setting_value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        # Bookkeeping for legacy_import: per-table progress and old -> new user ids
+        '''CREATE TABLE IF NOT EXISTS legacy_import_progress
+           (source TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            copied INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (source, table_name))''',
+        '''CREATE TABLE IF NOT EXISTS legacy_user_map
+           (source TEXT NOT NULL,
+            legacy_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (source, legacy_id))''',
+    ]),
+    # next_checkup_{id} / doctor_notes_{id} rows move out of system_settings
+    (7, 'Per-patient attributes', patient_attributes.schema_statements()),
+    # Penultimate-layer features for similar-scan search (float16 BLOBs, see embedding_index)
+    (8, 'Scan embeddings', [
+        '''CREATE TABLE IF NOT EXISTS scan_embeddings
+           (scan_id INTEGER PRIMARY KEY,
+            model_version TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            FOREIGN KEY (scan_id) REFERENCES scans (id))''',
+        # EmbeddingIndex.sync: WHERE model_version = ? AND scan_id > ? ORDER BY scan_id
+        'CREATE INDEX IF NOT EXISTS idx_scan_embeddings_version ON scan_embeddings (model_version, scan_id)',
+    ]),
+    # Version 2's triggers wrote NULL user ids into patient_activity_daily and failed the insert
+    (9, 'Skip scans without a user in the daily activity rollup',
+     stats.replace_scan_trigger_statements(stats.APP_SCANS)),
+    # PredictionCache, JobQueue and ExplanationCache used to create (and patch) these themselves;
+    # files that already have them only get the missing columns
+    (10, 'Prediction cache, scan jobs and explanation maps', [
+        _drop_prediction_cache_without_vectors,
+        '''CREATE TABLE IF NOT EXISTS prediction_cache
+           (image_hash TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            probabilities BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            embedding BLOB,
+            PRIMARY KEY (image_hash, model_version))''',
+        # From the same forward pass, so a cache hit can still be indexed for similar-scan search
+        _add_column('prediction_cache', 'embedding', 'BLOB'),
+        # LRU eviction: ORDER BY last_used LIMIT n
+        'CREATE INDEX IF NOT EXISTS idx_prediction_cache_last_used ON prediction_cache (last_used)',
+        '''CREATE TABLE IF NOT EXISTS scan_jobs
+           (id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            image_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            prediction TEXT,
+            confidence REAL,
+            scan_id INTEGER,
+            error TEXT,
+            tta INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+        _add_column('scan_jobs', 'tta', 'INTEGER NOT NULL DEFAULT 0'),
+        # JobQueue.start: WHERE status = ? ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_scan_jobs_status ON scan_jobs (status, created_at)',
+        '''CREATE TABLE IF NOT EXISTS explanations
+           (image_hash TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            class_index INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            heatmap BLOB NOT NULL,
+            compute_ms REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (image_hash, model_version, class_index))''',
+    ]),
+    # JobQueue leases: only jobs whose owning process stopped renewing them are re-queued
+    (11, 'Scan job owners and leases', [
+        'ALTER TABLE scan_jobs ADD COLUMN owner TEXT',
+        'ALTER TABLE scan_jobs ADD COLUMN lease_expires REAL',
+    ]),
+]
+
+def ensure_schema(conn):
+    """Create the base tables and bring ``conn`` to the latest schema version"""
+    for statement in BASE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return migrate(conn, APP_MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, migrations):
+    """Apply pending migrations and return the list of versions applied"""
+    applied = []
+    current = schema_version(conn)
+    for version, description, statements in sorted(migrations, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        current = version
+    return applied
@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE, normalize
+
+# Loaders by runtime name. Each takes a model path and returns an object with
+# a ``predict(batch)`` method that maps an (N, H, W, 3) uint8 pixel batch
+# (see preprocessing.decode_pixels) to (N, classes). Models that can also
+# return their penultimate-layer features implement
+# ``predict_features(batch)`` -> ((N, classes), (N, dim)). Models that can
+# explain a prediction implement ``explain(batch, class_indices)`` -> (N, h, w)
+# Grad-CAM maps in [0, 1].
+_LOADERS = {}
+
+
+def register_loader(runtime, loader):
+    """Register a model loader for a runtime name (e.g. 'keras')"""
+    _LOADERS[runtime] = loader
+
+
+def get_loader(runtime):
+    if runtime not in _LOADERS:
+        raise ValueError(f'Unknown model runtime: {runtime}')
+    return _LOADERS[runtime]
+
+
+def predict_features(model, batch):
+    """(outputs, embeddings) in one forward pass; embeddings is None if the model has none"""
+    if hasattr(model, 'predict_features'):
+        return model.predict_features(batch)
+    return model.predict(batch), None
+
+
+def explain(model, batch, class_indices):
+    """Grad-CAM maps of ``class_indices``; NotImplementedError if the model cannot produce them"""
+    if not hasattr(model, 'explain'):
+        raise NotImplementedError(f'{type(model).__name__} models do not support explanations')
+    return model.explain(batch, class_indices)
+
+
+class KerasModel:
+    """Serves a Keras model through one compiled ``tf.function``.
+
+    ``model.predict`` runs Keras' data adapter and callbacks on every call,
+    which costs more than the forward pass for the small batches served here.
+    ``serve`` has a fixed signature, uint8 batches of any size at INPUT_SIZE,
+    so it is traced exactly once; the cast to float, the [0, 1] scaling and
+    (if the model was built for another size) the resize run inside the graph.
+    The constructor calls it once so the trace happens at load time, not on
+    the first request.
+
+    The same forward pass also returns the input of the final classification
+    layer (the penultimate-layer embedding used for similar-scan search).
+
+    ``explain`` computes Grad-CAM over the last 4-D feature map: the class
+    score's gradient, averaged over space, weights the feature channels. It
+    is a second compiled function, traced on first use so models that never
+    explain anything do not pay for it.
+    """
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        self.model = model
+        height, width = INPUT_SIZE[1], INPUT_SIZE[0]
+        self._pixel_spec = tf.TensorSpec([None, height, width, 3], tf.uint8, name='pixels')
+        model_size = tuple(model.input_shape[1:3])
+
+        def prepare(pixels):
+            images = tf.cast(pixels, tf.float32) * (1.0 / 255.0)
+            if None not in model_size and model_size != (height, width):
+                images = tf.image.resize(images, model_size)
+            return images
+
+        self._prepare = prepare
+        self._explain = None
+        self._explain_lock = threading.Lock()
+        try:
+            network = tf.keras.Model(model.inputs, [model.output, model.layers[-1].input])
+        except (AttributeError, ValueError, TypeError):
+            # No single classification layer to tap; serve probabilities only
+            network = None
+        self.has_embeddings = network is not None
+
+        @tf.function(input_signature=[self._pixel_spec])
+        def serve(pixels):
+            images = prepare(pixels)
+            if network is None:
+                return model(images, training=False), tf.zeros([tf.shape(pixels)[0], 0])
+            outputs, features = network(images, training=False)
+            return outputs, tf.reshape(features, [tf.shape(pixels)[0], -1])
+
+        self.serve = serve
+        self.serve(tf.zeros([1, height, width, 3], tf.uint8))
+
+    def predict(self, batch):
+        return self.predict_features(batch)[0]
+
+    def predict_features(self, batch):
+        outputs, features = self.serve(np.asarray(batch, dtype=PIXEL_DTYPE))
+        return outputs.numpy(), features.numpy() if self.has_embeddings else None
+
+    def explain(self, batch, class_indices):
+        if self._explain is None:
+            with self._explain_lock:
+                if self._explain is None:
+                    self._explain = self._build_explain()
+        maps = self._explain(np.asarray(batch, dtype=PIXEL_DTYPE), np.asarray(class_indices, dtype=np.int32))
+        return maps.numpy()
+
+    def _build_explain(self):
+        import tensorflow as tf
+
+        feature_layer = None
+        for layer in reversed(self.model.layers):
+            try:
+                if len(layer.output.shape) == 4:
+                    feature_layer = layer
+                    break
+            except AttributeError:
+                continue
+        if feature_layer is None:
+            raise NotImplementedError('Model has no convolutional feature map to explain')
+        network = tf.keras.Model(self.model.inputs, [feature_layer.output, self.model.output])
+        prepare = self._prepare
+
+        @tf.function(input_signature=[self._pixel_spec, tf.TensorSpec([None], tf.int32, name='classes')])
+        def explain(pixels, classes):
+            images = prepare(pixels)
+            with tf.GradientTape() as tape:
+                features, outputs = network(images, training=False)
+                # Images are independent, so one gradient of the summed scores gives every image's own
+                scores = tf.gather(outputs, classes, batch_dims=1)
+            weights = tf.reduce_mean(tape.gradient(scores, features), axis=[1, 2], keepdims=True)
+            maps = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+            return tf.math.divide_no_nan(maps, tf.reduce_max(maps, axis=[1, 2], keepdims=True))
+
+        return explain
+
+
+def _load_keras(path):
+    # TensorFlow is only imported here so processes that never run
+    # inference (admin UI, CLI commands) never pay for it
+    import tensorflow as tf
+    return KerasModel(tf.keras.models.load_model(path))
+
+
+register_loader('keras', _load_keras)
+
+
+class TFLiteModel:
+    """Serves an exported .tflite model (see export_model.py)"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self._input = interpreter.get_input_details()[0]['index']
+        self._output = interpreter.get_output_details()[0]['index']
+        # Exported models take float32 in [0, 1]; the scaling is not part of the flatbuffer
+        self._float_input = interpreter.get_input_details()[0]['dtype'] == np.float32
+        self._batch_size = None
+        # A TFLite interpreter must not be invoked from two threads at once
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = normalize(batch) if self._float_input else np.asarray(batch)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+
+def _load_tflite(path):
+    # Prefer the standalone runtime so serving a converted model needs no TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+
+    threads = int(os.environ.get('TF_NUM_INTRAOP_THREADS', 0)) or os.cpu_count()
+    return TFLiteModel(Interpreter(model_path=path, num_threads=threads))
+
+
+register_loader('tflite', _load_tflite)
+
+
+class ModelRegistry:
+    """Loads the model on first use or in a background warm-up thread"""
+
+    UNLOADED = 'unloaded'
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self, path, runtime='keras', loader=None):
+        self.path = path
+        self.runtime = runtime
+        # An explicit loader (e.g. a worker process pool) replaces the runtime's own
+        self.loader = loader or get_loader(runtime)
+        self._model = None
+        self._state = self.UNLOADED
+        self._error = None
+        self._load_seconds = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+
+    def get(self):
+        """Return the loaded model, loading it now if needed"""
+        if self._model is not None:
+            return self._model
+
+        with self._lock:
+            if self._model is None:
+                self._load()
+        if self._model is None:
+            raise RuntimeError(f'Model failed to load: {self._error}')
+        return self._model
+
+    def predict(self, batch):
+        return self.get().predict(batch)
+
+    def predict_features(self, batch):
+        return predict_features(self.get(), batch)
+
+    def explain(self, batch, class_indices):
+        return explain(self.get(), batch, class_indices)
+
+    def set_model(self, model, runtime=None):
+        """Serve an already-built model (e.g. the benchmark's stub) instead of loading ``path``"""
+        with self._lock:
+            self._model = model
+            if runtime is not None:
+                self.runtime = runtime
+            self._error = None
+            self._load_seconds = 0.0
+            self._state = self.READY
+
+    def warm_up(self):
+        """Start loading the model in a background thread"""
+        with self._lock:
+            if self._model is not None or self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self._warm_up, name='model-warmup', daemon=True)
+            self._warmup_thread.start()
+
+    def version(self):
+        """Fingerprint of the model file; changes whenever the file is replaced"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return f'{self.runtime}:missing'
+        return f'{self.runtime}:{st.st_size}:{st.st_mtime_ns}'
+
+    def is_ready(self):
+        return self._state == self.READY
+
+    def status(self):
+        """Return readiness details for health checks"""
+        return {
+            'state': self._state,
+            'runtime': self.runtime,
+            'path': self.path,
+            'load_seconds': self._load_seconds,
+            'error': self._error,
+        }
+
+    def _warm_up(self):
+        try:
+            self.get()
+        except RuntimeError:
+            # Failure is recorded in status(); get() will retry on next use
+            pass
+        finally:
+            self._warmup_thread = None
+
+    def _load(self):
+        # Caller holds self._lock
+        self._state = self.LOADING
+        self._error = None
+        started = time.perf_counter()
+        try:
+            self._model = self.loader(self.path)
+        except Exception as e:
+            self._state = self.FAILED
+            self._error = str(e)
+            return
+        self._load_seconds = time.perf_counter() - started
+        self._state = self.READY
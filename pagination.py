@@ -0,0 +1,78 @@
+"""Keyset (cursor) pagination over (timestamp, id) ordered listings.
+
+A paginated query is written once with an ``{after}`` placeholder in its
+WHERE clause and ``ORDER BY <timestamp> DESC, <id> DESC LIMIT ?`` at the end:
+
+    SCANS = keyset_query('database.db', 'patient_scans', '''
+        SELECT * FROM scans WHERE user_id = ? {after}
+        ORDER BY created_at DESC, id DESC LIMIT ?''', 'created_at, id', (1,))
+
+``keyset_query`` registers both the first-page and the next-page form as hot
+queries. ``fetch_page`` reads one page plus one row to find out whether there
+is a next page, and returns an opaque cursor pointing just past the last row,
+so deep pages cost the same as the first one.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from query_plan import hot_query
+
+Page = namedtuple('Page', 'items next_cursor')
+KeysetQuery = namedtuple('KeysetQuery', 'first after')
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by ``encode_cursor``"""
+
+
+def keyset_query(db_path, name, sql, columns, sample_params=()):
+    """Return the (first, after) forms of ``sql`` and register both as hot queries"""
+    first = sql.format(after='')
+    after = sql.format(after=f'AND ({columns}) < (?, ?)')
+    hot_query(db_path, name, first, tuple(sample_params) + (20,))
+    hot_query(db_path, name + '_after', after, tuple(sample_params) + ('', 0, 20))
+    return KeysetQuery(first, after)
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([str(timestamp), int(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) for a cursor string; raises InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return str(timestamp), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def page_size(value, default, maximum):
+    """Clamp a requested page size (query string value or None) to [1, maximum]"""
+    try:
+        size = int(value) if value else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def fetch_page(conn, query, params, cursor=None, limit=20, key=None):
+    """Run a KeysetQuery and return a Page.
+
+    ``key`` maps a row to its (timestamp, id); by default the row's
+    ``created_at`` and ``id`` columns.
+    """
+    key = key or (lambda row: (row['created_at'], row['id']))
+    if cursor:
+        rows = conn.execute(query.after, tuple(params) + decode_cursor(cursor) + (limit + 1,)).fetchall()
+    else:
+        rows = conn.execute(query.first, tuple(params) + (limit + 1,)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key(rows[-1]))
+    return Page(rows, next_cursor)
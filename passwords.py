@@ -0,0 +1,27 @@
+"""Password hashing shared by app.py and database.Database.
+
+New hashes come from werkzeug. Accounts imported from the old alzheimer.db
+still carry unsalted SHA-256 hex digests; those verify here and should be
+replaced with ``hash_password`` on the next successful login.
+"""
+import hashlib
+import hmac
+import re
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_LEGACY_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hash_password(password):
+    return generate_password_hash(password)
+
+
+def needs_rehash(stored):
+    return bool(_LEGACY_DIGEST.match(stored or ''))
+
+
+def verify_password(stored, password):
+    if needs_rehash(stored):
+        return hmac.compare_digest(stored, hashlib.sha256(password.encode()).hexdigest())
+    return check_password_hash(stored, password)
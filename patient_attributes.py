@@ -0,0 +1,178 @@
+"""Per-patient attributes with an in-process read-through cache.
+
+``patient_attributes`` holds one row per (patient, attribute), replacing the
+``next_checkup_{id}`` / ``doctor_notes_{id}`` keys that used to pile up in
+``system_settings``. ``AttributeCache`` keeps every attribute of a patient
+as one cache entry:
+
+- ``get`` loads a patient's attributes with one query on a miss;
+- ``get_many`` serves a whole listing page with one ``IN (...)`` query for
+  the patients not already cached;
+- ``set`` and ``clear`` write through and drop the entry, so this process
+  sees its own writes immediately. Writes from other processes become
+  visible once the entry's ``ttl`` runs out.
+
+Every method takes an optional ``conn``: request handlers pass the
+request's connection so a cache miss does not check out a second one.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import get_pool
+
+# name -> value shown when the attribute has not been set
+ATTRIBUTES = {
+    'next_checkup': 'Not scheduled',
+    'doctor_notes': 'No notes available',
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+_cache_options = {}
+
+
+def schema_statements():
+    """Table plus a data migration out of the string-keyed system_settings rows"""
+    statements = ['''CREATE TABLE IF NOT EXISTS patient_attributes
+                     (user_id INTEGER NOT NULL,
+                      name TEXT NOT NULL,
+                      value TEXT NOT NULL,
+                      updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      PRIMARY KEY (user_id, name),
+                      FOREIGN KEY (user_id) REFERENCES users (id)) WITHOUT ROWID''']
+    for name in ATTRIBUTES:
+        prefix = f'{name}_'
+        statements.append(f'''INSERT OR IGNORE INTO patient_attributes (user_id, name, value, updated_at)
+                              SELECT CAST(substr(setting_key, {len(prefix) + 1}) AS INTEGER), '{name}',
+                                     setting_value, updated_at
+                              FROM system_settings
+                              WHERE setting_key GLOB '{prefix}[0-9]*'
+                                AND CAST(substr(setting_key, {len(prefix) + 1}) AS INTEGER)
+                                    IN (SELECT id FROM users)''')
+        statements.append(f"DELETE FROM system_settings WHERE setting_key GLOB '{prefix}[0-9]*'")
+    return statements
+
+
+class AttributeCache:
+    def __init__(self, db_path, ttl=60.0, max_entries=10000):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        # user_id -> (expires_at, {name: value}), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every write; a load that overlaps a write is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+
+    def get(self, user_id, name=None, conn=None):
+        """All attributes of a patient as a dict, or one of them (default if unset)"""
+        attributes = self.get_many([user_id], conn)[user_id]
+        return attributes if name is None else attributes[name]
+
+    def get_many(self, user_ids, conn=None):
+        """{user_id: {name: value}} for every id, loading the uncached ones in one query"""
+        result, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    result[user_id] = dict(entry[1])
+                    self.hits += 1
+                elif user_id not in missing:
+                    missing.append(user_id)
+            self.misses += len(missing)
+        if not missing:
+            return result
+
+        loaded = {user_id: dict(ATTRIBUTES) for user_id in missing}
+        placeholders = ', '.join('?' * len(missing))
+        with self.pool.connection(conn) as conn:
+            rows = conn.execute(f'SELECT user_id, name, value FROM patient_attributes '
+                                f'WHERE user_id IN ({placeholders})', missing).fetchall()
+        for user_id, name, value in rows:
+            loaded[user_id][name] = value
+
+        with self._lock:
+            self.queries += 1
+            if generation == self._generation:
+                expires = time.monotonic() + self.ttl
+                for user_id, attributes in loaded.items():
+                    self._entries[user_id] = (expires, attributes)
+                    self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        result.update({user_id: dict(attributes) for user_id, attributes in loaded.items()})
+        return result
+
+    def set(self, user_id, name, value, conn=None):
+        """Store an attribute (None removes it) and invalidate the patient's entry"""
+        if name not in ATTRIBUTES:
+            raise ValueError(f'Unknown patient attribute {name!r}; expected one of {", ".join(ATTRIBUTES)}')
+        if value is None:
+            self._write('DELETE FROM patient_attributes WHERE user_id = ? AND name = ?', (user_id, name), conn)
+        else:
+            self._write('''INSERT INTO patient_attributes (user_id, name, value) VALUES (?, ?, ?)
+                           ON CONFLICT(user_id, name) DO UPDATE SET
+                               value = excluded.value, updated_at = CURRENT_TIMESTAMP''',
+                        (user_id, name, value), conn)
+        self.invalidate(user_id)
+
+    def clear(self, user_id, conn=None):
+        """Delete every attribute of a patient (e.g. when the patient is deleted)"""
+        self._write('DELETE FROM patient_attributes WHERE user_id = ?', (user_id,), conn)
+        self.invalidate(user_id)
+
+    def _write(self, sql, params, conn=None):
+        # Committed before the entry is dropped, so a concurrent load cannot re-cache the old value
+        with self.pool.connection(conn) as conn:
+            conn.execute(sql, params)
+            conn.commit()
+
+    def invalidate(self, user_id=None):
+        """Drop one patient's entry, or everything when ``user_id`` is None"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'db_path': self.db_path,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'queries': self.queries,
+            }
+
+
+def configure(**options):
+    """Set default AttributeCache options for caches created later"""
+    _cache_options.update(options)
+
+
+def get_cache(db_path):
+    """Return the process-wide cache for ``db_path``, creating it on first use"""
+    cache = _caches.get(db_path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(db_path)
+            if cache is None:
+                cache = _caches[db_path] = AttributeCache(db_path, **_cache_options)
+    return cache
+
+
+def all_stats():
+    return [cache.stats() for cache in list(_caches.values())]
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+
+import embedding_index
+import probabilities
+from db_pool import get_pool
+
+
+def hash_image_bytes(data):
+    """Content hash used to key uploads"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """Persistent prediction cache keyed by (image hash, model version).
+
+    Entries live in the ``prediction_cache`` table (migration 10) so they
+    survive restarts. The table is bounded to ``max_entries`` rows by
+    evicting the least recently used ones, and rows written by any other
+    model version are purged as soon as a different model version is seen.
+    A hit only writes ``last_used`` back when the stored value is more than
+    ``touch_interval`` seconds old, so repeat hits stay read-only and do not
+    queue behind the database's writer lock.
+
+    ``lookup``, ``get`` and ``put`` take an optional ``conn`` so a request
+    can use its own connection (a touch or put commits on it).
+    """
+
+    def __init__(self, db_path, max_entries=10000, touch_interval=60.0):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.max_entries = max(1, int(max_entries))
+        self.touch_interval = max(0.0, float(touch_interval))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._current_version = None
+        self._size = self._count()
+
+    def get(self, image_hash, model_version, conn=None):
+        """Return the cached probability vector for an image, or None"""
+        entry = self.lookup(image_hash, model_version, conn)
+        return None if entry is None else entry[0]
+
+    def lookup(self, image_hash, model_version, conn=None):
+        """Return (probability vector, embedding or None) for an image, or None"""
+        with self.pool.connection(conn) as conn:
+            self._check_version(model_version, conn)
+            row = conn.execute('SELECT probabilities, embedding, last_used FROM prediction_cache '
+                               'WHERE image_hash = ? AND model_version = ?',
+                               (image_hash, model_version)).fetchone()
+            now = time.time()
+            if row is not None and now - row[2] > self.touch_interval:
+                conn.execute('UPDATE prediction_cache SET last_used = ? '
+                             'WHERE image_hash = ? AND model_version = ?',
+                             (now, image_hash, model_version))
+                conn.commit()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return probabilities.decode(row[0]), None if row[1] is None else embedding_index.decode(row[1])
+
+    def put(self, image_hash, model_version, vector, embedding=None, conn=None):
+        """Store a prediction, evicting least recently used rows past the bound"""
+        with self.pool.connection(conn) as conn:
+            self._check_version(model_version, conn)
+            encoded = (probabilities.encode(vector),
+                       None if embedding is None else embedding_index.encode(embedding), time.time())
+            # Only a new key grows the table; replacing an existing one must not bring eviction forward
+            added = conn.execute('INSERT OR IGNORE INTO prediction_cache '
+                                 '(probabilities, embedding, last_used, image_hash, model_version) '
+                                 'VALUES (?, ?, ?, ?, ?)', encoded + (image_hash, model_version)).rowcount
+            if not added:
+                conn.execute('UPDATE prediction_cache SET probabilities = ?, embedding = ?, last_used = ? '
+                             'WHERE image_hash = ? AND model_version = ?', encoded + (image_hash, model_version))
+            with self._lock:
+                self._size += added
+                evict = self._size > self.max_entries
+            if evict:
+                conn.execute('DELETE FROM prediction_cache WHERE rowid IN '
+                             '(SELECT rowid FROM prediction_cache ORDER BY last_used DESC '
+                             'LIMIT -1 OFFSET ?)', (self.max_entries,))
+            conn.commit()
+            if evict:
+                with self._lock:
+                    self._size = self._count(conn)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': self._size,
+                'max_entries': self.max_entries,
+                'model_version': self._current_version,
+            }
+
+    def _check_version(self, model_version, conn):
+        """Drop entries from older model versions the first time a new one is seen"""
+        if model_version == self._current_version:
+            return
+        with self._lock:
+            if model_version == self._current_version:
+                return
+            conn.execute('DELETE FROM prediction_cache WHERE model_version != ?', (model_version,))
+            conn.commit()
+            self._current_version = model_version
+            self._size = self._count(conn)
+
+    def _count(self, conn=None):
+        with self.pool.connection(conn) as conn:
+            return conn.execute('SELECT COUNT(*) FROM prediction_cache').fetchone()[0]
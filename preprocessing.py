@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+# Spatial input size the ResNet50 model was trained on
+INPUT_SIZE = (128, 128)
+
+# What the serving models take: raw RGB pixels, scaled inside the model graph
+PIXEL_DTYPE = np.uint8
+
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def open_image(source):
+    """Open an image from raw bytes or a binary file-like object without touching disk"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def decode_pixels(source, size=INPUT_SIZE, out=None, timed=False):
+    """Decode an upload into a uint8 (H, W, 3) RGB array at ``size``.
+
+    This is the input of every model runtime; the [0, 1] scaling happens in
+    the serving graph. JPEGs are decoded in draft mode, which lets libjpeg
+    downscale by a power of two while decoding, so full-size scans never get
+    fully materialised. Grayscale images stay single-channel until the final
+    copy, where broadcasting writes all three RGB channels in the same pass.
+    ``out`` may be a preallocated uint8 array (e.g. a row of a batch).
+    ``timed`` records the decode_resize and array_conversion stages; only
+    the single-image /predict path sets it.
+    """
+    with metrics.stage('decode_resize', record=timed):
+        img = open_image(source)
+        if img.format == 'JPEG':
+            img.draft(None, size)
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        if img.size != size:
+            img = img.resize(size)
+        # PIL decodes lazily; make the decode part of this stage, not the array conversion
+        img.load()
+
+    with metrics.stage('array_conversion', record=timed):
+        pixels = np.asarray(img)
+        if pixels.ndim == 2:
+            pixels = pixels[..., np.newaxis]
+
+        if out is None:
+            out = np.empty((size[1], size[0], 3), dtype=PIXEL_DTYPE)
+        np.copyto(out, pixels)
+    return out
+
+
+def normalize(pixels, out=None):
+    """uint8 pixels as float32 scaled to [0, 1], for consumers outside the serving graph"""
+    if out is None:
+        out = np.empty(np.shape(pixels), dtype=np.float32)
+    np.multiply(pixels, _SCALE, out=out)
+    return out
+
+
+def decode_image(source, size=INPUT_SIZE, out=None):
+    """Decode an upload into a float32 (H, W, 3) array scaled to [0, 1].
+
+    For float consumers such as TFLite calibration; ``out`` may be a
+    preallocated float32 array.
+    """
+    return normalize(decode_pixels(source, size), out=out)
@@ -0,0 +1,79 @@
+"""Class probability vectors stored as fixed-size float32 BLOBs.
+
+``scans.probabilities`` holds the full softmax output as ``len(CLASS_NAMES)``
+little-endian float32 values, 16 bytes per scan. A result set decodes into a
+single (n, classes) array with one ``np.frombuffer`` call, which is what the
+analytics below work on.
+"""
+import json
+
+import numpy as np
+
+CLASS_NAMES = ['Non-Demented', 'Very Mild Demented', 'Mild Demented', 'Moderate Demented']
+
+DTYPE = np.dtype('<f4')
+BLOB_SIZE = len(CLASS_NAMES) * DTYPE.itemsize
+# Stands in for scans stored before the vector was kept
+_MISSING = np.full(len(CLASS_NAMES), np.nan, dtype=DTYPE).tobytes()
+
+
+def encode(vector):
+    """Pack a probability vector (list, array or {class: p} dict) into a BLOB"""
+    if isinstance(vector, dict):
+        vector = [vector.get(name, np.nan) for name in CLASS_NAMES]
+    array = np.asarray(vector, dtype=DTYPE).reshape(-1)
+    if array.size != len(CLASS_NAMES):
+        raise ValueError(f'Expected {len(CLASS_NAMES)} probabilities, got {array.size}')
+    return array.tobytes()
+
+
+def decode(blob):
+    """One BLOB as a read-only float32 vector (NaN if the scan has none)"""
+    return decode_many([blob])[0]
+
+
+def decode_many(blobs):
+    """Stack BLOBs into an (n, classes) float32 array with a single frombuffer"""
+    data = b''.join(blob if blob is not None and len(blob) == BLOB_SIZE else _MISSING
+                    for blob in blobs)
+    return np.frombuffer(data, dtype=DTYPE).reshape(-1, len(CLASS_NAMES))
+
+
+def as_dict(vector):
+    return {name: float(p) for name, p in zip(CLASS_NAMES, vector)}
+
+
+def from_json(text):
+    """BLOB for a legacy ``json.dumps`` value (list in class order or {class: p})"""
+    return encode(json.loads(text))
+
+
+def load_matrix(conn, sql, params=(), chunk_size=5000):
+    """Run ``sql`` (selecting one probabilities column) and decode all rows at once"""
+    cursor = conn.execute(sql, params)
+    blobs = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        blobs.extend(row[0] for row in rows)
+    return decode_many(blobs)
+
+
+def confidence_summary(matrix, bins=10):
+    """Per predicted class: scan count, mean probability vector and a histogram of top-1 confidence"""
+    matrix = matrix[~np.isnan(matrix).any(axis=1)]
+    predicted = matrix.argmax(axis=1)
+    confidence = matrix.max(axis=1)
+    edges = np.linspace(0.0, 1.0, bins + 1)
+
+    summary = {'scans': int(len(matrix)), 'bin_edges': edges.round(4).tolist(), 'classes': {}}
+    for index, name in enumerate(CLASS_NAMES):
+        rows = predicted == index
+        counts, _ = np.histogram(confidence[rows], bins=edges)
+        summary['classes'][name] = {
+            'count': int(rows.sum()),
+            'mean_probabilities': as_dict(matrix[rows].mean(axis=0)) if rows.any() else None,
+            'confidence_histogram': counts.tolist(),
+        }
+    return summary
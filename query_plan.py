@@ -0,0 +1,48 @@
+"""Registry of hot queries and an ``EXPLAIN QUERY PLAN`` checker.
+
+Modules register the SQL they run on hot paths with ``hot_query``, which
+returns the SQL unchanged so it can be used directly:
+
+    PATIENT_SCANS_SQL = hot_query('database.db', 'patient_scans', 'SELECT ...', (1,))
+
+``check_query_plans`` explains every registered query and reports the ones
+whose plan contains a full table scan (a ``SCAN`` step not using an index).
+"""
+import re
+import sqlite3
+
+# name -> (db_path, sql, sample params)
+HOT_QUERIES = {}
+
+# "SCAN scans", "SCAN TABLE scans", "SCAN s" - but not "SCAN s USING [COVERING] INDEX ..."
+_FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+
+def hot_query(db_path, name, sql, params=()):
+    """Register ``sql`` as a hot query on ``db_path`` and return it"""
+    HOT_QUERIES[name] = (db_path, sql, tuple(params))
+    return sql
+
+
+def explain(conn, sql, params=()):
+    """Return the plan detail lines for a query"""
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check_query_plans(queries=None):
+    """Explain each hot query; return {name: [full-scan plan lines]} for offenders"""
+    queries = HOT_QUERIES if queries is None else queries
+    violations = {}
+    connections = {}
+    try:
+        for name, (db_path, sql, params) in sorted(queries.items()):
+            if db_path not in connections:
+                connections[db_path] = sqlite3.connect(db_path)
+            full_scans = [line for line in explain(connections[db_path], sql, params)
+                          if _FULL_SCAN.match(line)]
+            if full_scans:
+                violations[name] = full_scans
+    finally:
+        for conn in connections.values():
+            conn.close()
+    return violations
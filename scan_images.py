@@ -0,0 +1,137 @@
+"""Downsized scan image variants for the dashboards.
+
+Uploads live in the content-addressed BlobStore, so an image never changes
+under its digest and neither does anything derived from it. Each variant is
+rendered once to ``<root>/derived/<variant>-<size>/<aa>/<bb>/<digest>.jpg``
+and can be served with a strong ETag and an immutable ``Cache-Control``.
+The variant size is part of the path and the ETag, so changing it in the
+config produces new files and new validators instead of stale ones.
+
+``DerivativeWriter.schedule`` renders the variants on a background thread
+right after an upload; ``ensure`` renders a missing one on demand (scans
+stored before this existed, or a request that beats the background writer).
+"""
+import atexit
+import hashlib
+import io
+import os
+import posixpath
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from blob_store import write_atomic
+from preprocessing import open_image
+
+ORIGINAL = 'original'
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def render(source, size, quality=85):
+    """JPEG bytes of ``source`` scaled down to fit in ``size`` x ``size`` pixels"""
+    img = open_image(source)
+    if img.format == 'JPEG':
+        # Let libjpeg downscale while decoding, as preprocessing does
+        img.draft(None, (size, size))
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+    img.thumbnail((size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def digest_for(image_path):
+    """Content digest of a stored scan; read from the store path, hashed for legacy uploads"""
+    name = posixpath.basename(image_path.replace('\\', '/')).split('.', 1)[0]
+    if _DIGEST.match(name):
+        return name
+    with open(image_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class DerivativeStore:
+    def __init__(self, root, variants, quality=85):
+        # variants: name -> longest edge in pixels
+        self.root = root.replace('\\', '/')
+        self.variants = dict(variants)
+        self.quality = quality
+
+    def path_for(self, digest, variant):
+        size = self.variants[variant]
+        return posixpath.join(self.root, 'derived', f'{variant}-{size}', digest[:2], digest[2:4], digest + '.jpg')
+
+    def etag(self, digest, variant):
+        """Strong validator; the bytes behind it never change"""
+        if variant == ORIGINAL:
+            return digest
+        return f'{digest}-{variant}-{self.variants[variant]}'
+
+    def ensure(self, digest, variant, source):
+        """Return the variant's path, rendering it from ``source`` (bytes or a path) if missing"""
+        path = self.path_for(digest, variant)
+        if os.path.exists(path):
+            return path
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                source = f.read()
+        write_atomic(path, render(source, self.variants[variant], self.quality))
+        return path
+
+
+class DerivativeWriter:
+    """Renders every variant of new uploads on a small thread pool.
+
+    Mirrors blob_store.BackgroundWriter: ``schedule`` returns at once, a
+    digest already pending or rendered is skipped, and pending work is
+    flushed at interpreter exit. Rendering errors (e.g. an upload PIL cannot
+    read) are counted and otherwise ignored; ``ensure`` retries on request.
+    """
+
+    def __init__(self, store, max_workers=1):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivative-writer')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.errors = 0
+        atexit.register(self.flush)
+
+    def schedule(self, data, digest):
+        with self._lock:
+            if digest in self._pending:
+                return
+            if all(os.path.exists(self.store.path_for(digest, v)) for v in self.store.variants):
+                return
+            future = self._executor.submit(self._render_all, data, digest)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._done(digest))
+
+    def flush(self):
+        """Block until every scheduled rendering has finished"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result()
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'rendered': self.rendered, 'errors': self.errors}
+
+    def _render_all(self, data, digest):
+        for variant in self.store.variants:
+            try:
+                self.store.ensure(digest, variant, data)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                return
+            with self._lock:
+                self.rendered += 1
+
+    def _done(self, digest):
+        with self._lock:
+            self._pending.pop(digest, None)
@@ -0,0 +1,231 @@
+"""Trigger-maintained dashboard statistics.
+
+Instead of running COUNT(*) / GROUP BY over users and scans on every page
+view, triggers keep two small tables up to date on each write:
+
+  stats_counters          name -> value, e.g. 'users.role.patient',
+                          'scans.total', 'scans.class.Mild Demented'
+  patient_activity_daily  one row per (day, user) with that day's scan count,
+                          so "active in the last N days" only reads N days
+  user_scan_counts        user_id -> number of scans, joined by listings that
+                          show a per-patient scan count
+
+A ScanTable describes which columns of the scans table play which role.
+``reconcile`` recomputes everything from scratch to verify (and optionally
+repair) the maintained values.
+"""
+from collections import namedtuple
+
+ScanTable = namedtuple('ScanTable', 'table class_column user_column date_column')
+
+APP_SCANS = ScanTable('scans', 'prediction', 'user_id', 'created_at')
+
+
+def _bump(name_sql, delta):
+    return (f"INSERT INTO stats_counters (name, value) VALUES ({name_sql}, {delta}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + ({delta});")
+
+
+def _activity(row, spec, delta):
+    day = f'date({row}.{spec.date_column})'
+    user = f'{row}.{spec.user_column}'
+    # Scans without a user (deleted or unknown patients) have no activity row, as in _bump_user
+    statements = (f"INSERT INTO patient_activity_daily (day, user_id, scans) "
+                  f"SELECT {day}, {user}, {delta} WHERE {user} IS NOT NULL "
+                  f"ON CONFLICT(day, user_id) DO UPDATE SET scans = scans + ({delta});")
+    if delta < 0:
+        statements += f" DELETE FROM patient_activity_daily WHERE day = {day} AND user_id = {user} AND scans <= 0;"
+    return statements
+
+
+def schema_statements(spec):
+    """Tables and triggers maintaining the statistics for one database file"""
+    by_role = lambda row: f"'users.role.' || {row}.role"
+    return [
+        '''CREATE TABLE IF NOT EXISTS stats_counters
+           (name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS patient_activity_daily
+           (day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            scans INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id))''',
+
+        f'''CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+            {_bump(by_role('NEW'), 1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+            {_bump(by_role('OLD'), -1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_users_role AFTER UPDATE OF role ON users
+            WHEN OLD.role IS NOT NEW.role BEGIN
+            {_bump(by_role('OLD'), -1)}
+            {_bump(by_role('NEW'), 1)}
+        END''',
+    ] + scan_trigger_statements(spec) + rebuild_statements(spec)
+
+
+def scan_trigger_statements(spec):
+    """Triggers counting scans by class and rolling them up per day and user"""
+    t, cls = spec.table, spec.class_column
+    total = f"'{t}.total'"
+    by_class = lambda row: f"'{t}.class.' || {row}.{cls}"
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_insert AFTER INSERT ON {t} BEGIN
+            {_bump(total, 1)}
+            {_bump(by_class('NEW'), 1)}
+            {_activity('NEW', spec, 1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_delete AFTER DELETE ON {t} BEGIN
+            {_bump(total, -1)}
+            {_bump(by_class('OLD'), -1)}
+            {_activity('OLD', spec, -1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_update AFTER UPDATE OF {cls}, {spec.user_column}, {spec.date_column}
+            ON {t} BEGIN
+            {_bump(by_class('OLD'), -1)}
+            {_bump(by_class('NEW'), 1)}
+            {_activity('OLD', spec, -1)}
+            {_activity('NEW', spec, 1)}
+        END''',
+    ]
+
+
+def replace_scan_trigger_statements(spec):
+    """Drop and recreate the scan triggers, for migrations that change their bodies"""
+    t = spec.table
+    return [f'DROP TRIGGER IF EXISTS stats_{t}_{event}' for event in ('insert', 'delete', 'update')] + \
+        scan_trigger_statements(spec)
+
+
+def rebuild_statements(spec):
+    """Recompute counters and daily rollups from the base tables"""
+    t = spec.table
+    return [
+        'DELETE FROM stats_counters',
+        "INSERT INTO stats_counters (name, value) SELECT 'users.role.' || role, COUNT(*) FROM users GROUP BY role",
+        f"INSERT INTO stats_counters (name, value) SELECT '{t}.total', COUNT(*) FROM {t}",
+        f"INSERT INTO stats_counters (name, value) SELECT '{t}.class.' || {spec.class_column}, COUNT(*) "
+        f"FROM {t} GROUP BY {spec.class_column}",
+        'DELETE FROM patient_activity_daily',
+        f'INSERT INTO patient_activity_daily (day, user_id, scans) '
+        f'SELECT date({spec.date_column}), {spec.user_column}, COUNT(*) FROM {t} '
+        f'WHERE {spec.user_column} IS NOT NULL '
+        f'GROUP BY date({spec.date_column}), {spec.user_column}',
+    ]
+
+
+def user_count_statements(spec):
+    """Per-user scan counter, added after the original statistics tables"""
+    t, user = spec.table, spec.user_column
+    return [
+        '''CREATE TABLE IF NOT EXISTS user_scan_counts
+           (user_id INTEGER PRIMARY KEY,
+            scans INTEGER NOT NULL DEFAULT 0)''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_user_insert AFTER INSERT ON {t}
+            WHEN NEW.{user} IS NOT NULL BEGIN
+            {_bump_user('NEW', spec, 1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_user_delete AFTER DELETE ON {t}
+            WHEN OLD.{user} IS NOT NULL BEGIN
+            {_bump_user('OLD', spec, -1)}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS stats_{t}_user_update AFTER UPDATE OF {user} ON {t}
+            WHEN OLD.{user} IS NOT NEW.{user} BEGIN
+            {_bump_user('OLD', spec, -1)}
+            {_bump_user('NEW', spec, 1)}
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS stats_users_scan_count_delete AFTER DELETE ON users BEGIN
+            DELETE FROM user_scan_counts WHERE user_id = OLD.id;
+        END''',
+    ] + rebuild_user_count_statements(spec)
+
+
+def _bump_user(row, spec, delta):
+    # NULL users (e.g. the OLD side of an update from NULL) are simply skipped
+    return (f"INSERT INTO user_scan_counts (user_id, scans) "
+            f"SELECT {row}.{spec.user_column}, {delta} WHERE {row}.{spec.user_column} IS NOT NULL "
+            f"ON CONFLICT(user_id) DO UPDATE SET scans = scans + ({delta});")
+
+
+def rebuild_user_count_statements(spec):
+    return [
+        'DELETE FROM user_scan_counts',
+        f'INSERT INTO user_scan_counts (user_id, scans) '
+        f'SELECT {spec.user_column}, COUNT(*) FROM {spec.table} '
+        f'WHERE {spec.user_column} IS NOT NULL GROUP BY {spec.user_column}',
+    ]
+
+
+def get_counter(conn, name):
+    row = conn.execute('SELECT value FROM stats_counters WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_counters(conn, prefix):
+    """All non-zero counters under ``prefix`` as {suffix: value}, largest first"""
+    rows = conn.execute('SELECT name, value FROM stats_counters '
+                        'WHERE substr(name, 1, ?) = ? AND value != 0 ORDER BY value DESC',
+                        (len(prefix), prefix)).fetchall()
+    return {row[0][len(prefix):]: row[1] for row in rows}
+
+
+def class_distribution(conn, spec=APP_SCANS):
+    """[{'prediction', 'count'}] largest first, same shape as the old GROUP BY"""
+    return [{'prediction': name, 'count': count}
+            for name, count in get_counters(conn, f'{spec.table}.class.').items()]
+
+
+def user_scan_count(conn, user_id):
+    row = conn.execute('SELECT scans FROM user_scan_counts WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def active_patients(conn, days=30):
+    """Distinct users with a scan in the last ``days`` days, read from the daily rollup"""
+    return conn.execute('SELECT COUNT(DISTINCT user_id) FROM patient_activity_daily '
+                        'WHERE day >= date(\'now\', ?)', (f'-{int(days)} days',)).fetchone()[0]
+
+
+def reconcile(conn, spec, fix=False):
+    """Compare maintained statistics with a from-scratch recount.
+
+    Returns a list of (name, maintained, actual) mismatches. With ``fix`` the
+    maintained tables are rebuilt in one transaction.
+    """
+    t = spec.table
+    actual = {f'users.role.{role}': n
+              for role, n in conn.execute('SELECT role, COUNT(*) FROM users GROUP BY role')}
+    actual[f'{t}.total'] = conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+    actual.update({f'{t}.class.{cls}': n for cls, n in conn.execute(
+        f'SELECT {spec.class_column}, COUNT(*) FROM {t} GROUP BY {spec.class_column}')})
+    maintained = dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+
+    mismatches = [(name, maintained.get(name, 0), actual.get(name, 0))
+                  for name in sorted(set(actual) | set(maintained))
+                  if maintained.get(name, 0) != actual.get(name, 0)]
+
+    actual_days = set(conn.execute(
+        f'SELECT date({spec.date_column}), {spec.user_column}, COUNT(*) FROM {t} '
+        f'WHERE {spec.user_column} IS NOT NULL GROUP BY 1, 2').fetchall())
+    maintained_days = set(conn.execute('SELECT day, user_id, scans FROM patient_activity_daily').fetchall())
+    if actual_days != maintained_days:
+        mismatches.append(('patient_activity_daily', len(maintained_days), len(actual_days)))
+
+    actual_users = set(conn.execute(
+        f'SELECT {spec.user_column}, COUNT(*) FROM {t} '
+        f'WHERE {spec.user_column} IS NOT NULL GROUP BY 1').fetchall())
+    maintained_users = set(conn.execute('SELECT user_id, scans FROM user_scan_counts WHERE scans != 0').fetchall())
+    if actual_users != maintained_users:
+        mismatches.append(('user_scan_counts', len(maintained_users), len(actual_users)))
+
+    if mismatches and fix:
+        try:
+            conn.execute('BEGIN')
+            for statement in rebuild_statements(spec) + rebuild_user_count_statements(spec):
+                conn.execute(statement)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return mismatches
@@ -0,0 +1,40 @@
+import importlib
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The app is a set of top-level modules, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import ensure_schema  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py, imported once in a scratch working directory kept for the session"""
+    with pytest.MonkeyPatch.context() as mp:
+        # Importing app creates its databases, uploads and index files in the working directory
+        mp.chdir(tmp_path_factory.mktemp('app'))
+        yield importlib.import_module('app')
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """A fresh database.db at the latest schema version"""
+    conn = sqlite3.connect(str(tmp_path / 'database.db'))
+    ensure_schema(conn)
+    yield conn
+    conn.close()
+
+
+def add_user(conn, username, role='patient'):
+    return conn.execute('INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)',
+                        (username, f'{username}@example.com', 'x', role)).lastrowid
+
+
+def add_scan(conn, user_id, prediction='Non-Demented', created_at='2024-01-01 12:00:00'):
+    return conn.execute('INSERT INTO scans (user_id, image_path, prediction, confidence, created_at) '
+                        'VALUES (?, ?, ?, ?, ?)', (user_id, 'static/uploads/x.jpg', prediction, 0.9,
+                                                   created_at)).lastrowid
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+import activity_log
+from conftest import add_user
+from database import RECENT_ACTIVITY_SQL
+
+
+@pytest.fixture
+def writer(conn, tmp_path):
+    writer = activity_log.ActivityLogWriter(str(tmp_path / 'database.db'), flush_interval=60)
+    yield writer
+    writer.close()
+
+
+def stored(conn):
+    return conn.execute('SELECT COUNT(*) FROM activity_log').fetchone()[0]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+def test_events_are_written_behind_and_read_once(conn, writer):
+    user_id = add_user(conn, 'alice')
+    conn.commit()
+    for i in range(3):
+        writer.log(user_id, 'Login', f'#{i}')
+    assert stored(conn) == 0
+    assert [a['details'] for a in activity_log.recent_activity(writer, conn, RECENT_ACTIVITY_SQL)] == \
+        ['#2', '#1', '#0']
+
+    assert writer.flush() == 3
+    assert stored(conn) == 3
+    assert len(activity_log.recent_activity(writer, conn, RECENT_ACTIVITY_SQL)) == 3
+    assert writer.stats()['queued'] == 0
+
+
+def test_failed_batch_is_retried(conn, writer):
+    conn.execute('ALTER TABLE activity_log RENAME TO activity_log_away')
+    conn.commit()
+    writer.log(1, 'Login')
+    writer.log(1, 'Logout')
+    assert writer.flush() == 0
+    assert writer.stats()['errors'] == 1
+    assert [event[1] for event in writer.buffered()] == ['Logout', 'Login']
+
+    conn.execute('ALTER TABLE activity_log_away RENAME TO activity_log')
+    conn.commit()
+    assert writer.flush() == 2
+    assert conn.execute('SELECT action FROM activity_log ORDER BY rowid').fetchall() == [('Login',), ('Logout',)]
+
+
+def test_writer_thread_survives_errors(conn, tmp_path, monkeypatch):
+    writer = activity_log.ActivityLogWriter(str(tmp_path / 'database.db'), batch_size=1, flush_interval=0.01)
+    acquire = writer.pool.acquire
+    calls = []
+
+    def flaky_acquire(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('pool exploded')
+        return acquire(*args, **kwargs)
+
+    monkeypatch.setattr(writer.pool, 'acquire', flaky_acquire)
+    try:
+        writer.log(1, 'Login')
+        wait_for(lambda: writer.stats()['written'] == 1)
+        assert writer._thread.is_alive()
+        assert writer.stats()['last_error'] == 'pool exploded'
+        assert stored(conn) == 1
+    finally:
+        writer.close()
@@ -0,0 +1,44 @@
+import io
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from batch_scans import iter_uploads
+
+ALLOWED = {'png', 'jpg', 'jpeg'}
+
+
+def archive(members):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return FileStorage(io.BytesIO(out.getvalue()), filename='study.zip')
+
+
+def test_zip_members_are_expanded_and_filtered():
+    upload = archive([('a.jpg', b'1'), ('nested/b.png', b'22'), ('notes.txt', b'x'), ('.hidden.jpg', b'x')])
+    assert list(iter_uploads([upload], ALLOWED, 10)) == [('a.jpg', b'1'), ('b.png', b'22')]
+
+
+def test_oversized_member_is_refused_before_it_is_inflated():
+    # 64 MB of zeros compresses to a few dozen KB
+    upload = archive([('bomb.jpg', b'\0' * (64 * 1024 * 1024))])
+    assert len(upload.stream.getvalue()) < 1024 * 1024
+    with pytest.raises(ValueError, match='bomb.jpg'):
+        list(iter_uploads([upload], ALLOWED, 10, max_image_bytes=16 * 1024 * 1024))
+
+
+def test_total_size_is_limited():
+    upload = archive([(f'{i}.jpg', b'\0' * 1000) for i in range(5)])
+    uploads = iter_uploads([upload], ALLOWED, 10, max_image_bytes=1000, max_total_bytes=3500)
+    assert [next(uploads)[0] for _ in range(3)] == ['0.jpg', '1.jpg', '2.jpg']
+    with pytest.raises(ValueError, match='3500 bytes'):
+        next(uploads)
+
+
+def test_file_count_is_limited():
+    files = [FileStorage(io.BytesIO(b'x'), filename=f'{i}.jpg') for i in range(3)]
+    with pytest.raises(ValueError, match='at most 2 images'):
+        list(iter_uploads(files, ALLOWED, 2))
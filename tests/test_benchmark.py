@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def registry(app_module):
+    """The app's model registry, restored after the test"""
+    saved = dict(vars(app_module.registry))
+    yield app_module.registry
+    vars(app_module.registry).update(saved)
+
+
+def test_request_level_falls_back_to_the_stub(app_module, registry, monkeypatch):
+    for name in ('MODEL_RUNTIME', 'PREDICTION_CACHE_ENABLED', 'MODEL_WARMUP', 'EMBEDDING_INDEX_DIR'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(app_module.Config, 'MODEL_PATH', 'missing.h5')
+    runtime, model = benchmark.load_model(use_stub=False)
+    assert runtime == 'stub'
+
+    assert benchmark.import_app(os.getcwd(), runtime, model) is app_module
+    assert registry.is_ready() and registry.get() is model
+
+    files = []
+    for path in benchmark.find_images(2):
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read()))
+    result = benchmark.bench_requests(app_module, files, [2], 4)['2']
+    assert result['errors'] == 0
+    assert result['count'] == 4
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+
+import pytest
+
+from blob_store import BackgroundWriter, BlobStore, migrate_uploads
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / 'uploads'))
+
+
+def test_background_write_lands_at_the_returned_path(store):
+    writer = BackgroundWriter(store)
+    path = writer.put(b'scan', 'a.JPEG')
+    writer.wait(path)
+    with open(path, 'rb') as f:
+        assert f.read() == b'scan'
+    stats = writer.stats()
+    assert (stats['pending'], stats['written'], stats['failures']) == (0, 1, 0)
+
+
+def test_failed_write_is_raised_by_wait_and_counted(store, monkeypatch):
+    writer = BackgroundWriter(store)
+
+    def full_disk(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(store, 'put', full_disk)
+    path = writer.put(b'scan', 'a.jpg')
+    writer.flush()
+    # Still reported after the write has left the pending set
+    for _ in range(2):
+        with pytest.raises(OSError, match='No space left'):
+            writer.wait(path)
+    stats = writer.stats()
+    assert (stats['failures'], stats['failed_paths'], stats['written']) == (1, 1, 0)
+    assert 'No space left' in stats['last_error']
+
+    monkeypatch.undo()
+    assert writer.put(b'scan', 'a.jpg') == path
+    writer.wait(path)
+    assert os.path.exists(path)
+    assert writer.stats()['failed_paths'] == 0
+
+
+def test_path_is_content_addressed(store):
+    writer = BackgroundWriter(store)
+    digest = hashlib.sha256(b'scan').hexdigest()
+    path = writer.put(b'scan', 'x.png')
+    assert path == store.path_for(digest, 'x.png')
+    assert path.endswith(f'/{digest[:2]}/{digest[2:4]}/{digest}.png')
+
+
+@pytest.fixture
+def uploads(conn, tmp_path, monkeypatch):
+    """A legacy upload folder with two copies of one scan, as scans rows store them"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('uploads')
+    for name in ('20240101_a.jpg', '20240102_a.jpg'):
+        with open(os.path.join('uploads', name), 'wb') as f:
+            f.write(b'scan')
+    return 'uploads'
+
+
+def add_scan_at(conn, image_path):
+    return conn.execute('INSERT INTO scans (image_path, prediction, confidence) VALUES (?, ?, ?)',
+                        (image_path, 'Non-Demented', 0.9)).lastrowid
+
+
+def image_paths(conn):
+    return [row[0] for row in conn.execute('SELECT image_path FROM scans ORDER BY id')]
+
+
+def test_migrate_matches_rows_on_full_path(conn, uploads, tmp_path):
+    store = BlobStore(uploads)
+    add_scan_at(conn, 'uploads/20240101_a.jpg')
+    # Older rows were written on Windows
+    add_scan_at(conn, 'uploads\\20240102_a.jpg')
+    # Same name, different folder: not one of the migrated files
+    add_scan_at(conn, 'archive/20240101_a.jpg')
+    conn.commit()
+
+    summary = migrate_uploads(str(tmp_path / 'database.db'), uploads, store)
+    blob = store.path_for(hashlib.sha256(b'scan').hexdigest(), 'a.jpg')
+    assert summary == dict(files=2, unique_blobs=1, bytes_before=8, bytes_after=4, rows_updated=2)
+    assert image_paths(conn) == [blob, blob, 'archive/20240101_a.jpg']
+    assert sorted(os.listdir(uploads)) == [blob.split(os.sep)[1]]
+
+    # Running it again finds nothing left to move
+    assert migrate_uploads(str(tmp_path / 'database.db'), uploads, store)['files'] == 0
+
+
+def test_migrate_dry_run_changes_nothing(conn, uploads, tmp_path):
+    add_scan_at(conn, 'uploads/20240101_a.jpg')
+    conn.commit()
+    summary = migrate_uploads(str(tmp_path / 'database.db'), uploads, BlobStore(uploads), dry_run=True)
+    assert summary['rows_updated'] == 1
+    assert image_paths(conn) == ['uploads/20240101_a.jpg']
+    assert sorted(os.listdir(uploads)) == ['20240101_a.jpg', '20240102_a.jpg']
+
+
+def test_migrate_keeps_originals_when_rows_are_not_updated(conn, uploads, tmp_path):
+    conn.execute('ALTER TABLE scans RENAME TO scans_away')
+    conn.commit()
+    with pytest.raises(sqlite3.OperationalError):
+        migrate_uploads(str(tmp_path / 'database.db'), uploads, BlobStore(uploads))
+    assert {'20240101_a.jpg', '20240102_a.jpg'} <= set(os.listdir(uploads))
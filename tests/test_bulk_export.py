@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+
+import pytest
+
+import bulk_export
+from conftest import add_scan, add_user
+from db_pool import get_pool
+
+
+@pytest.fixture
+def source(conn, tmp_path):
+    user_id = add_user(conn, 'alice')
+    # Two scans share every timestamp, so pages end in the middle of a tie
+    for day in (3, 1, 2):
+        for _ in range(2):
+            add_scan(conn, user_id, created_at=f'2024-01-0{day} 12:00:00')
+    conn.commit()
+    return bulk_export.scans_source(str(tmp_path / 'database.db'))
+
+
+def exported_ids(records):
+    return [record[0] for record in records]
+
+
+def test_pages_cover_every_row_once_in_order(conn, source):
+    ids = [row[0] for row in conn.execute('SELECT id FROM scans ORDER BY created_at, id')]
+    for chunk_size in (1, 2, 4, 100):
+        assert exported_ids(bulk_export.iter_records(source, chunk_size=chunk_size)) == ids
+    assert len(exported_ids(bulk_export.iter_records(source, since='2024-01-02', chunk_size=3))) == 4
+
+
+def test_connection_is_released_between_chunks(source):
+    pool = get_pool(source.db_path)
+    records = bulk_export.iter_records(source, chunk_size=2)
+    next(records)
+    assert pool.stats()['in_use'] == 0
+    assert len(list(records)) == 5
+
+
+def test_csv(source):
+    text = ''.join(bulk_export.stream(bulk_export.iter_records(source, chunk_size=4), 'csv', source.columns,
+                                      chunk_size=4))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert len(rows) == 6
+    assert list(rows[0]) == [name for name, _ in source.columns]
+    assert rows[0]['username'] == 'alice' and rows[0]['created_at'] == '2024-01-01 12:00:00'
+
+
+def test_jsonl(source):
+    chunks = list(bulk_export.stream(bulk_export.iter_records(source), 'jsonl', source.columns, chunk_size=4))
+    assert len(chunks) == 2
+    records = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert [record['created_at'][:10] for record in records] == ['2024-01-01'] * 2 + ['2024-01-02'] * 2 + \
+        ['2024-01-03'] * 2
+    # Scans without a stored vector export NaN probabilities as null
+    assert records[0]['p_non_demented'] is None
+
+
+def test_parquet(source):
+    pq = pytest.importorskip('pyarrow.parquet')
+    data = b''.join(bulk_export.stream(bulk_export.iter_records(source), 'parquet', source.columns, chunk_size=4))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.num_rows == 6
+    assert table.column_names == [name for name, _ in source.columns]
+
+
+def test_parquet_without_pyarrow_is_an_export_error(source):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        with pytest.raises(bulk_export.ExportError, match='pyarrow'):
+            bulk_export.stream(bulk_export.iter_records(source), 'parquet', source.columns)
+    else:
+        pytest.skip('pyarrow is installed')
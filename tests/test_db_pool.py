@@ -0,0 +1,75 @@
+import gc
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+from prediction_cache import PredictionCache
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2, timeout=0.05)
+    yield pool
+    pool.close_all()
+
+
+def test_pool_is_bounded_and_times_out(pool):
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(sqlite3.OperationalError, match='Timed out'):
+        pool.acquire()
+    assert pool.stats()['open'] == 2
+    assert pool.stats()['timeouts'] == 1
+
+    first.close()
+    third = pool.acquire()
+    assert pool.stats()['open'] == 2
+    third.close()
+    second.close()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_unclosed_connection_is_released_on_gc(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x)')
+    conn.execute('INSERT INTO t VALUES (1)')
+    del conn
+    gc.collect()
+    assert pool.stats()['in_use'] == 0
+
+    # The open transaction was rolled back, not committed
+    conn = pool.acquire()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.close()
+
+
+def test_broken_connection_is_dropped(pool):
+    conn = pool.acquire()
+    conn._conn.close()
+    conn.close()
+    assert pool.stats() == dict(pool.stats(), open=0, in_use=0, idle=0)
+
+    conn = pool.acquire()
+    assert conn.execute('SELECT 1').fetchone() == (1,)
+    conn.close()
+
+
+def test_connection_reuses_the_callers(pool):
+    held = pool.acquire()
+    with pool.connection(held) as conn:
+        assert conn is held
+    assert pool.stats()['in_use'] == 1
+    with pool.connection() as conn:
+        assert pool.stats()['in_use'] == 2
+    assert pool.stats()['in_use'] == 1
+    held.close()
+
+
+def test_helpers_use_the_request_connection(conn, tmp_path, monkeypatch):
+    cache = PredictionCache(str(tmp_path / 'database.db'))
+    # A request holding the only connection must not wait for a second one
+    monkeypatch.setattr(cache, 'pool', ConnectionPool(cache.db_path, max_size=1, timeout=0.05))
+    held = cache.pool.acquire()
+    cache.put('a', 'v1', [0.1, 0.2, 0.3, 0.4], conn=held)
+    assert cache.lookup('a', 'v1', held) is not None
+    held.close()
@@ -0,0 +1,55 @@
+import io
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import explanations
+
+
+def png():
+    out = io.BytesIO()
+    Image.fromarray(np.full((64, 64, 3), 128, dtype=np.uint8)).save(out, format='PNG')
+    return out.getvalue()
+
+
+def wait_for(explainer, *key, source):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        state = explainer.request(*key, source=source)
+        if state['status'] != explanations.PENDING:
+            return state
+        time.sleep(0.01)
+    raise AssertionError('explanation still pending')
+
+
+@pytest.fixture
+def cache(conn, tmp_path):
+    return explanations.ExplanationCache(str(tmp_path / 'database.db'))
+
+
+def test_transient_errors_are_retried(cache):
+    calls = []
+
+    def explain(pixels, class_indices):
+        calls.append(len(pixels))
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        return np.ones((len(pixels), 4, 4), dtype=np.float32)
+
+    explainer = explanations.Explainer(explain, cache, max_wait_ms=0)
+    state = wait_for(explainer, 'abc', 'v1', 2, source=png())
+    assert state['status'] == explanations.READY
+    assert len(calls) == 2
+    assert explainer.stats()['retried'] == 1 and explainer.stats()['failed'] == 0
+
+
+def test_permanent_errors_are_remembered(cache):
+    def explain(pixels, class_indices):
+        raise NotImplementedError('This model cannot explain')
+
+    explainer = explanations.Explainer(explain, cache, max_wait_ms=0)
+    assert wait_for(explainer, 'abc', 'v1', 0, source=png())['status'] == explanations.FAILED
+    assert wait_for(explainer, 'bad', 'v1', 0, source=b'not an image')['status'] == explanations.FAILED
+    assert explainer.stats()['failed'] == 2
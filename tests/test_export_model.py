@@ -0,0 +1,116 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+import export_model
+from model_registry import TFLiteModel
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'images')
+
+
+class FakeInterpreter:
+    """The slice of tf.lite.Interpreter that TFLiteModel uses"""
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.resizes = []
+
+    def get_input_details(self):
+        return [{'index': 0, 'dtype': self.dtype}]
+
+    def get_output_details(self):
+        return [{'index': 1}]
+
+    def resize_tensor_input(self, index, shape):
+        self.resizes.append(tuple(shape))
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        self.input = value
+
+    def invoke(self):
+        self.output = self.input.reshape(len(self.input), -1)[:, :4].astype(np.float32)
+
+    def get_tensor(self, index):
+        return self.output
+
+
+class TableModel:
+    """Looks each image's output up by the index stored in its first pixel"""
+
+    def __init__(self, outputs):
+        self.outputs = np.asarray(outputs, dtype=np.float32)
+
+    def predict(self, batch):
+        return self.outputs[np.asarray(batch).reshape(len(batch), -1)[:, 0].astype(int)]
+
+
+class ConstantModel:
+    def __init__(self, row):
+        self.row = np.asarray(row, dtype=np.float32)
+
+    def predict(self, batch):
+        return np.tile(self.row, (len(batch), 1))
+
+
+def test_tflite_model_scales_pixels_and_resizes_once_per_batch_size():
+    interpreter = FakeInterpreter()
+    model = TFLiteModel(interpreter)
+    batch = np.full((2, 2, 2, 3), 255, dtype=PIXEL_DTYPE)
+    np.testing.assert_allclose(model.predict(batch), np.ones((2, 4)))
+    model.predict(batch)
+    model.predict(batch[:1])
+    assert interpreter.resizes == [(2, 2, 2, 3), (1, 2, 2, 3)]
+
+
+def test_tflite_model_with_integer_input_gets_raw_pixels():
+    model = TFLiteModel(FakeInterpreter(dtype=np.uint8))
+    np.testing.assert_array_equal(model.predict(np.full((1, 2, 2, 3), 7, dtype=PIXEL_DTYPE)), [[7] * 4])
+
+
+def test_calibration_images_are_the_sample_jpegs():
+    paths, images = export_model.load_calibration_images(IMAGE_DIR, limit=3)
+    assert len(paths) == 3 and all(path.endswith('.jpg') for path in paths)
+    assert images.shape == (3, INPUT_SIZE[1], INPUT_SIZE[0], 3) and images.dtype == PIXEL_DTYPE
+
+
+def test_parity_report_lists_disagreements():
+    reference = TableModel([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4]])
+    candidate = TableModel([[0.8, 0.2], [0.3, 0.7], [0.4, 0.6]])
+    report = export_model.parity_report(reference, candidate, np.arange(3).reshape(3, 1), ['a', 'b', 'c'])
+    assert report['top1_agreement'] == pytest.approx(2 / 3)
+    assert report['max_abs_prob_diff'] == pytest.approx(0.2)
+    assert report['disagreements'] == [{'image': 'c', 'reference': 0, 'candidate': 1}]
+
+
+@pytest.mark.parametrize('agreeing', [True, False])
+def test_export_only_replaces_the_model_when_diagnoses_match(tmp_path, monkeypatch, agreeing):
+    source = tmp_path / 'model.h5'
+    source.write_bytes(b'keras')
+    output = tmp_path / 'model.tflite'
+    monkeypatch.setattr(export_model, 'convert_to_tflite', lambda path, quantization, images: b'flatbuffer')
+
+    def loader(runtime):
+        flip = runtime == 'tflite' and not agreeing
+        return lambda path: ConstantModel([0.2, 0.8] if flip else [0.8, 0.2])
+
+    monkeypatch.setattr(export_model, 'get_loader', loader)
+    result = CliRunner().invoke(export_model.export_model_command,
+                                ['--source', str(source), '--output', str(output), '--quantization', 'int8',
+                                 '--calibration-dir', IMAGE_DIR])
+
+    report = json.loads((tmp_path / 'model.parity.json').read_text())
+    assert report['quantization'] == 'int8'
+    assert not os.path.exists(str(output) + '.tmp')
+    if agreeing:
+        assert result.exit_code == 0, result.output
+        assert output.read_bytes() == b'flatbuffer'
+    else:
+        assert result.exit_code != 0 and 'was not written' in result.output
+        assert not output.exists()
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference import BatchingEngine
+
+
+class RecordingModel:
+    """Returns each image's first value, twice, and remembers the batch sizes it saw"""
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.release = release
+
+    def __call__(self, images):
+        self.batches.append(len(images))
+        if self.release is not None:
+            self.release.wait(5)
+        return np.repeat(images.reshape(len(images), -1)[:, :1], 2, axis=1)
+
+
+@pytest.fixture
+def engine():
+    engines = []
+
+    def make(predict_fn, **kwargs):
+        engine = BatchingEngine(predict_fn, **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.stop(timeout=5)
+
+
+def run_concurrently(engine, values):
+    results = {}
+
+    def call(value):
+        results[value] = engine.predict(np.full((2, 2), value, dtype=np.float32), timeout=5)
+
+    threads = [threading.Thread(target=call, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_rows(engine):
+    model = RecordingModel()
+    batching = engine(model, max_batch_size=4, max_wait_ms=5000)
+    results = run_concurrently(batching, [1, 2, 3, 4])
+    # A full batch goes out without waiting for max_wait_ms
+    assert model.batches == [4]
+    for value, row in results.items():
+        np.testing.assert_array_equal(row, [value, value])
+    stats = batching.stats()
+    assert (stats['total_batches'], stats['total_images'], stats['mean_fill_ratio']) == (1, 4, 1.0)
+
+
+def test_lone_request_runs_once_the_wait_expires(engine):
+    model = RecordingModel()
+    batching = engine(model, max_batch_size=8, max_wait_ms=1)
+    np.testing.assert_array_equal(batching.predict(np.ones((2, 2)), timeout=5), [1, 1])
+    assert model.batches == [1]
+
+
+def test_groups_are_never_split(engine):
+    release = threading.Event()
+    model = RecordingModel(release)
+    batching = engine(model, max_batch_size=4, max_wait_ms=1)
+    # The first call holds the worker so the groups queue up behind it
+    blocker = threading.Thread(target=batching.predict, args=(np.zeros((2, 2)),), kwargs={'timeout': 5})
+    blocker.start()
+    while not model.batches:
+        time.sleep(0.001)
+    results = {}
+
+    def call(name, count):
+        results[name] = batching.predict_many(np.ones((count, 2, 2)), timeout=5)
+
+    threads = [threading.Thread(target=call, args=args) for args in (('three', 3), ('two', 2), ('six', 6))]
+    for thread in threads:
+        thread.start()
+    while batching.queue_depth() < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join()
+
+    assert {name: len(rows) for name, rows in results.items()} == {'three': 3, 'two': 2, 'six': 6}
+    assert sorted(model.batches) == [1, 2, 3, 6]
+
+
+def test_tuple_outputs_are_split_per_caller(engine):
+    def two_outputs(images):
+        return images.reshape(len(images), -1)[:, :1], None
+
+    batching = engine(two_outputs, max_wait_ms=1)
+    probabilities, embedding = batching.predict(np.full((2, 2), 7.0), timeout=5)
+    np.testing.assert_array_equal(probabilities, [7.0])
+    assert embedding is None
+
+
+def test_model_error_reaches_every_caller_in_the_batch(engine):
+    def broken(images):
+        raise ValueError('bad input shape')
+
+    batching = engine(broken, max_wait_ms=1)
+    with pytest.raises(ValueError, match='bad input shape'):
+        batching.predict(np.zeros((2, 2)), timeout=5)
+    # The worker thread is still there for the next request
+    with pytest.raises(ValueError):
+        batching.predict(np.zeros((2, 2)), timeout=5)
+
+
+def test_several_workers_run_batches_side_by_side(engine):
+    # Only returns once two batches are in the model at the same time
+    both_running = threading.Barrier(2, timeout=5)
+
+    def model(images):
+        both_running.wait()
+        return images.reshape(len(images), -1)[:, :1]
+
+    batching = engine(model, max_batch_size=1, workers=2)
+    results = run_concurrently(batching, [1, 2])
+    assert sorted(float(row[0]) for row in results.values()) == [1.0, 2.0]
+    assert batching.stats()['total_batches'] == 2
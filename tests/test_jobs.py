@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from conftest import add_user
+from jobs import JobQueue
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.02)
+    raise AssertionError('timed out')
+
+
+@pytest.fixture
+def db_path(conn, tmp_path):
+    add_user(conn, 'alice')
+    conn.commit()
+    return str(tmp_path / 'database.db')
+
+
+def status(conn, job_id):
+    return conn.execute('SELECT status, owner FROM scan_jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def test_live_jobs_of_another_process_are_not_rerun(conn, db_path):
+    release = threading.Event()
+    first = JobQueue(db_path, lambda job: release.wait(5) and {'prediction': 'a'}, workers=1, lease_seconds=1)
+    job_id = first.submit(1, 'a.jpg', 'a.jpg', 'h')
+    wait_for(lambda: status(conn, job_id)[0] == JobQueue.RUNNING)
+
+    rerun = []
+    second = JobQueue(db_path, lambda job: rerun.append(job['id']) or {}, workers=1, lease_seconds=1)
+    second.start()
+    # Several lease lengths: the first queue's heartbeat must keep the job its own
+    time.sleep(2)
+    assert status(conn, job_id) == (JobQueue.RUNNING, first.owner)
+    release.set()
+    wait_for(lambda: status(conn, job_id)[0] == JobQueue.DONE)
+    assert rerun == []
+    assert 'owner' not in first.get(job_id)
+
+
+def test_jobs_with_an_expired_lease_are_resumed(conn, db_path):
+    conn.execute("INSERT INTO scan_jobs (id, user_id, filename, image_path, image_hash, status, owner, "
+                 "lease_expires) VALUES ('dead', 1, 'a.jpg', 'a.jpg', 'h', 'running', 'gone:1', ?)",
+                 (time.time() - 1,))
+    conn.commit()
+    ran = []
+    JobQueue(db_path, lambda job: ran.append(job['id']) or {}, workers=1).start()
+    wait_for(lambda: status(conn, 'dead')[0] == JobQueue.DONE)
+    assert ran == ['dead']
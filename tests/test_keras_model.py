@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from model_registry import KerasModel, get_loader
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE
+
+tf = pytest.importorskip('tensorflow')
+
+
+def small_network(size=(INPUT_SIZE[1], INPUT_SIZE[0])):
+    inputs = tf.keras.Input(shape=size + (3,))
+    features = tf.keras.layers.Conv2D(4, 3, activation='relu')(inputs)
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(features)
+    outputs = tf.keras.layers.Dense(4, activation='softmax')(pooled)
+    return tf.keras.Model(inputs, outputs)
+
+
+def pixels(count):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (count, INPUT_SIZE[1], INPUT_SIZE[0], 3)).astype(PIXEL_DTYPE)
+
+
+def test_matches_model_predict_and_traces_once():
+    network = small_network()
+    model = KerasModel(network)
+    for count in (1, 3, 5):
+        batch = pixels(count)
+        expected = network.predict(batch.astype(np.float32) / 255.0, verbose=0)
+        np.testing.assert_allclose(model.predict(batch), expected, atol=1e-5)
+    assert model.serve.experimental_get_tracing_count() == 1
+
+
+def test_embeddings_are_the_classifier_input():
+    model = KerasModel(small_network())
+    outputs, embeddings = model.predict_features(pixels(2))
+    assert outputs.shape == (2, 4) and embeddings.shape == (2, 4)
+    assert model.has_embeddings
+
+
+def test_smaller_model_input_is_resized_in_the_graph():
+    model = KerasModel(small_network(size=(32, 32)))
+    assert model.predict(pixels(2)).shape == (2, 4)
+
+
+def test_explain_returns_normalized_maps():
+    model = KerasModel(small_network())
+    maps = model.explain(pixels(2), [0, 3])
+    assert maps.shape[0] == 2 and maps.ndim == 3
+    assert maps.min() >= 0.0 and maps.max() <= 1.0
+
+
+def test_loader_reads_a_saved_model(tmp_path):
+    path = str(tmp_path / 'model.keras')
+    small_network().save(path)
+    assert get_loader('keras')(path).predict(pixels(1)).shape == (1, 4)
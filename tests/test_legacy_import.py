@@ -0,0 +1,91 @@
+import json
+import sqlite3
+
+import pytest
+
+import legacy_import
+import stats
+
+LEGACY_SCHEMA = [
+    '''CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL, email TEXT UNIQUE NOT NULL, role TEXT NOT NULL, oauth_provider TEXT,
+        oauth_id TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE scan_results (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER NOT NULL,
+        scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, scan_image_path TEXT NOT NULL,
+        predicted_class TEXT NOT NULL, confidence REAL NOT NULL, probabilities TEXT NOT NULL, notes TEXT)''',
+    '''CREATE TABLE activity_log (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+        action TEXT NOT NULL, details TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = str(tmp_path / 'alzheimer.db')
+    source = sqlite3.connect(path)
+    for statement in LEGACY_SCHEMA:
+        source.execute(statement)
+    source.execute("INSERT INTO users (id, username, password, email, role) "
+                   "VALUES (7, 'dana', 'x', 'dana@example.com', 'patient')")
+    vector = json.dumps([0.7, 0.1, 0.1, 0.1])
+    # patient 99 never existed in the legacy users table
+    source.executemany('INSERT INTO scan_results (patient_id, scan_date, scan_image_path, predicted_class, '
+                       'confidence, probabilities) VALUES (?, ?, ?, ?, ?, ?)',
+                       [(7, '2023-05-01 10:00:00', 'a.jpg', 'Non-Demented', 0.7, vector),
+                        (99, '2023-05-02 10:00:00', 'b.jpg', 'Non-Demented', 0.7, vector)])
+    source.execute("INSERT INTO activity_log (user_id, action) VALUES (99, 'upload')")
+    source.commit()
+    source.close()
+    return path
+
+
+def test_orphan_scan_is_kept_without_a_user(conn, legacy_db):
+    legacy_import.import_legacy(legacy_db, conn, batch_size=1)
+
+    scans = conn.execute('SELECT image_path, user_id FROM scans ORDER BY image_path').fetchall()
+    dana = conn.execute("SELECT id FROM users WHERE username = 'dana'").fetchone()[0]
+    assert scans == [('a.jpg', dana), ('b.jpg', None)]
+    progress = {row['table']: row for row in legacy_import.import_status(conn, legacy_db)}
+    assert all(row['done'] for row in progress.values())
+    assert (progress['scan_results']['copied'], progress['scan_results']['skipped']) == (2, 0)
+    assert (progress['activity_log']['copied'], progress['activity_log']['skipped']) == (0, 1)
+    assert stats.reconcile(conn, stats.APP_SCANS) == []
+
+
+def test_rerun_copies_nothing_twice(conn, legacy_db):
+    legacy_import.import_legacy(legacy_db, conn)
+    legacy_import.import_legacy(legacy_db, conn)
+    assert conn.execute('SELECT COUNT(*) FROM scans').fetchone()[0] == 2
+
+
+@pytest.mark.parametrize('email, role, merged', [
+    ('dana@example.com', 'patient', True),
+    ('dana@example.com', 'admin', False),
+    ('someone.else@example.com', 'patient', False),
+])
+def test_users_merge_only_on_username_email_and_role(conn, legacy_db, email, role, merged):
+    existing = conn.execute('INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)',
+                            ('dana', email, 'y', role)).lastrowid
+    conn.commit()
+    conflicts = []
+    legacy_import.import_legacy(legacy_db, conn, conflict=lambda row, reason: conflicts.append(row['id']))
+
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'dana'").fetchone()[0] == 1
+    scans = dict(conn.execute('SELECT image_path, user_id FROM scans').fetchall())
+    progress = {row['table']: row for row in legacy_import.import_status(conn, legacy_db)}
+    if merged:
+        assert conflicts == [] and scans['a.jpg'] == existing
+        assert progress['users']['skipped'] == 0
+    else:
+        # Never attached to someone else's account
+        assert conflicts == [7] and scans['a.jpg'] is None
+        assert progress['users']['skipped'] == 1
+
+
+def test_email_taken_by_another_username_is_a_conflict(conn, legacy_db):
+    conn.execute("INSERT INTO users (username, email, password, role) "
+                 "VALUES ('not-dana', 'dana@example.com', 'y', 'patient')")
+    conn.commit()
+    reasons = []
+    legacy_import.import_legacy(legacy_db, conn, conflict=lambda row, reason: reasons.append(reason))
+    assert reasons == ["email belongs to account 'not-dana'"]
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'dana'").fetchone()[0] == 0
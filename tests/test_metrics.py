@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import metrics
+from preprocessing import decode_pixels
+
+
+@pytest.fixture
+def enabled():
+    previous = metrics.ENABLED
+    metrics.configure(True)
+    yield
+    metrics.configure(previous)
+
+
+@pytest.fixture
+def disabled():
+    previous = metrics.ENABLED
+    metrics.configure(False)
+    yield
+    metrics.configure(previous)
+
+
+def stage_counts():
+    return {labels[0]: counts for labels, (counts, _) in metrics.STAGE_SECONDS._values.items()}
+
+
+def jpeg():
+    out = io.BytesIO()
+    Image.fromarray(np.zeros((256, 256, 3), dtype=np.uint8)).save(out, format='JPEG')
+    return out.getvalue()
+
+
+def test_decode_stages_are_recorded_only_when_asked(enabled):
+    before = {stage: sum(counts) for stage, counts in stage_counts().items()}
+    decode_pixels(jpeg())
+    assert {stage: sum(counts) for stage, counts in stage_counts().items()} == before
+    decode_pixels(jpeg(), timed=True)
+    after = {stage: sum(counts) for stage, counts in stage_counts().items()}
+    for stage in ('decode_resize', 'array_conversion'):
+        assert after[stage] == before.get(stage, 0) + 1
+
+
+def test_render_exposes_histogram_buckets(enabled):
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', ['kind'], buckets=(0.1, 1.0))
+    histogram.observe(0.5, 'a')
+    text = metrics.render()
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 0' in text
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 1' in text
+    assert 'test_seconds_count{kind="a"} 1' in text
+
+
+def test_disabled_metrics_record_nothing(disabled):
+    counter = metrics.Counter('test_total', 'Test counter')
+    counter.inc()
+    assert counter.samples() == []
+    assert metrics.stage('decode_resize') is metrics.stage('inference')
@@ -0,0 +1,33 @@
+import sqlite3
+
+from migrations import APP_MIGRATIONS, ensure_schema, schema_version
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def test_fresh_file_reaches_the_latest_version(conn):
+    assert schema_version(conn) == max(version for version, _, _ in APP_MIGRATIONS)
+    for table in ('prediction_cache', 'scan_jobs', 'explanations', 'scan_embeddings'):
+        assert columns(conn, table)
+    assert ensure_schema(conn) == []
+
+
+def test_tables_created_by_older_modules_are_adopted(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'database.db'))
+    # What PredictionCache and JobQueue created before the tables were migrations
+    conn.execute('''CREATE TABLE prediction_cache (image_hash TEXT NOT NULL, model_version TEXT NOT NULL,
+                    prediction TEXT, last_used REAL NOT NULL, PRIMARY KEY (image_hash, model_version))''')
+    conn.execute('''CREATE TABLE scan_jobs (id TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
+                    filename TEXT NOT NULL, image_path TEXT NOT NULL, image_hash TEXT NOT NULL,
+                    status TEXT NOT NULL, prediction TEXT, confidence REAL, scan_id INTEGER, error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("INSERT INTO scan_jobs (id, user_id, filename, image_path, image_hash, status) "
+                 "VALUES ('j1', 1, 'a.jpg', 'a.jpg', 'h', 'done')")
+    conn.commit()
+
+    ensure_schema(conn)
+    assert 'probabilities' in columns(conn, 'prediction_cache')
+    assert 'embedding' in columns(conn, 'prediction_cache')
+    assert conn.execute("SELECT status, tta FROM scan_jobs WHERE id = 'j1'").fetchone() == ('done', 0)
@@ -0,0 +1,101 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import model_registry
+from model_registry import ModelRegistry
+
+
+class StubModel:
+    def predict(self, batch):
+        return np.tile([0.1, 0.2, 0.3, 0.4], (len(batch), 1))
+
+
+class CountingLoader:
+    def __init__(self, failures=0):
+        self.calls = 0
+        self.failures = failures
+
+    def __call__(self, path):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError(f'No model at {path}')
+        return StubModel()
+
+
+def test_model_is_loaded_on_first_use_only():
+    loader = CountingLoader()
+    registry = ModelRegistry('model.h5', loader=loader)
+    assert registry.status()['state'] == ModelRegistry.UNLOADED and loader.calls == 0
+
+    threads = [threading.Thread(target=registry.predict, args=(np.zeros((1, 2)),)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert registry.is_ready() and registry.status()['load_seconds'] is not None
+
+
+def test_failed_load_is_reported_and_retried():
+    registry = ModelRegistry('model.h5', loader=CountingLoader(failures=1))
+    with pytest.raises(RuntimeError, match='No model at model.h5'):
+        registry.get()
+    status = registry.status()
+    assert (status['state'], status['error']) == (ModelRegistry.FAILED, 'No model at model.h5')
+
+    assert isinstance(registry.get(), StubModel)
+    assert registry.status()['error'] is None
+
+
+def test_warm_up_loads_in_the_background():
+    release = threading.Event()
+
+    def slow_loader(path):
+        release.wait(5)
+        return StubModel()
+
+    registry = ModelRegistry('model.h5', loader=slow_loader)
+    registry.warm_up()
+    thread = registry._warmup_thread
+    assert registry.status()['state'] in (ModelRegistry.UNLOADED, ModelRegistry.LOADING)
+    release.set()
+    thread.join(5)
+    assert registry.is_ready()
+
+
+def test_set_model_serves_without_loading():
+    loader = CountingLoader()
+    registry = ModelRegistry('model.h5', loader=loader)
+    model = StubModel()
+    registry.set_model(model, runtime='stub')
+    assert registry.get() is model and loader.calls == 0
+    assert registry.status()['runtime'] == 'stub'
+
+
+def test_version_tracks_the_model_file(tmp_path):
+    path = tmp_path / 'model.h5'
+    registry = ModelRegistry(str(path), loader=CountingLoader())
+    assert registry.version() == 'keras:missing'
+    path.write_bytes(b'v1')
+    first = registry.version()
+    path.write_bytes(b'v2!')
+    os.utime(path, ns=(0, 0))
+    assert registry.version() not in (first, 'keras:missing')
+
+
+def test_runtimes_are_pluggable(monkeypatch):
+    monkeypatch.setattr(model_registry, '_LOADERS', dict(model_registry._LOADERS))
+    with pytest.raises(ValueError, match='Unknown model runtime: onnx'):
+        ModelRegistry('model.onnx', runtime='onnx')
+    model_registry.register_loader('stub-test', CountingLoader())
+    assert ModelRegistry('model.bin', runtime='stub-test').get().predict(np.zeros((2, 1))).shape == (2, 4)
+
+
+def test_optional_model_capabilities():
+    outputs, embeddings = model_registry.predict_features(StubModel(), np.zeros((3, 1)))
+    assert outputs.shape == (3, 4) and embeddings is None
+    with pytest.raises(NotImplementedError, match='StubModel'):
+        model_registry.explain(StubModel(), np.zeros((1, 1)), [0])
@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+from conftest import add_scan, add_user
+from pagination import InvalidCursor, KeysetQuery, decode_cursor, encode_cursor, fetch_page, page_size
+
+SCANS = KeysetQuery(
+    'SELECT * FROM scans WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?',
+    'SELECT * FROM scans WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?',
+)
+
+
+@pytest.fixture
+def conn(conn):
+    # fetch_page reads created_at/id by name, as app.py's connections allow
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def all_pages(conn, user_id, limit):
+    pages, cursor = [], None
+    while True:
+        page = fetch_page(conn, SCANS, (user_id,), cursor, limit)
+        pages.append([row['id'] for row in page.items])
+        cursor = page.next_cursor
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once_across_equal_timestamps(conn):
+    user = add_user(conn, 'alice')
+    # Five scans share a timestamp, so the id tiebreaker decides the page boundaries
+    ids = [add_scan(conn, user, created_at='2024-01-01 12:00:00') for _ in range(5)]
+    ids += [add_scan(conn, user, created_at='2024-01-02 12:00:00') for _ in range(2)]
+    expected = sorted(ids[5:], reverse=True) + sorted(ids[:5], reverse=True)
+
+    pages = all_pages(conn, user, 3)
+    assert pages == [expected[0:3], expected[3:6], expected[6:7]]
+
+
+def test_exact_multiple_of_page_size_has_no_empty_last_page(conn):
+    user = add_user(conn, 'alice')
+    for day in range(1, 5):
+        add_scan(conn, user, created_at=f'2024-01-0{day} 12:00:00')
+    assert [len(page) for page in all_pages(conn, user, 2)] == [2, 2]
+
+
+def test_empty_listing(conn):
+    page = fetch_page(conn, SCANS, (add_user(conn, 'alice'),), None, 20)
+    assert page.items == [] and page.next_cursor is None
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    assert decode_cursor(encode_cursor('2024-01-01 12:00:00', 7)) == ('2024-01-01 12:00:00', 7)
+    for bad in ('not-a-cursor', encode_cursor('x', 1)[:-3], ''):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(bad)
+
+
+@pytest.mark.parametrize('value, expected', [(None, 20), ('', 20), ('5', 5), ('0', 1), ('-3', 1),
+                                             ('1000', 100), ('abc', 20)])
+def test_page_size_is_clamped(value, expected):
+    assert page_size(value, 20, 100) == expected
@@ -0,0 +1,90 @@
+import pytest
+
+import patient_attributes
+from conftest import add_user
+
+
+@pytest.fixture
+def cache(conn, tmp_path):
+    return patient_attributes.AttributeCache(str(tmp_path / 'database.db'), ttl=60)
+
+
+@pytest.fixture
+def patients(conn):
+    ids = [add_user(conn, name) for name in ('alice', 'bob', 'carol')]
+    conn.commit()
+    return ids
+
+
+def test_unset_attributes_read_as_defaults(cache, patients):
+    assert cache.get(patients[0]) == patient_attributes.ATTRIBUTES
+    assert cache.get(patients[0], 'next_checkup') == 'Not scheduled'
+
+
+def test_listing_page_loads_uncached_patients_in_one_query(cache, patients):
+    alice, bob, carol = patients
+    cache.set(bob, 'doctor_notes', 'Follow up in May')
+    cache.get(alice)
+
+    page = cache.get_many(patients)
+    assert page[bob]['doctor_notes'] == 'Follow up in May'
+    assert page[carol]['doctor_notes'] == 'No notes available'
+    stats = cache.stats()
+    assert (stats['queries'], stats['hits'], stats['misses']) == (2, 1, 3)
+
+    cache.get_many(patients)
+    assert cache.stats()['queries'] == 2
+
+
+def test_own_writes_are_visible_immediately(cache, patients):
+    alice = patients[0]
+    assert cache.get(alice, 'next_checkup') == 'Not scheduled'
+    cache.set(alice, 'next_checkup', '2024-06-01')
+    assert cache.get(alice, 'next_checkup') == '2024-06-01'
+    cache.set(alice, 'next_checkup', None)
+    assert cache.get(alice, 'next_checkup') == 'Not scheduled'
+
+    cache.set(alice, 'doctor_notes', 'Stable')
+    cache.clear(alice)
+    assert cache.get(alice) == patient_attributes.ATTRIBUTES
+
+
+def test_other_writers_show_up_after_the_ttl(conn, tmp_path, patients):
+    cache = patient_attributes.AttributeCache(str(tmp_path / 'database.db'), ttl=0)
+    alice = patients[0]
+    cache.get(alice)
+    conn.execute("INSERT INTO patient_attributes (user_id, name, value) VALUES (?, 'doctor_notes', 'Seen')",
+                 (alice,))
+    conn.commit()
+    assert cache.get(alice, 'doctor_notes') == 'Seen'
+
+
+def test_least_recently_used_patient_is_evicted(conn, tmp_path, patients):
+    cache = patient_attributes.AttributeCache(str(tmp_path / 'database.db'), max_entries=2)
+    alice, bob, carol = patients
+    cache.get(alice)
+    cache.get(bob)
+    cache.get(alice)
+    cache.get(carol)
+    assert list(cache._entries) == [alice, carol]
+
+
+def test_unknown_attribute_is_rejected(cache, patients):
+    with pytest.raises(ValueError, match='next_checkup, doctor_notes'):
+        cache.set(patients[0], 'shoe_size', '9')
+
+
+def test_system_settings_rows_are_migrated(conn, patients):
+    alice = patients[0]
+    conn.execute('DROP TABLE patient_attributes')
+    conn.executemany('INSERT INTO system_settings (setting_key, setting_value) VALUES (?, ?)',
+                     [(f'next_checkup_{alice}', '2024-06-01'), (f'doctor_notes_{alice}', 'Stable'),
+                      # Orphaned by a deleted patient
+                      ('doctor_notes_999', 'Gone'), ('site_name', 'Clinic')])
+    for statement in patient_attributes.schema_statements():
+        conn.execute(statement)
+
+    assert conn.execute('SELECT user_id, name, value FROM patient_attributes ORDER BY name').fetchall() == \
+        [(alice, 'doctor_notes', 'Stable'), (alice, 'next_checkup', '2024-06-01')]
+    assert conn.execute('SELECT setting_key FROM system_settings').fetchall() == [('site_name',)]
+
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from prediction_cache import PredictionCache
+
+VECTOR = [0.1, 0.2, 0.3, 0.4]
+
+
+@pytest.fixture
+def db_path(conn, tmp_path):
+    return str(tmp_path / 'database.db')
+
+
+def last_used(conn, image_hash):
+    return conn.execute('SELECT last_used FROM prediction_cache WHERE image_hash = ?', (image_hash,)).fetchone()[0]
+
+
+def test_hits_only_touch_stale_entries(conn, db_path):
+    cache = PredictionCache(db_path, touch_interval=60)
+    cache.put('a', 'v1', VECTOR)
+    stored = last_used(conn, 'a')
+    np.testing.assert_allclose(cache.get('a', 'v1'), VECTOR)
+    assert last_used(conn, 'a') == stored
+
+    conn.execute('UPDATE prediction_cache SET last_used = last_used - 120')
+    conn.commit()
+    cache.get('a', 'v1')
+    assert last_used(conn, 'a') > stored - 120
+    assert cache.stats()['hits'] == 2
+
+
+def test_replacing_an_entry_does_not_count_as_growth(conn, db_path):
+    cache = PredictionCache(db_path, max_entries=2)
+    for _ in range(3):
+        cache.put('a', 'v1', VECTOR)
+    cache.put('b', 'v1', VECTOR)
+    assert cache.stats()['entries'] == 2
+    assert conn.execute('SELECT COUNT(*) FROM prediction_cache').fetchone()[0] == 2
+
+    cache.put('a', 'v1', [0.4, 0.3, 0.2, 0.1])
+    np.testing.assert_allclose(cache.get('a', 'v1'), [0.4, 0.3, 0.2, 0.1])
+    cache.put('c', 'v1', VECTOR)
+    # 'b' was used least recently
+    assert cache.get('b', 'v1') is None
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pytest
+
+import probabilities
+from probabilities import CLASS_NAMES
+
+
+def test_encode_decode_round_trip():
+    vector = np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32)
+    blob = probabilities.encode(vector)
+    assert len(blob) == probabilities.BLOB_SIZE
+    np.testing.assert_array_equal(probabilities.decode(blob), vector)
+
+
+def test_dict_and_legacy_json_encode_in_class_order():
+    values = {name: i / 10 for i, name in enumerate(CLASS_NAMES)}
+    expected = probabilities.encode([values[name] for name in CLASS_NAMES])
+    assert probabilities.encode(values) == expected
+    assert probabilities.from_json(json.dumps(values)) == expected
+    assert probabilities.from_json(json.dumps(list(values.values()))) == expected
+
+
+def test_decode_many_fills_missing_vectors_with_nan():
+    blob = probabilities.encode([0.25] * len(CLASS_NAMES))
+    matrix = probabilities.decode_many([blob, None, b'short'])
+    assert matrix.shape == (3, len(CLASS_NAMES))
+    np.testing.assert_array_equal(matrix[0], 0.25)
+    assert np.isnan(matrix[1:]).all()
+
+
+def test_wrong_length_is_rejected():
+    with pytest.raises(ValueError):
+        probabilities.encode([0.5, 0.5])
+
+
+def test_load_matrix_decodes_every_chunk(conn):
+    vectors = [np.roll([0.7, 0.1, 0.1, 0.1], i % 4) for i in range(7)]
+    conn.executemany("INSERT INTO scans (image_path, prediction, confidence, probabilities) "
+                     "VALUES ('x.jpg', 'Non-Demented', 0.7, ?)", [(probabilities.encode(v),) for v in vectors])
+    conn.execute("INSERT INTO scans (image_path, prediction, confidence) VALUES ('x.jpg', 'Non-Demented', 0.7)")
+    matrix = probabilities.load_matrix(conn, 'SELECT probabilities FROM scans ORDER BY id', chunk_size=3)
+    assert matrix.shape == (8, len(CLASS_NAMES))
+    np.testing.assert_allclose(matrix[:7], vectors)
+    assert np.isnan(matrix[7]).all()
+
+
+def test_confidence_summary_groups_by_predicted_class():
+    matrix = np.array([[0.95, 0.05, 0, 0], [0.55, 0.45, 0, 0], [0.1, 0.2, 0.7, 0], [np.nan] * 4],
+                      dtype=np.float32)
+    summary = probabilities.confidence_summary(matrix, bins=4)
+    assert summary['scans'] == 3
+    assert summary['bin_edges'] == [0.0, 0.25, 0.5, 0.75, 1.0]
+    non_demented = summary['classes']['Non-Demented']
+    assert non_demented['count'] == 2
+    assert non_demented['confidence_histogram'] == [0, 0, 1, 1]
+    assert non_demented['mean_probabilities']['Non-Demented'] == pytest.approx(0.75)
+    assert summary['classes']['Mild Demented']['confidence_histogram'] == [0, 0, 1, 0]
+    assert summary['classes']['Moderate Demented'] == {'count': 0, 'mean_probabilities': None,
+                                                       'confidence_histogram': [0, 0, 0, 0]}
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+
+import pytest
+
+import query_plan
+from migrations import ensure_schema
+
+
+@pytest.fixture(scope='module')
+def hot_queries(app_module):
+    """Every hot query app.py and database.py register, checked against a fresh database.db"""
+    conn = sqlite3.connect('database.db')
+    ensure_schema(conn)
+    conn.close()
+    return os.getcwd()
+
+
+def test_hot_queries_are_registered(hot_queries):
+    for name in ('login_user', 'patient_scans', 'patient_scans_after', 'latest_scan', 'recent_activity'):
+        assert name in query_plan.HOT_QUERIES
+
+
+def test_hot_queries_use_indexes(hot_queries, monkeypatch):
+    monkeypatch.chdir(hot_queries)
+    assert query_plan.check_query_plans() == {}
+
+
+def test_full_scan_is_reported(tmp_path):
+    db_path = str(tmp_path / 'database.db')
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    conn.close()
+    violations = query_plan.check_query_plans({
+        'unindexed': (db_path, 'SELECT * FROM scans WHERE image_path = ?', ('x',)),
+        'indexed': (db_path, 'SELECT * FROM users WHERE username = ?', ('admin',)),
+    })
+    assert list(violations) == ['unindexed']
@@ -0,0 +1,204 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import db_pool
+
+IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       'static', 'images', '*.jpg')))
+
+
+def fake_classify(data, image_hash, use_tta=False, db=None):
+    # The model is not needed to exercise the request path
+    return 'Non-Demented', 0.9, np.array([0.05, 0.9, 0.03, 0.02]), np.ones(8, dtype=np.float32)
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'classify_image', fake_classify)
+    db = sqlite3.connect('database.db')
+    username = f'routes{os.urandom(4).hex()}'
+    user_id = db.execute("INSERT INTO users (username, email, password, role) VALUES (?, ?, 'x', 'patient')",
+                         (username, f'{username}@example.com')).lastrowid
+    db.commit()
+    db.close()
+
+    def login():
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, username='routes', role='patient')
+        return client
+    login.user_id = user_id
+    return login
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    pool = db_pool.get_pool('database.db')
+    pool.close_all()
+    monkeypatch.setattr(pool, 'max_size', 2)
+    monkeypatch.setattr(pool, 'timeout', 2.0)
+    return pool
+
+
+def scan_count(user_id):
+    db = sqlite3.connect('database.db')
+    try:
+        return db.execute('SELECT COUNT(*) FROM scans WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize('explain_on_upload', [False, True])
+def test_concurrent_predicts_fit_a_small_pool(app_module, client, small_pool, monkeypatch, explain_on_upload):
+    monkeypatch.setattr(app_module.Config, 'EXPLAIN_ON_UPLOAD', explain_on_upload)
+    requests = 6
+    errors = []
+
+    def upload(path):
+        with open(path, 'rb') as f:
+            response = client().post('/predict', data={'file': (f, os.path.basename(path))},
+                                     content_type='multipart/form-data', follow_redirects=True)
+        if b'Error processing scan' in response.data:
+            errors.append(path)
+
+    threads = [threading.Thread(target=upload, args=(path,)) for path in IMAGES[:requests]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert scan_count(client.user_id) == requests
+    assert small_pool.stats()['timeouts'] == 0
+    # The index catches up off the request path
+    app_module.index_sync.submit(lambda: None).result()
+    assert app_module.similar_scans.stats()['vectors'] >= requests
+
+
+def submit_scan(client):
+    with open(IMAGES[0], 'rb') as f:
+        response = client.post('/jobs', data={'file': (f, 'scan.jpg')}, content_type='multipart/form-data')
+    assert response.status_code == 202
+    return response.get_json()
+
+
+def wait_for_job(client, status_url):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job still running')
+
+
+def test_job_is_submitted_and_completed(client):
+    patient = client()
+    submitted = submit_scan(patient)
+    assert submitted['status'] == 'queued'
+
+    job = wait_for_job(patient, submitted['status_url'])
+    assert (job['status'], job['prediction'], job['error']) == ('done', 'Non-Demented', None)
+    assert job['id'] == submitted['job_id'] and job['scan_id'] is not None
+    assert scan_count(client.user_id) == 1
+
+
+def test_failed_job_reports_its_error(app_module, client, monkeypatch):
+    def broken_classify(*args, **kwargs):
+        raise RuntimeError('Model failed to load: no weights')
+
+    monkeypatch.setattr(app_module, 'classify_image', broken_classify)
+    patient = client()
+    job = wait_for_job(patient, submit_scan(patient)['status_url'])
+    assert job['status'] == 'failed'
+    assert 'no weights' in job['error']
+
+
+def test_job_status_is_private(app_module, client):
+    status_url = submit_scan(client())['status_url']
+    stranger = app_module.app.test_client()
+    assert stranger.get(status_url).status_code == 401
+    with stranger.session_transaction() as session:
+        session.update(user_id=-1, username='stranger', role='patient')
+    assert stranger.get(status_url).status_code == 404
+    assert stranger.post('/jobs', data={}, content_type='multipart/form-data').status_code == 400
+
+
+def test_scan_image_is_served_with_strong_etags(app_module, client):
+    with open(IMAGES[0], 'rb') as f:
+        image_path = app_module.blob_store.put(f.read(), 'scan.jpg')
+    db = sqlite3.connect('database.db')
+    scan_id = db.execute("INSERT INTO scans (user_id, image_path, prediction, confidence) "
+                         "VALUES (?, ?, 'Non-Demented', 0.9)", (client.user_id, image_path)).lastrowid
+    db.commit()
+    db.close()
+
+    patient = client()
+    digest = os.path.basename(image_path).split('.')[0]
+    for url, etag in ((f'/scans/{scan_id}/image', digest),
+                      (f'/scans/{scan_id}/image/thumb',
+                       f'{digest}-thumb-{app_module.Config.SCAN_IMAGE_VARIANTS["thumb"]}')):
+        response = patient.get(url)
+        assert response.status_code == 200
+        assert response.headers['ETag'] == f'"{etag}"'
+        assert 'immutable' in response.headers['Cache-Control']
+        revalidated = patient.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert (revalidated.status_code, revalidated.data) == (304, b'')
+
+    assert patient.get(f'/scans/{scan_id}/image/huge').status_code == 404
+    stranger = app_module.app.test_client()
+    with stranger.session_transaction() as session:
+        session.update(user_id=-1, username='stranger', role='patient')
+    assert stranger.get(f'/scans/{scan_id}/image').status_code == 404
+
+
+def follow(client, url):
+    items, pages, cursor = [], 0, None
+    while True:
+        response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        body = response.get_json()
+        key = 'scans' if 'scans' in body else 'patients'
+        items += body[key]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return items, pages, body
+
+
+def test_scan_history_pages_by_cursor(client):
+    db = sqlite3.connect('database.db')
+    for day in (1, 1, 1, 2, 3):
+        db.execute("INSERT INTO scans (user_id, image_path, prediction, confidence, created_at) "
+                   "VALUES (?, 'x.jpg', 'Non-Demented', 0.9, ?)", (client.user_id, f'2024-01-0{day} 12:00:00'))
+    db.commit()
+    db.close()
+
+    patient = client()
+    scans, pages, body = follow(patient, '/scans?limit=2')
+    assert pages == 3 and body['total'] == 5
+    assert [scan['created_at'][:10] for scan in scans] == ['2024-01-03', '2024-01-02'] + ['2024-01-01'] * 3
+    assert len({scan['id'] for scan in scans}) == 5
+
+    response = patient.get('/scans?cursor=not-a-cursor')
+    assert response.status_code == 400 and 'Invalid cursor' in response.get_json()['error']
+
+
+def test_patient_listing_pages_with_attributes(app_module, client):
+    app_module.attributes.set(client.user_id, 'doctor_notes', 'Paged')
+    admin = app_module.app.test_client()
+    assert admin.get('/admin/patients').status_code == 401
+    with admin.session_transaction() as session:
+        session.update(user_id=-1, username='admin', role='admin')
+
+    patients, pages, body = follow(admin, '/admin/patients?limit=1')
+    assert pages == len(patients) == body['total']
+    assert len({patient['id'] for patient in patients}) == len(patients)
+    assert all('password' not in patient for patient in patients)
+    assert [patient['doctor_notes'] for patient in patients if patient['id'] == client.user_id] == ['Paged']
@@ -0,0 +1,70 @@
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import scan_images
+
+
+@pytest.fixture
+def scan():
+    out = io.BytesIO()
+    Image.new('RGB', (400, 200), (120, 40, 40)).save(out, format='PNG')
+    return out.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return scan_images.DerivativeStore(str(tmp_path), {'thumb': 64, 'preview': 256})
+
+
+def test_render_fits_the_longest_edge(scan):
+    img = Image.open(io.BytesIO(scan_images.render(scan, 64)))
+    assert (img.format, img.size) == ('JPEG', (64, 32))
+    # Never scaled up
+    assert Image.open(io.BytesIO(scan_images.render(scan, 1000))).size == (400, 200)
+
+
+def test_digest_comes_from_store_paths_or_the_file(tmp_path, scan):
+    digest = hashlib.sha256(scan).hexdigest()
+    assert scan_images.digest_for(f'static\\uploads\\ab\\cd\\{digest}.png') == digest
+    legacy = tmp_path / '20240101_scan.png'
+    legacy.write_bytes(scan)
+    assert scan_images.digest_for(str(legacy)) == digest
+
+
+def test_variant_paths_and_etags_change_with_the_size(tmp_path, store):
+    digest = 'ab' * 32
+    assert store.path_for(digest, 'thumb') == f'{tmp_path}/derived/thumb-64/ab/ab/{digest}.jpg'
+    assert store.etag(digest, scan_images.ORIGINAL) == digest
+    assert store.etag(digest, 'thumb') == f'{digest}-thumb-64'
+
+    resized = scan_images.DerivativeStore(str(tmp_path), {'thumb': 96})
+    assert resized.path_for(digest, 'thumb') != store.path_for(digest, 'thumb')
+    assert resized.etag(digest, 'thumb') != store.etag(digest, 'thumb')
+
+
+def test_ensure_renders_once(tmp_path, store, scan):
+    source = tmp_path / 'scan.png'
+    source.write_bytes(scan)
+    path = store.ensure('cd' * 32, 'thumb', str(source))
+    assert Image.open(path).size == (64, 32)
+    modified = os.stat(path).st_mtime_ns
+    # An existing variant is served as is, without touching the source
+    assert store.ensure('cd' * 32, 'thumb', 'missing.png') == path
+    assert os.stat(path).st_mtime_ns == modified
+
+
+def test_writer_renders_every_variant_and_counts_bad_uploads(store, scan):
+    writer = scan_images.DerivativeWriter(store)
+    writer.schedule(scan, 'ef' * 32)
+    writer.schedule(b'not an image', '01' * 32)
+    writer.flush()
+    assert all(os.path.exists(store.path_for('ef' * 32, variant)) for variant in store.variants)
+    assert writer.stats() == {'pending': 0, 'rendered': 2, 'errors': 1}
+
+    # Already rendered: nothing is queued
+    writer.schedule(scan, 'ef' * 32)
+    assert writer.stats()['pending'] == 0
@@ -0,0 +1,69 @@
+import sqlite3
+
+import stats
+from conftest import add_scan, add_user
+from migrations import APP_MIGRATIONS, BASE_SCHEMA, migrate
+
+
+def test_triggers_match_a_recount(conn):
+    alice, bob = add_user(conn, 'alice'), add_user(conn, 'bob')
+    add_user(conn, 'carol', role='admin')
+    first = add_scan(conn, alice, 'Mild Demented', '2024-01-01 09:00:00')
+    add_scan(conn, alice, 'Non-Demented', '2024-01-01 10:00:00')
+    add_scan(conn, bob, 'Mild Demented', '2024-01-02 10:00:00')
+    conn.execute('UPDATE scans SET prediction = ?, user_id = ? WHERE id = ?', ('Moderate Demented', bob, first))
+    conn.execute("UPDATE users SET role = 'admin' WHERE id = ?", (alice,))
+    conn.execute('DELETE FROM scans WHERE user_id = ? AND prediction = ?', (bob, 'Mild Demented'))
+    conn.commit()
+
+    assert stats.reconcile(conn, stats.APP_SCANS) == []
+    assert stats.get_counter(conn, 'scans.total') == 2
+    assert stats.get_counters(conn, 'users.role.') == {'admin': 2, 'patient': 1}
+    assert stats.user_scan_count(conn, alice) == 1
+    assert stats.user_scan_count(conn, bob) == 1
+
+
+def test_reconcile_fix_repairs_drift(conn):
+    alice = add_user(conn, 'alice')
+    add_scan(conn, alice)
+    conn.execute("UPDATE stats_counters SET value = 42 WHERE name = 'scans.total'")
+    conn.execute('DELETE FROM patient_activity_daily')
+    conn.execute('DELETE FROM user_scan_counts')
+    conn.commit()
+
+    names = [name for name, _, _ in stats.reconcile(conn, stats.APP_SCANS, fix=True)]
+    assert names == ['scans.total', 'patient_activity_daily', 'user_scan_counts']
+    assert stats.reconcile(conn, stats.APP_SCANS) == []
+
+
+def test_scans_without_a_user_are_counted_but_not_rolled_up(conn):
+    alice = add_user(conn, 'alice')
+    orphan = add_scan(conn, None, 'Mild Demented')
+    add_scan(conn, alice)
+    conn.execute('UPDATE scans SET user_id = ? WHERE id = ?', (alice, orphan))
+    conn.execute('UPDATE scans SET user_id = NULL WHERE id = ?', (orphan,))
+    conn.commit()
+
+    assert stats.get_counter(conn, 'scans.total') == 2
+    assert conn.execute('SELECT user_id, scans FROM patient_activity_daily').fetchall() == [(alice, 1)]
+    conn.execute('DELETE FROM scans WHERE id = ?', (orphan,))
+    assert stats.reconcile(conn, stats.APP_SCANS) == []
+
+
+def test_migration_9_replaces_the_triggers_of_older_files(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'database.db'))
+    for statement in BASE_SCHEMA:
+        conn.execute(statement)
+    migrate(conn, [m for m in APP_MIGRATIONS if m[0] < 9])
+    # What version 2 used to install
+    conn.execute('DROP TRIGGER stats_scans_insert')
+    conn.execute('''CREATE TRIGGER stats_scans_insert AFTER INSERT ON scans BEGIN
+        INSERT INTO patient_activity_daily (day, user_id, scans) VALUES (date(NEW.created_at), NEW.user_id, 1)
+        ON CONFLICT(day, user_id) DO UPDATE SET scans = scans + 1;
+    END''')
+    conn.commit()
+
+    assert 9 in migrate(conn, APP_MIGRATIONS)
+    add_scan(conn, None)
+    conn.commit()
+    assert stats.reconcile(conn, stats.APP_SCANS) == []
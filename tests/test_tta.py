@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import tta
+
+
+@pytest.fixture
+def image():
+    return np.arange(16 * 16 * 3, dtype=np.uint8).reshape(16, 16, 3)
+
+
+def test_variants_in_augmentation_order(image):
+    variants = tta.augment(image, shift=2)
+    assert variants.shape == (len(tta.AUGMENTATIONS),) + image.shape
+    np.testing.assert_array_equal(variants[0], image)
+    np.testing.assert_array_equal(variants[1], image[:, ::-1])
+    np.testing.assert_array_equal(variants[2][:, :-2], image[:, 2:])
+    np.testing.assert_array_equal(variants[5][2:], image[:-2])
+
+
+@pytest.mark.parametrize('shift', [0, -1, 16, 40])
+def test_shift_out_of_range_is_rejected(image, shift):
+    with pytest.raises(ValueError):
+        tta.augment(image, shift=shift)
+
+
+def test_combine_averages_each_images_variants(image):
+    outputs = np.repeat(np.eye(2, dtype=np.float32), len(tta.AUGMENTATIONS), axis=0)
+    np.testing.assert_array_equal(tta.combine(outputs), np.eye(2))
+    assert tta.augment_batch(np.stack([image, image]), shift=1).shape[0] == 2 * len(tta.AUGMENTATIONS)
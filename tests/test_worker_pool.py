@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+import pytest
+
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE
+from worker_pool import InferenceProcessPool, partition_cores
+
+# Batches of this size make the stub model hang
+HANG = 3
+
+
+class StubModel:
+    def predict(self, batch):
+        if len(batch) == HANG:
+            time.sleep(60)
+        return np.tile([0.1, 0.2, 0.3, 0.4], (len(batch), 1))
+
+
+def load_stub(path):
+    # Module level, so spawned workers can unpickle it
+    return StubModel()
+
+
+def images(count):
+    return np.zeros((count, INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=PIXEL_DTYPE)
+
+
+@pytest.fixture
+def pool():
+    pool = InferenceProcessPool('unused', processes=1, capacity=4, timeout=2.0, loader=load_stub)
+    yield pool
+    pool.close()
+
+
+def test_partition_cores_splits_evenly():
+    assert partition_cores(2, [0, 1, 2, 3, 4]) == [[0, 1, 2], [3, 4]]
+    assert partition_cores(8, [0, 1]) == [[0], [1]]
+
+
+def test_killed_worker_is_replaced(pool):
+    assert pool.predict(images(2)).shape == (2, 4)
+    dead = pool._workers[0].process
+    dead.kill()
+    dead.join()
+
+    with pytest.raises(RuntimeError, match='Inference worker 0 failed'):
+        pool.predict(images(1))
+    assert pool.replaced == 1
+    assert pool._workers[0].process.pid != dead.pid
+    assert pool.predict(images(2)).shape == (2, 4)
+
+
+def test_hung_worker_is_replaced(pool):
+    with pytest.raises(RuntimeError, match='no reply'):
+        pool.predict(images(HANG))
+    assert pool.replaced == 1
+    assert pool.predict(images(1)).shape == (1, 4)
@@ -0,0 +1,63 @@
+"""Test-time augmentation: several variants of a scan in one forward pass.
+
+``augment_batch`` turns N preprocessed uint8 images into N * K variants
+(image-major, the unmodified image first), small enough perturbations that
+the diagnosis should not change: a horizontal flip, shifts of a few pixels
+with the edge row repeated into the gap, and a darker and a brighter copy.
+The stack goes through the model as one batch and ``combine`` averages each
+image's K probability vectors, which smooths out predictions that sit on a
+class boundary.
+"""
+import numpy as np
+
+AUGMENTATIONS = ('identity', 'flip', 'shift_left', 'shift_right', 'shift_up', 'shift_down',
+                 'darker', 'brighter')
+
+
+def check_shift(shift, size):
+    """Raise ValueError unless ``shift`` pixels leave part of a ``size`` (width, height) image in view"""
+    if not 1 <= shift < min(size):
+        raise ValueError(f'TTA shift must be between 1 and {min(size) - 1} pixels, got {shift}')
+
+
+def augment(image, shift=4, jitter=0.1, out=None):
+    """(K, H, W, C) variants of one uint8 (H, W, C) image, in AUGMENTATIONS order"""
+    image = np.asarray(image)
+    check_shift(shift, image.shape[1::-1])
+    if out is None:
+        out = np.empty((len(AUGMENTATIONS),) + image.shape, dtype=image.dtype)
+    out[0] = image
+    out[1] = image[:, ::-1]
+
+    # Shifts repeat the edge row/column instead of wrapping around
+    out[2, :, :-shift] = image[:, shift:]
+    out[2, :, -shift:] = image[:, -1:]
+    out[3, :, shift:] = image[:, :-shift]
+    out[3, :, :shift] = image[:, :1]
+    out[4, :-shift] = image[shift:]
+    out[4, -shift:] = image[-1:]
+    out[5, shift:] = image[:-shift]
+    out[5, :shift] = image[:1]
+
+    pixels = image.astype(np.float32)
+    np.clip(pixels * (1.0 - jitter), 0, 255, out=pixels)
+    out[6] = pixels
+    np.clip(image.astype(np.float32) * (1.0 + jitter), 0, 255, out=pixels)
+    out[7] = pixels
+    return out
+
+
+def augment_batch(images, shift=4, jitter=0.1):
+    """(N * K, H, W, C) variants of an (N, H, W, C) batch; rows i*K .. i*K+K-1 belong to image i"""
+    images = np.asarray(images)
+    count = len(AUGMENTATIONS)
+    out = np.empty((len(images) * count,) + images.shape[1:], dtype=images.dtype)
+    for i, image in enumerate(images):
+        augment(image, shift, jitter, out=out[i * count:(i + 1) * count])
+    return out
+
+
+def combine(outputs):
+    """Average (N * K, ...) outputs of ``augment_batch`` back to one row per image"""
+    outputs = np.asarray(outputs, dtype=np.float32)
+    return outputs.reshape((-1, len(AUGMENTATIONS)) + outputs.shape[1:]).mean(axis=1)
@@ -0,0 +1,241 @@
+import atexit
+import multiprocessing as mp
+import os
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from preprocessing import INPUT_SIZE, PIXEL_DTYPE
+
+_IMAGE_SHAPE = (INPUT_SIZE[1], INPUT_SIZE[0], 3)
+
+
+def _available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(processes, cores=None):
+    """Split the cores this process may use into ``processes`` contiguous subsets"""
+    cores = cores if cores is not None else _available_cores()
+    processes = max(1, min(processes, len(cores)))
+    size, extra = divmod(len(cores), processes)
+    subsets, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        subsets.append(cores[start:end])
+        start = end
+    return subsets
+
+
+def _worker_main(path, runtime, loader, cores, intra_op_threads, inter_op_threads, shm_name, capacity, conn):
+    """Entry point of an inference worker process"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    # TensorFlow reads these when its runtime initialises, so they must be set
+    # before the loader imports it
+    intra = intra_op_threads or len(cores)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    os.environ['OMP_NUM_THREADS'] = str(intra)
+
+    from model_registry import explain, get_loader, predict_features
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    images = np.ndarray((capacity,) + _IMAGE_SHAPE, dtype=PIXEL_DTYPE, buffer=shm.buf)
+    try:
+        model = (loader or get_loader(runtime))(path)
+    except Exception as e:
+        conn.send(('error', str(e)))
+        shm.close()
+        return
+    conn.send(('ready', None))
+
+    while True:
+        message, args = conn.recv()
+        if message == 'stop':
+            break
+        try:
+            if message == 'explain':
+                count, class_indices = args
+                conn.send(('ok', np.asarray(explain(model, images[:count], class_indices))))
+            else:
+                outputs, features = predict_features(model, images[:args])
+                conn.send(('ok', (np.asarray(outputs), features)))
+        except NotImplementedError as e:
+            conn.send(('unsupported', str(e)))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+    del images
+    shm.close()
+
+
+class _Worker:
+    def __init__(self, index, cores, process, conn, shm, capacity):
+        self.index = index
+        self.cores = cores
+        self.process = process
+        self.conn = conn
+        self.shm = shm
+        self.capacity = capacity
+        self.images = np.ndarray((capacity,) + _IMAGE_SHAPE, dtype=PIXEL_DTYPE, buffer=shm.buf)
+        # Set when the process crashed or stopped answering; replaced before it is used again
+        self.failed = False
+        self.stopped = False
+
+    def stop(self, timeout=5):
+        if self.stopped:
+            return
+        self.stopped = True
+        try:
+            self.conn.send(('stop', 0))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+        del self.images
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferenceProcessPool:
+    """Runs the model in ``processes`` worker processes, each pinned to its own cores.
+
+    Every worker owns a shared-memory buffer big enough for ``capacity``
+    images. ``predict`` borrows an idle worker, copies the batch into that
+    buffer and only sends the row count over the pipe; the worker replies with
+    the (small) output array. Calls from different threads run on different
+    workers in parallel, so pair this with a BatchingEngine that has one
+    collector thread per process. ``explain`` borrows a worker the same way.
+
+    A worker that dies or gives no reply within ``timeout`` seconds fails the
+    call it was serving and is replaced by a fresh process on the same cores.
+    ``loader`` (a picklable ``path -> model`` callable) replaces the
+    runtime's registered loader in the workers.
+    """
+
+    def __init__(self, path, runtime='keras', processes=2, capacity=8,
+                 intra_op_threads=None, inter_op_threads=1, timeout=120.0, loader=None):
+        # Spawn, not fork: the parent has threads and TensorFlow is not fork-safe
+        self._ctx = mp.get_context('spawn')
+        self.path = path
+        self.runtime = runtime
+        self.loader = loader
+        self.capacity = max(1, int(capacity))
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.timeout = timeout
+        self.replaced = 0
+        self._idle = queue.Queue()
+        self._closed = False
+
+        self._workers = [self._start(index, cores) for index, cores in enumerate(partition_cores(processes))]
+        atexit.register(self.close)
+        for worker in self._workers:
+            try:
+                self._wait_ready(worker)
+            except RuntimeError:
+                self.close()
+                raise
+            self._idle.put(worker)
+
+    @property
+    def processes(self):
+        return len(self._workers)
+
+    def predict(self, batch):
+        return self.predict_features(batch)[0]
+
+    def predict_features(self, batch):
+        """(outputs, embeddings) computed by one worker; embeddings is None if the model has none"""
+        batch = np.asarray(batch, dtype=PIXEL_DTYPE)
+        if len(batch) > self.capacity:
+            parts = [self.predict_features(batch[i:i + self.capacity])
+                     for i in range(0, len(batch), self.capacity)]
+            outputs = np.concatenate([part[0] for part in parts])
+            features = None if parts[0][1] is None else np.concatenate([part[1] for part in parts])
+            return outputs, features
+
+        return self._call(batch, 'predict', len(batch))
+
+    def explain(self, batch, class_indices):
+        """Grad-CAM maps computed by one worker (see model_registry.explain)"""
+        batch = np.asarray(batch, dtype=PIXEL_DTYPE)
+        class_indices = [int(i) for i in class_indices]
+        if len(batch) > self.capacity:
+            return np.concatenate([self.explain(batch[i:i + self.capacity], class_indices[i:i + self.capacity])
+                                   for i in range(0, len(batch), self.capacity)])
+        return self._call(batch, 'explain', (len(batch), class_indices))
+
+    def _call(self, batch, message, args):
+        worker = self._idle.get()
+        try:
+            if worker.failed:
+                worker = self._replace(worker)
+            worker.images[:len(batch)] = batch
+            worker.conn.send((message, args))
+            if not worker.conn.poll(self.timeout):
+                raise TimeoutError(f'no reply within {self.timeout}s')
+            status, result = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # Never handed out again; if the replacement cannot start the next caller retries it
+            worker.failed = True
+            try:
+                worker = self._replace(worker)
+            except RuntimeError:
+                pass
+            raise RuntimeError(f'Inference worker {worker.index} failed: {e!r}') from e
+        finally:
+            self._idle.put(worker)
+        if status == 'unsupported':
+            raise NotImplementedError(result)
+        if status != 'ok':
+            raise RuntimeError(f'Inference worker error: {result}')
+        return result
+
+    def _start(self, index, cores):
+        image_bytes = int(np.prod(_IMAGE_SHAPE)) * np.dtype(PIXEL_DTYPE).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=self.capacity * image_bytes)
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name=f'inference-worker-{index}',
+                                    args=(self.path, self.runtime, self.loader, cores, self.intra_op_threads,
+                                          self.inter_op_threads, shm.name, self.capacity, child_conn),
+                                    daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(index, cores, process, parent_conn, shm, self.capacity)
+
+    def _wait_ready(self, worker):
+        try:
+            status, error = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            status, error = 'error', f'worker exited ({e!r})'
+        if status != 'ready':
+            raise RuntimeError(f'Inference worker failed to load the model: {error}')
+
+    def _replace(self, worker):
+        """Stop a failed worker and start a new one on its cores; raises RuntimeError if that one cannot load"""
+        worker.stop(timeout=1)
+        replacement = self._start(worker.index, worker.cores)
+        try:
+            self._wait_ready(replacement)
+        except RuntimeError:
+            replacement.stop(timeout=1)
+            raise
+        self._workers[worker.index] = replacement
+        self.replaced += 1
+        return replacement
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            worker.stop()